@@ -0,0 +1,93 @@
+# account.py
+
+import logging
+import threading
+import time
+
+import config
+
+
+class AccountState:
+    """
+    Local snapshot of one account's balances so position sizing never waits
+    on a REST round trip.
+
+    The snapshot is refreshed in the background every
+    config.BALANCE_REFRESH_INTERVAL seconds and marked stale after each order.
+    `balance()` only calls Kraken itself when the snapshot is older than
+    config.BALANCE_MAX_AGE (or was invalidated); concurrent callers share that
+    single refresh. If it fails, the old snapshot is still used up to
+    config.BALANCE_HARD_MAX_AGE, but never once an order has invalidated it.
+    """
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.balances = {}  # Asset -> float, e.g. {'ZUSD': 500.0}
+        self.refreshed_at = None  # time.monotonic() of the last successful refresh
+        self.refreshes = 0
+        self.failures = 0
+        self._stale = True
+        self._lock = threading.Lock()  # Serializes refreshes
+
+    def age(self):
+        """Seconds since the last successful refresh, or None if never refreshed."""
+        if self.refreshed_at is None:
+            return None
+        return time.monotonic() - self.refreshed_at
+
+    def invalidate(self):
+        """Mark the snapshot stale, e.g. after an order changed the balances."""
+        self._stale = True
+
+    def is_fresh(self, max_age=None):
+        age = self.age()
+        limit = config.BALANCE_MAX_AGE if max_age is None else max_age
+        return not self._stale and age is not None and age <= limit
+
+    def usable(self):
+        """Whether the snapshot may still size orders: not invalidated and within config.BALANCE_HARD_MAX_AGE."""
+        return self.is_fresh(config.BALANCE_HARD_MAX_AGE)
+
+    def refresh(self, max_age=0):
+        """
+        Query Balance unless the snapshot is already younger than `max_age`
+        seconds. Returns True if the snapshot is `usable()` afterwards.
+        """
+        with self._lock:
+            # Another thread may have refreshed while this one waited for the lock
+            if max_age and self.is_fresh(max_age):
+                return True
+            try:
+                response = self.client.query_private('Balance')
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"Balance refresh failed for account {self.name}: {e}")
+                return self.usable()
+            if not response or response.get('error'):
+                self.failures += 1
+                logging.error(f"Balance refresh failed for account {self.name}: {response}")
+                return self.usable()
+            self.balances = {asset: float(amount) for asset, amount in response['result'].items()}
+            self.refreshed_at = time.monotonic()
+            self._stale = False
+            self.refreshes += 1
+            return True
+
+    def balance(self, asset):
+        """Cached balance of `asset`, refreshed first if stale. None if no usable snapshot could be had."""
+        if not self.is_fresh() and not self.refresh(config.BALANCE_MAX_AGE):
+            age = self.age()
+            reason = 'never fetched' if age is None else 'stale after an order' if self._stale else f'{age:.0f}s old'
+            logging.warning(f"Account {self.name}: balance is {reason} and could not be refreshed; "
+                            f"skipping position sizing.")
+            return None
+        return self.balances.get(asset, 0.0)
+
+    def metrics(self):
+        age = self.age()
+        return {
+            'age_s': None if age is None else round(age, 1),
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+        }
@@ -0,0 +1,295 @@
+# backtest.py
+
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+import config
+import indicators
+import rules
+import strategy
+from history_store import HistoryStore
+
+# Signal codes used in the vectorized arrays
+HOLD, BUY, SELL = 0, 1, -1
+
+
+def load_ohlc(path):
+    """Load stored OHLC candles (Kraken column layout) from a CSV file."""
+    data = pd.read_csv(path)
+    if pd.api.types.is_numeric_dtype(data['timestamp']):
+        data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
+    else:
+        data['timestamp'] = pd.to_datetime(data['timestamp'])
+    return data.sort_values('timestamp').reset_index(drop=True)
+
+
+def load_pair(pair):
+    """1m, 5m and 1h candles for a REST pair from the on-disk history store (None where nothing is stored)."""
+    store = HistoryStore(config.HISTORY_DIR)
+    frames = tuple(
+        store.load(pair, interval)
+        for interval in (config.TIMEFRAME_SHORT, config.TIMEFRAME_LONG, config.TIMEFRAME_CONFIRM)
+    )
+    store.close()
+    return tuple(frame if len(frame) else None for frame in frames)
+
+
+def resample_ohlc(data, interval):
+    """Aggregate candles into `interval`-minute candles (used when a timeframe is not stored)."""
+    bucket = data['timestamp'].dt.floor(f'{interval}min')
+    grouped = data.groupby(bucket)
+    result = grouped.agg(
+        open=('open', 'first'),
+        high=('high', 'max'),
+        low=('low', 'min'),
+        close=('close', 'last'),
+        volume=('volume', 'sum'),
+        count=('count', 'sum'),
+    )
+    traded = (data['vwap'] * data['volume']).groupby(bucket).sum()
+    result['vwap'] = (traded / result['volume']).where(result['volume'] > 0, result['close'])
+    result = result.rename_axis('timestamp').reset_index()
+    return result[['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']]
+
+
+def _epoch_seconds(data):
+    return data['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+
+def align_timeframe(base_close_times, data, interval):
+    """
+    For every base bar, the index of the newest `data` candle that had already
+    closed when the base bar closed (-1 if none). Using closed candles only is
+    what keeps the backtest free of lookahead.
+    """
+    close_times = _epoch_seconds(data) + interval * 60
+    return np.searchsorted(close_times, base_close_times, side='right') - 1
+
+
+def _take(data, column, index):
+    values = data[column].to_numpy(dtype=np.float64)
+    taken = values[np.clip(index, 0, None)]
+    taken[index < 0] = np.nan
+    return taken
+
+
+def prepare_frame(data, columns=None):
+    """
+    A copy of `data` with the indicator and support/resistance columns the
+    strategy reads: `columns` and their dependencies, or all of them.
+    """
+    data = indicators.apply_technical_indicators(data.copy(), columns)
+    if columns is None or {'support', 'resistance'} & set(columns):
+        data = strategy.calculate_support_resistance(data)
+    return data
+
+
+def build_features(data_1m, data_5m, data_1h):
+    """
+    Compute indicators and support/resistance once over each full history and
+    line them up on the 1m bars as a (features, bars) matrix in
+    rules.FEATURE_NAMES order. Returns (features, valid) where `valid` marks
+    bars with enough aligned history.
+    """
+    columns = strategy.required_columns()
+    return align_features(
+        prepare_frame(data_1m, columns.get(config.TIMEFRAME_SHORT, ())),
+        prepare_frame(data_5m, columns.get(config.TIMEFRAME_LONG, ())),
+        prepare_frame(data_1h, columns.get(config.TIMEFRAME_CONFIRM, ())),
+    )
+
+
+def align_features(data_1m, data_5m, data_1h):
+    """build_features for frames that already carry their indicator and support/resistance columns."""
+    frames = {
+        config.TIMEFRAME_SHORT: data_1m,
+        config.TIMEFRAME_LONG: data_5m,
+        config.TIMEFRAME_CONFIRM: data_1h,
+    }
+    bars = len(data_1m)
+    close_times = _epoch_seconds(data_1m) + config.TIMEFRAME_SHORT * 60
+    # Row of each timeframe's newest closed candle per 1m bar; the 1m frame is its own base
+    aligned = {config.TIMEFRAME_SHORT: np.arange(bars)}
+    for interval in (config.TIMEFRAME_LONG, config.TIMEFRAME_CONFIRM):
+        aligned[interval] = align_timeframe(close_times, frames[interval], interval)
+
+    features = np.empty((len(rules.FEATURE_NAMES), bars))
+    valid = np.ones(bars, dtype=bool)
+    for row, (interval, column, back) in enumerate(rules.FEATURES.values()):
+        index = aligned[interval] - back
+        index[aligned[interval] < 0] = -1
+        features[row] = _take(frames[interval], column, index)
+        valid &= index >= 0
+    return features, valid
+
+
+def generate_signal_array(features, valid=None):
+    """
+    Evaluate every strategy rule over all bars with the compiled rule set.
+    Returns (signals, rules): signal codes (BUY/SELL/HOLD) and the index into
+    rules.active.rules of the rule that fired (-1 for none), first match wins.
+    """
+    fired = rules.active.evaluate_all(features, valid)
+    codes = np.array([BUY if signal == 'BUY' else SELL for signal in rules.active.signals] + [HOLD], dtype=np.int8)
+    return codes[fired], fired
+
+
+def _first_exit(start, stop_loss, take_profit, low, high, sells):
+    """Index of the first bar from `start` that hits the stop, the target or a SELL signal."""
+    n = len(low)
+    size = 256
+    while start < n:
+        end = min(start + size, n)
+        hit = (low[start:end] <= stop_loss) | (high[start:end] >= take_profit) | sells[start:end]
+        k = int(hit.argmax())
+        if hit[k]:
+            return start + k
+        start = end
+        size *= 2  # Long trades get scanned in growing chunks, so the total scan stays linear
+    return None
+
+
+def simulate_trades(data_1m, signals, atr, starting_balance=None, fee_percentage=None):
+    """
+    Replay the run_bot position logic over the signal array: enter LONG at the
+    bar close on BUY with the ATR stop-loss/take-profit, exit on the first bar
+    whose range reaches either level (stop first when both do) or on SELL.
+    """
+    if starting_balance is None:
+        starting_balance = config.BACKTEST_STARTING_BALANCE
+    if fee_percentage is None:
+        fee_percentage = config.BACKTEST_FEE_PERCENTAGE
+    fee_rate = fee_percentage / 100
+
+    timestamps = data_1m['timestamp'].to_numpy()
+    open_ = data_1m['open'].to_numpy(dtype=np.float64)
+    high = data_1m['high'].to_numpy(dtype=np.float64)
+    low = data_1m['low'].to_numpy(dtype=np.float64)
+    close = data_1m['close'].to_numpy(dtype=np.float64)
+    buys = np.flatnonzero(signals == BUY)
+    sells = signals == SELL
+
+    balance = starting_balance
+    trades = []
+    k = 0
+    while k < len(buys):
+        i = buys[k]
+        entry_price = close[i]
+        stop_loss_price = strategy.calculate_stop_loss(entry_price, atr[i])
+        take_profit_price = strategy.calculate_take_profit(entry_price, stop_loss_price)
+        quantity = strategy.position_size(balance, entry_price, stop_loss_price)
+        if quantity <= 0:
+            k += 1
+            continue
+
+        j = _first_exit(i + 1, stop_loss_price, take_profit_price, low, high, sells)
+        if j is None:
+            j, exit_price, reason = len(close) - 1, close[-1], 'end_of_data'
+        elif low[j] <= stop_loss_price:
+            exit_price, reason = min(open_[j], stop_loss_price), 'stop_loss'
+        elif high[j] >= take_profit_price:
+            exit_price, reason = max(open_[j], take_profit_price), 'take_profit'
+        else:
+            exit_price, reason = close[j], 'signal'
+
+        fees = (entry_price + exit_price) * quantity * fee_rate
+        pnl = (exit_price - entry_price) * quantity - fees
+        balance += pnl
+        trades.append({
+            'entry_time': timestamps[i],
+            'exit_time': timestamps[j],
+            'entry_price': entry_price,
+            'exit_price': exit_price,
+            'quantity': quantity,
+            'stop_loss': stop_loss_price,
+            'take_profit': take_profit_price,
+            'exit_reason': reason,
+            'fees': fees,
+            'pnl': pnl,
+            'balance': balance,
+        })
+        k = int(np.searchsorted(buys, j, side='right'))
+
+    return pd.DataFrame(trades, columns=[
+        'entry_time', 'exit_time', 'entry_price', 'exit_price', 'quantity', 'stop_loss',
+        'take_profit', 'exit_reason', 'fees', 'pnl', 'balance'
+    ])
+
+
+def summarize(trades, starting_balance=None):
+    """Headline statistics for a trades table."""
+    if starting_balance is None:
+        starting_balance = config.BACKTEST_STARTING_BALANCE
+    pnl = trades['pnl'].to_numpy(dtype=np.float64)
+    equity = starting_balance + np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.r_[starting_balance, equity])
+    drawdown = (peak[1:] - equity) / peak[1:] if len(equity) else np.zeros(0)
+    gains = pnl[pnl > 0].sum()
+    losses = -pnl[pnl < 0].sum()
+    return {
+        'trades': len(trades),
+        'win_rate': float((pnl > 0).mean()) if len(pnl) else 0.0,
+        'total_pnl': float(pnl.sum()),
+        'return_pct': float(pnl.sum() / starting_balance * 100),
+        'max_drawdown_pct': float(drawdown.max() * 100) if len(drawdown) else 0.0,
+        'profit_factor': float(gains / losses) if losses > 0 else float('inf') if gains > 0 else 0.0,
+    }
+
+
+def run_backtest(data_1m, data_5m=None, data_1h=None, starting_balance=None, fee_percentage=None):
+    """
+    Backtest strategy.generate_signals over stored history. Missing 5m/1h
+    frames are resampled from the 1m candles. Returns (trades, summary).
+    """
+    if data_5m is None:
+        data_5m = resample_ohlc(data_1m, config.TIMEFRAME_LONG)
+    if data_1h is None:
+        data_1h = resample_ohlc(data_1m, config.TIMEFRAME_CONFIRM)
+
+    features, valid = build_features(data_1m, data_5m, data_1h)
+    signals, fired = generate_signal_array(features, valid)
+    trades = simulate_trades(data_1m, signals, features[rules.FEATURE_INDEX['atr_1m']], starting_balance, fee_percentage)
+
+    summary = summarize(trades, starting_balance)
+    summary['bars'] = len(data_1m)
+    summary['buy_signals'] = int((signals == BUY).sum())
+    summary['sell_signals'] = int((signals == SELL).sum())
+    summary['rule_hits'] = rules.active.hit_counts(fired)
+    return trades, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized backtest of the trading strategy on stored OHLC data.")
+    parser.add_argument('data_1m', nargs='?', help="CSV of 1-minute candles")
+    parser.add_argument('--pair', help="Load candles for this REST pair from the on-disk history store instead")
+    parser.add_argument('--data-5m', help="CSV of 5-minute candles (resampled from 1m if omitted)")
+    parser.add_argument('--data-1h', help="CSV of 1-hour candles (resampled from 1m if omitted)")
+    parser.add_argument('--balance', type=float, default=config.BACKTEST_STARTING_BALANCE)
+    parser.add_argument('--fee', type=float, default=config.BACKTEST_FEE_PERCENTAGE, help="Fee percentage per fill")
+    parser.add_argument('--trades-out', help="Write the trades table to this CSV file")
+    args = parser.parse_args()
+
+    if args.pair:
+        data_1m, data_5m, data_1h = load_pair(args.pair)
+        if data_1m is None:
+            parser.error(f"no 1-minute history stored for {args.pair}")
+    elif args.data_1m:
+        data_1m = load_ohlc(args.data_1m)
+        data_5m = load_ohlc(args.data_5m) if args.data_5m else None
+        data_1h = load_ohlc(args.data_1h) if args.data_1h else None
+    else:
+        parser.error("either a 1-minute CSV or --pair is required")
+
+    trades, summary = run_backtest(data_1m, data_5m, data_1h, args.balance, args.fee)
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    if args.trades_out:
+        trades.to_csv(args.trades_out, index=False)
+        logging.info(f"Wrote {len(trades)} trades to {args.trades_out}")
+
+
+if __name__ == '__main__':
+    main()
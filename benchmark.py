@@ -0,0 +1,329 @@
+# benchmark.py
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import config
+
+# Metrics where a higher number is better; everything else (latencies, memory) is lower-is-better
+HIGHER_IS_BETTER = ('messages_per_s',)
+
+
+def synthetic_candles(n, interval, end=None, seed=0):
+    """Random-walk OHLC candles in the Kraken REST layout, ending at `end` (epoch seconds)."""
+    rng = np.random.default_rng(seed)
+    step = interval * 60
+    end = int(end if end is not None else time.time())
+    timestamps = end - end % step - step * np.arange(n)[::-1]
+    close = 30000 + np.cumsum(rng.normal(0, 15 * np.sqrt(interval), n))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) + rng.random(n) * 8
+    low = np.minimum(open_, close) - rng.random(n) * 8
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(timestamps, unit='s'),
+        'open': open_, 'high': high, 'low': low, 'close': close,
+        'vwap': (high + low + close) / 3,
+        'volume': rng.random(n) * 5,
+        'count': rng.integers(1, 100, n).astype(float),
+    })
+
+
+def synthetic_feed(pairs, minutes, updates_per_minute, start, seed=0):
+    """
+    Kraken v1 WebSocket frames: `updates_per_minute` revisions of each pair's
+    1m candle per minute, interleaved across pairs, with a heartbeat per minute.
+    """
+    rng = np.random.default_rng(seed)
+    price = {pair: 30000.0 for pair in pairs}
+    for minute in range(minutes):
+        begin = start + minute * 60
+        candle = {pair: None for pair in pairs}
+        for update in range(updates_per_minute):
+            for channel_id, pair in enumerate(pairs):
+                price[pair] += rng.normal(0, 3)
+                p = price[pair]
+                if candle[pair] is None:
+                    candle[pair] = [p, p, p, 0.0, 0]
+                c = candle[pair]
+                c[1] = max(c[1], p)
+                c[2] = min(c[2], p)
+                c[3] += rng.random() * 0.1
+                c[4] += 1
+                yield json.dumps([channel_id, [
+                    f"{begin + update:.6f}", f"{begin + 60:.6f}",
+                    f"{c[0]:.5f}", f"{c[1]:.5f}", f"{c[2]:.5f}", f"{p:.5f}", f"{p:.5f}", f"{c[3]:.8f}", c[4]
+                ], "ohlc-1", pair])
+        yield '{"event":"heartbeat"}'
+
+
+class StubClient:
+    """Offline stand-in for krakenex.API: synthetic history, a fixed balance, accepted orders."""
+
+    def __init__(self, end, seed=0):
+        self.end = end
+        self.seed = seed
+        self.orders = 0
+
+    def query_public(self, method, data=None):
+        if method != 'OHLC':
+            return {'error': [], 'result': {}}
+        interval = data['interval']
+        candles = synthetic_candles(max(config.REQUIRED_DATA_LENGTH + 1, 720), interval, self.end, self.seed + interval)
+        rows = candles.assign(timestamp=candles['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)).values.tolist()
+        return {'error': [], 'result': {data['pair']: rows, 'last': self.end}}
+
+    def query_private(self, method, data=None):
+        if method == 'AddOrder':
+            self.orders += 1
+            return {'error': [], 'result': {'txid': [f'STUB-{self.orders}']}}
+        if method == 'Balance':
+            return {'error': [], 'result': {'ZUSD': '10000.0'}}
+        return {'error': [], 'result': {}}
+
+
+def _time_call(func, repeat):
+    """Median wall time of `func()` in microseconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func()
+        durations.append((time.perf_counter_ns() - start) / 1000)
+    return statistics.median(durations)
+
+
+def run_micro(history_lengths, pair_counts, repeat):
+    """
+    Per-call timings of the indicator, support/resistance and signal hot
+    paths, with the configured indicator backend next to `ta` and its
+    largest deviation from it.
+    """
+    import indicators
+    import strategy
+
+    results = {}
+    for length in history_lengths:
+        frames = {interval: synthetic_candles(length, interval, seed=interval) for interval in (1, 5, 60)}
+        with_indicators = {i: indicators.apply_technical_indicators(f.copy()) for i, f in frames.items()}
+        results[f'apply_technical_indicators_us[{length}]'] = _time_call(
+            lambda: indicators.apply_technical_indicators(frames[5].copy()), repeat)
+        results[f'indicator_column_ta_us[{length}]'] = _time_call(
+            lambda: [indicators.indicator_column(frames[5], name, 'ta') for name in indicators.INDICATOR_COLUMNS], repeat)
+        results[f'indicator_kernel_error_ppb[{length}]'] = max(indicators.compare_backends(frames[5]).values()) * 1e9
+        results[f'calculate_support_resistance_us[{length}]'] = _time_call(
+            lambda: strategy.calculate_support_resistance(frames[5].copy()), repeat)
+        results[f'generate_signals_us[{length}]'] = _time_call(
+            lambda: strategy.generate_signals(with_indicators[1].copy(), with_indicators[5].copy(), with_indicators[60].copy()),
+            repeat)
+        for pairs in pair_counts:
+            # A full per-tick recompute for every pair, which is what N pairs cost per 1m round
+            def all_pairs():
+                for _ in range(pairs):
+                    for frame in frames.values():
+                        indicators.apply_technical_indicators(frame.copy())
+            results[f'recompute_all_pairs_us[{length}x{pairs}]'] = _time_call(all_pairs, max(1, repeat // 5))
+            # The same recompute as one batched kernel call over every pair and timeframe
+            batch = [frame for _ in range(pairs) for frame in frames.values()]
+            results[f'recompute_all_pairs_batched_us[{length}x{pairs}]'] = _time_call(
+                lambda: indicators.batch_indicators(batch), max(1, repeat // 5))
+    return results
+
+
+def _json_parse(message):
+    """The frame parse handle_socket_message used before FrameDecoder: a full JSON parse of every frame."""
+    msg = json.loads(message)
+    if isinstance(msg, list) and msg[-2].startswith('ohlc'):
+        ohlc = msg[1]
+        interval = int(msg[-2].split('-')[1])
+        return (float(ohlc[1]) - interval * 60, *map(float, ohlc[2:9]))
+    return msg
+
+
+def run_parse(pairs, minutes, updates_per_minute, repeat):
+    """Per-frame cost of the previous JSON parse and of FrameDecoder (with each JSON backend) on a synthetic feed."""
+    import frame_decoder
+
+    frames = list(synthetic_feed([f'B{i:02d}/USD' for i in range(pairs)], minutes, updates_per_minute, 0))
+    decoder = frame_decoder.FrameDecoder([1])
+    backends = {'json': json.loads}
+    if frame_decoder.orjson is not None:
+        backends['orjson'] = frame_decoder.orjson.loads
+
+    def per_frame(func):
+        return _time_call(lambda: [func(frame) for frame in frames], repeat) / len(frames)
+
+    results = {'parse_json_us': per_frame(_json_parse)}
+    for name, loads in backends.items():
+        frame_decoder.loads = loads
+        results[f'parse_decoder_{name}_us'] = per_frame(decoder.decode)
+    frame_decoder.loads = backends[frame_decoder.JSON_BACKEND]
+    return results
+
+
+def run_paper(events, repeat):
+    """Per-event cost of the paper exchange replaying 1m candles, idle and with resting exit orders."""
+    from paper_exchange import PaperExchange
+
+    candles = synthetic_candles(events, 1, end=1_700_000_000, seed=1)
+    candles['timestamp'] = candles['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    rows = list(candles.itertuples(index=False, name=None))
+    pair = 'XXBT' + config.QUOTE_ASSET
+
+    def replay(resting):
+        paper = PaperExchange(balances={config.QUOTE_ASSET: 1e9, 'XXBT': 1.0}, latency=0)
+        if resting:
+            # Far from the price, so they rest for the whole replay and every event checks them
+            for ordertype, price in (('stop-loss', 1.0), ('take-profit', 1e9)):
+                paper.query_private('AddOrder', {'pair': pair, 'type': 'sell', 'ordertype': ordertype,
+                                                 'volume': 0.5, 'price': price})
+        for row in rows:
+            paper.on_candle(pair, row)
+
+    return {
+        'paper_event_idle_us': _time_call(lambda: replay(False), repeat) / events,
+        'paper_event_resting_us': _time_call(lambda: replay(True), repeat) / events,
+    }
+
+
+def run_feed(pairs, minutes, updates_per_minute, rate, replay=None, record=None):
+    """
+    Replay Kraken frames through trading_bot.handle_socket_message with a stub
+    client and report throughput, per-stage latency and peak memory.
+    """
+    config.PAIRS = {f'B{i:02d}/USD': {'rest': f'B{i:02d}USD', 'account': 'default'} for i in range(pairs)}
+    config.PAPER_TRADING = True
+    config.HISTORY_CACHE_ENABLED = False
+    config.STATS_PORT = None
+    config.STATE_DIR = None
+    config.LOG_FILE = os.devnull  # Keep the log writer running, so its cost is measured
+    config.AUDIT_FILE = None
+
+    import latency
+    import trading_bot
+
+    end = int(time.time())
+    start = end - end % 60
+    stub = StubClient(end)
+    for paper in trading_bot.clients.values():
+        paper.public = stub  # History comes from the stub; orders fill on the paper simulator
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if not trading_bot.fetch_historical_data():
+            raise RuntimeError("stub history did not load")
+
+    if replay:
+        with open(replay) as f:
+            frames = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        frames = list(synthetic_feed(list(trading_bot.instruments), minutes, updates_per_minute, start))
+    if record:
+        with open(record, 'w') as f:
+            f.write('\n'.join(frames) + '\n')
+
+    latency.recorder.reset()
+    interval = 1.0 / rate if rate else 0.0
+    begin = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for i, frame in enumerate(frames):
+            if interval:
+                delay = begin + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            trading_bot.handle_socket_message(frame, time.perf_counter_ns())
+        received = time.perf_counter() - begin
+        # Let the evaluation pool finish what the burst queued
+        while trading_bot.evaluator.metrics()['queue_depth'] > 0:
+            time.sleep(0.005)
+        trading_bot.evaluator.shutdown()
+        drained = time.perf_counter() - begin
+
+    results = {
+        'messages': len(frames),
+        'messages_per_s': len(frames) / received,
+        'drain_s': drained,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    for stage, stats in latency.recorder.stats().items():
+        results[f'{stage}_p50_us'] = stats['p50_us']
+        results[f'{stage}_p99_us'] = stats['p99_us']
+    results.update({f'evaluator_{k}': v for k, v in trading_bot.evaluator.metrics().items()})
+    for name, paper in trading_bot.clients.items():
+        metrics = paper.metrics()
+        results.update({f'paper_{name}_fills': metrics['fills'], f'paper_{name}_pnl': metrics['pnl']})
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Metrics that got worse than the baseline by more than `tolerance` (fraction)."""
+    regressions = []
+    for name, base in baseline.items():
+        value = results.get(name)
+        if not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+            continue
+        if not name.endswith(('_us', '_mb', '_s')):
+            continue  # Counters such as evaluator_* are informational
+        change = (value - base) / abs(base)
+        worse = -change if name in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append((name, base, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the feed-to-signal hot paths.")
+    parser.add_argument('--pairs', type=int, default=10, help="Pairs in the replayed feed")
+    parser.add_argument('--minutes', type=int, default=30, help="Minutes of synthetic feed")
+    parser.add_argument('--updates', type=int, default=20, help="1m candle updates per pair per minute")
+    parser.add_argument('--rate', type=float, default=0, help="Messages per second (0 = as fast as possible)")
+    parser.add_argument('--replay', help="Replay recorded frames (one JSON frame per line) instead of synthetic ones")
+    parser.add_argument('--record', help="Save the replayed frames to this file")
+    parser.add_argument('--history', default='500,2000,10000', help="History lengths for the microbenchmarks")
+    parser.add_argument('--micro-pairs', default='1,10,50', help="Pair counts for the recompute microbenchmark")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-feed', action='store_true')
+    parser.add_argument('--save-baseline', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON to compare against; exits 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = {}
+    if not args.skip_micro:
+        results.update(run_micro(
+            [int(n) for n in args.history.split(',')],
+            [int(n) for n in args.micro_pairs.split(',')],
+            args.repeat,
+        ))
+        results.update(run_parse(args.pairs, args.minutes, args.updates, max(1, args.repeat // 5)))
+        results.update(run_paper(100_000, max(1, args.repeat // 5)))
+    if not args.skip_feed:
+        results.update(run_feed(args.pairs, args.minutes, args.updates, args.rate, args.replay, args.record))
+
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value:,.1f}" if isinstance(value, float) else f"{name:<{width}}  {value}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, base, value, change in regressions:
+            print(f"REGRESSION {name}: {base:,.1f} -> {value:,.1f} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
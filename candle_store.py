@@ -0,0 +1,201 @@
+# candle_store.py
+
+import numpy as np
+import pandas as pd
+
+# Kraken OHLC field order (REST and WebSocket agree on this, minus the WebSocket etime)
+CANDLE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
+
+
+class CandleBuffer:
+    """
+    Fixed-capacity candle ring buffer backed by NumPy arrays.
+
+    Every row is written twice, at slot i and slot i + capacity, so the most
+    recent `capacity` rows always form one contiguous slice. That lets
+    `column()` and `to_frame()` hand out zero-copy views while appends and
+    open-candle updates stay O(1) regardless of history length.
+
+    Timestamps are stored as epoch seconds of the candle *start* time, which is
+    what Kraken's REST OHLC endpoint returns. They are always float64; the
+    other columns use `dtype`, so float32 halves the memory of long histories
+    at about seven significant digits per value.
+
+    `buffer` can supply the storage (at least `storage_size()` bytes, e.g. a
+    slice of shared memory); it is cleared to NaN unless `clear` is False.
+    """
+
+    def __init__(self, capacity, interval, columns=CANDLE_COLUMNS, dtype=np.float64, buffer=None, clear=True):
+        if columns[0] != 'timestamp':
+            raise ValueError("the first CandleBuffer column must be 'timestamp'")
+        self.capacity = capacity
+        self.interval = interval  # Candle length in minutes
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        if buffer is None:
+            buffer = bytearray(self.storage_size(capacity, self.columns, self.dtype))
+        self._time = np.ndarray(2 * capacity, np.float64, buffer, 0)
+        self._data = np.ndarray((len(self.columns) - 1, 2 * capacity), self.dtype, buffer, 16 * capacity)
+        if clear:
+            self._time[:] = np.nan
+            self._data[:] = np.nan
+        # 1-D view of every column, for single-column reads and writes
+        self._rows = {'timestamp': self._time}
+        self._rows.update({name: self._data[i] for i, name in enumerate(self.columns[1:])})
+        self._head = 0  # Next slot to write, always in [0, capacity)
+        self._size = 0
+        self.version = 0  # Bumped on every append/update so readers can detect changes
+
+    @staticmethod
+    def storage_size(capacity, columns, dtype=np.float64):
+        """Bytes of storage for a buffer of this shape."""
+        return 16 * capacity + (len(columns) - 1) * 2 * capacity * np.dtype(dtype).itemsize
+
+    @property
+    def nbytes(self):
+        return self._time.nbytes + self._data.nbytes
+
+    def __len__(self):
+        return self._size
+
+    def cursor(self):
+        """(head, size, version): the state that, with the storage, fully describes the buffer."""
+        return self._head, self._size, self.version
+
+    def set_cursor(self, head, size, version):
+        """Adopt a cursor published by the process that writes the shared storage."""
+        self._head, self._size, self.version = int(head), int(size), int(version)
+
+    @property
+    def last_timestamp(self):
+        """Start time (epoch seconds) of the newest candle, or None when empty."""
+        if self._size == 0:
+            return None
+        return float(self._time[self._head - 1 + self.capacity])
+
+    def _window(self):
+        end = self._head + self.capacity
+        return end - self._size, end
+
+    def _write(self, slot, values):
+        n = len(values)
+        data = self._data
+        self._time[slot] = self._time[slot + self.capacity] = values[0]
+        data[:n - 1, slot] = values[1:]
+        if n < len(self.columns):
+            data[n - 1:, slot] = np.nan
+        data[:, slot + self.capacity] = data[:, slot]
+
+    def append(self, values):
+        """Append a new candle. `values` follows `columns` order; missing trailing columns become NaN."""
+        self._write(self._head, values)
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+        self.version += 1
+
+    def update_last(self, values):
+        """Overwrite the newest (still open) candle in place."""
+        if self._size == 0:
+            raise IndexError("update_last on an empty CandleBuffer")
+        self._write((self._head - 1) % self.capacity, values)
+        self.version += 1
+
+    def upsert(self, values):
+        """
+        Append or update depending on the candle start time in values[0].
+        Returns True if a new candle was started, False if the open one was
+        updated, and None if the candle is older than the newest one (ignored).
+        """
+        last = self.last_timestamp
+        timestamp = values[0]
+        if last is None or timestamp > last:
+            self.append(values)
+            return True
+        if timestamp == last:
+            self.update_last(values)
+            return False
+        return None
+
+    def set_last(self, name, value, offset=1):
+        """Set a single column of the candle `offset` rows from the end (1 = newest), e.g. a derived indicator value."""
+        slot = (self._head - offset) % self.capacity
+        row = self._rows[name]
+        row[slot] = row[slot + self.capacity] = value
+
+    def set_column(self, name, values):
+        """Overwrite a whole column (oldest to newest); `values` must match the buffer length."""
+        start, end = self._window()
+        row = self._rows[name]
+        row[start:end] = values
+        # Mirror whichever part of the window lives in each half into the other half
+        if start < self.capacity:
+            split = min(end, self.capacity)
+            row[start + self.capacity:split + self.capacity] = row[start:split]
+        if end > self.capacity:
+            split = max(start, self.capacity)
+            row[split - self.capacity:end - self.capacity] = row[split:end]
+
+    def column(self, name):
+        """Zero-copy view of a column, oldest to newest."""
+        start, end = self._window()
+        return self._rows[name][start:end]
+
+    def last(self, name, offset=1):
+        """Value of a column `offset` rows from the end (1 = newest)."""
+        return self._rows[name][self._head - offset + self.capacity]
+
+    def load_frame(self, frame):
+        """Replace the contents with the newest `capacity` rows of a DataFrame holding `CANDLE_COLUMNS`."""
+        frame = frame.tail(self.capacity)
+        n = len(frame)
+        self._time[:] = np.nan
+        self._data[:] = np.nan
+        for name in self.columns:
+            if name not in frame.columns:
+                continue
+            values = frame[name]
+            if name == 'timestamp' and pd.api.types.is_datetime64_any_dtype(values):
+                values = values.to_numpy(dtype='datetime64[s]').astype(np.int64)
+            row = self._rows[name]
+            row[:n] = np.asarray(values, dtype=row.dtype)
+            row[self.capacity:self.capacity + n] = row[:n]
+        self._head = n % self.capacity
+        self._size = n
+        self.version += 1
+
+    def rows(self):
+        """Copies of the buffered timestamps and of the other columns (columns x candles), oldest first."""
+        start, end = self._window()
+        return self._time[start:end].copy(), self._data[:, start:end].copy()
+
+    def load_rows(self, times, data):
+        """Replace the contents with the arrays `rows()` returned for a buffer with the same columns."""
+        n = min(len(times), self.capacity)
+        self._time[:] = np.nan
+        self._data[:] = np.nan
+        if n:
+            self._time[:n] = self._time[self.capacity:self.capacity + n] = times[-n:]
+            self._data[:, :n] = self._data[:, self.capacity:self.capacity + n] = data[:, -n:]
+        self._head = n % self.capacity
+        self._size = n
+        self.version += 1
+
+    def to_frame(self, copy=False, tail=None):
+        """
+        DataFrame over the buffered candles (only the newest `tail` if given).
+        Numeric columns are zero-copy views unless `copy=True`; `timestamp`
+        is converted to datetime.
+        """
+        start, end = self._window()
+        if tail is not None:
+            start = max(start, end - tail)
+        frame = {}
+        for name, row in self._rows.items():
+            values = row[start:end]
+            if name == 'timestamp':
+                values = pd.to_datetime(values, unit='s')
+            elif copy:
+                values = values.copy()
+            frame[name] = values
+        return pd.DataFrame(frame, copy=False)
@@ -5,20 +5,114 @@ API_SECRET = ''
 
 PAPER_TRADING = True  # Set to False to enable live trading
 
+# Exchange connectivity
+WEBSOCKET_URL = 'wss://ws.kraken.com/'
+REST_URL = 'https://api.kraken.com'
+RECONNECT_BASE_DELAY = 1  # Seconds; reconnect backoff doubles from here with full jitter
+RECONNECT_MAX_DELAY = 60  # Upper bound on the reconnect backoff (seconds)
+REST_TIMEOUT = 30  # Seconds to wait for a REST call routed through the gateway
+REST_POOL_SIZE = 16  # Keep-alive HTTP connections pooled per Kraken client
+REST_RATE_LIMIT = 15  # Kraken REST counter ceiling (Starter 15, Intermediate/Pro 20)
+REST_RATE_DECAY = 0.33  # Counter decay per second (Starter 0.33, Intermediate 0.5, Pro 1)
+PUBLIC_RATE_LIMIT = 5  # Burst of public calls (OHLC backfills) before pacing kicks in
+PUBLIC_RATE_DECAY = 1  # Public calls per second once the burst is used up
+
+# Account state
+QUOTE_ASSET = 'ZUSD'  # Balance used for position sizing
+BALANCE_REFRESH_INTERVAL = 15  # Seconds between background Balance refreshes
+BALANCE_MAX_AGE = 60  # Sizing refreshes the balance itself if the cached one is older than this
+BALANCE_HARD_MAX_AGE = 300  # If that refresh fails, an older (or post-fill) balance is not used and no entry is sized
+
+# Paper trading: orders fill on a local simulator (paper_exchange.py) fed by the live market data
+PAPER_BALANCES = {'ZUSD': 500.0}  # Starting balances per asset
+PAPER_LATENCY = 0.1  # Seconds between placing an order and the simulated exchange seeing it
+PAPER_SLIPPAGE_BPS = 2  # Market and triggered orders fill this much worse than the price when no book is attached
+# (30-day volume in the quote asset, maker %, taker %), Kraken's spot schedule
+PAPER_FEE_SCHEDULE = [
+    (0, 0.16, 0.26), (50_000, 0.14, 0.24), (100_000, 0.12, 0.22), (250_000, 0.10, 0.20), (500_000, 0.08, 0.18),
+    (1_000_000, 0.06, 0.16), (2_500_000, 0.04, 0.14), (5_000_000, 0.02, 0.12), (10_000_000, 0.00, 0.10),
+]
+PAPER_HISTORY_SIZE = 10000  # Closed orders and trades the simulator keeps for QueryOrders / TradesHistory
+
+# Accounts: name -> API credentials
+ACCOUNTS = {
+    'default': {'key': API_KEY, 'secret': API_SECRET},
+}
+
 # Trading parameters
 SYMBOL = 'XBT/USD'  # Use Kraken's trading pair notation for Bitcoin/USD
 REST_SYMBOL = 'XXBTZUSD'
+# Pairs traded by this process: WebSocket pair -> REST pair and the account that trades it
+PAIRS = {
+    SYMBOL: {'rest': REST_SYMBOL, 'account': 'default'},
+}
+EVALUATION_WORKERS = 8  # Threads evaluating the strategy across pairs
 TRADE_QUANTITY_PERCENTAGE = 10  # Percentage of capital to use per trade
 RISK_PER_TRADE_PERCENTAGE = 1   # Percentage of capital to risk per trade
 REQUIRED_DATA_LENGTH = 500 # This is for indicator requirements, making sure we have enough data frames
+CANDLE_DTYPE = 'float64'  # 'float32' halves candle/indicator memory for long histories (timestamps stay float64)
+SNAPSHOT_ROWS = 50  # Newest candles per timeframe copied for each strategy evaluation
+LAZY_FEATURES = True  # Track only the indicator/level columns the strategy reads, computed when read (False: all, every tick)
+HISTORY_CACHE_ENABLED = True  # Keep closed candles on disk and only fetch the gap on startup
+HISTORY_DIR = 'history'  # Directory for the on-disk candle store
+BACKFILL_WORKERS = 2  # Threads fetching candles missed by the WebSocket
+BACKFILL_RETRIES = 3  # REST attempts per backfill before accepting the gap
+BACKFILL_RETRY_DELAY = 2  # Seconds before the first retry, growing linearly
+
+# Logging
+LOG_FILE = 'trading_bot.log'
+LOG_FORMAT = 'json'  # 'json' (one object per line) or 'text'
+LOG_LEVEL = 'INFO'  # 'DEBUG' adds per-candle events
+LOG_QUEUE_SIZE = 10000  # Events waiting for the writer thread; beyond this they are dropped and counted
+LOG_FLUSH_INTERVAL = 0.1  # Seconds between writer thread flushes
+LOG_SAMPLE_RATES = {'evaluation': 100, 'candle': 100}  # Write 1 in N of these events (0 = none); others are all written
+AUDIT_FILE = 'trades.jsonl'  # Every fill and the decision behind it, never sampled (None to disable)
+
+# Latency instrumentation
+LATENCY_ENABLED = True  # Record per-stage timing spans
+LATENCY_WINDOW = 2048  # Samples kept per stage for the rolling p50/p99
+STATS_LOG_INTERVAL = 60  # Seconds between latency / evaluator metrics log lines
+STATS_PORT = None  # e.g. 8765 to serve the stats as JSON on 127.0.0.1
+PROFILER_ENABLED = False  # Sample thread stacks to find hot spots
+PROFILER_INTERVAL = 0.005  # Seconds between profiler samples
+
+# Shared-memory market data bus (run strategy variants with `python market_bus.py --rules <file>`)
+BUS_NAME = None  # e.g. 'kraken-bus' to publish candles and indicators to other processes
+BUS_POLL_INTERVAL = 0.001  # Seconds between subscriber checks for new updates
+BUS_READ_RETRIES = 3  # Zero-copy read attempts before a subscriber reads from a private copy instead
 
 # Stop-loss and take-profit settings
 RISK_REWARD_RATIO = 2  # Desired risk-reward ratio
 
+# Tick data and order book
+SUBSCRIBE_TRADES = False  # Stream trade prints so exits are checked on every trade, not every candle update
+BOOK_DEPTH = 0  # Levels per side of the L2 book used for entry pricing (Kraken: 10, 25, 100, 500, 1000; 0 = off)
+SLIPPAGE_BPS = 0  # Allowance added to the expected fill price (basis points)
+
+# Order management
+STATE_DIR = 'state'  # Positions, fill journals and candle/indicator snapshots per pair, restored on restart
+ORDER_STATE_FILLS = 100  # Recent fills kept in each pair's state file
+SNAPSHOT_INTERVAL = 60  # Seconds between snapshots of each pair's candles and indicator state in STATE_DIR (0 disables)
+SNAPSHOT_MAX_AGE = 6 * 3600  # Older snapshots are not restored; history is fetched instead
+RECONCILE_TOLERANCE = 0.01  # Fraction of a position the exchange balance may lack (fees, rounding) before it counts as gone
+ORDER_LOOKUP_ATTEMPTS = 3  # Lookups by userref before an order whose outcome is unknown (e.g. timed out) counts as not placed
+ORDER_LOOKUP_DELAY = 2  # Seconds between those lookups
+FILL_POLL_ATTEMPTS = 20  # QueryOrders checks for a market order's fill before booking the expected price instead
+FILL_POLL_INTERVAL = 0.25  # Seconds between those checks
+ORDER_WORKERS = 2  # Threads placing exits triggered by the price feed
+NATIVE_EXIT_ORDERS = False  # Also place stop-loss / take-profit orders on Kraken (or the paper simulator)
+NATIVE_EXIT_GRACE = 10  # Seconds a crossed level waits for the native order before selling at market
+NATIVE_EXIT_POLL_INTERVAL = 2  # Seconds between order status checks while waiting
+EXIT_RETRY_MAX_DELAY = 60  # Cap on the backoff between failed exit attempts (doubles from NATIVE_EXIT_POLL_INTERVAL)
+PRICE_DECIMALS = 1  # Price precision for native orders (XBT/USD trades in 0.1)
+
 # Timeframes
 TIMEFRAME_SHORT = 1
 TIMEFRAME_LONG = 5
 TIMEFRAME_CONFIRM = 60
+# Every timeframe kept per pair; the first one is the base feed. Extra entries are tracked for analysis.
+TIMEFRAMES = [TIMEFRAME_SHORT, TIMEFRAME_LONG, TIMEFRAME_CONFIRM]
+RESAMPLE_FROM_BASE = True  # Build the higher timeframes from the base feed instead of subscribing to each
 
 # Technical indicator settings
 EMA_9_WINDOW = 9
@@ -31,8 +125,24 @@ MACD_FAST = 12
 MACD_SLOW = 26
 MACD_SIGNAL = 9
 S_R_BUFFER = 0.0011 # 0.011% buffer for S/R levels
+SUPPORT_RESISTANCE_WINDOW = 50  # Candles in the rolling support / resistance range
+SUPPORT_RESISTANCE_EXTRA_WINDOWS = []  # More windows tracked live as support_<w> / resistance_<w>, e.g. [20, 200]
+PIVOT_STRENGTH = 3  # Candles each side of a swing high/low for pivot levels (0 disables)
 VOLUME_SPIKE_BUFFER = 1.2 
+VOLUME_MA_WINDOW = 20
+RULES_FILE = None  # JSON file of signal rules to use instead of the built-in set in rules.py
+INDICATOR_BACKEND = 'auto'  # Batch indicator math: 'numpy', 'numba' (if installed), 'ta' (the library) or 'auto' (numba, else numpy)
+INDICATOR_WORKERS = None  # Threads a batched indicator call splits its series across (None = one per CPU)
 
 # ATR settings
 ATR_WINDOW = 7
 ATR_MULTIPLIER = 1.5
+
+# Backtest settings
+BACKTEST_STARTING_BALANCE = 500  # Quote currency (USD) balance at the start of a backtest
+BACKTEST_FEE_PERCENTAGE = 0.26  # Charged on both entry and exit (Kraken taker fee)
+
+# Parameter optimizer settings
+OPTIMIZER_WORKERS = None  # Worker processes (None = one per CPU)
+OPTIMIZER_FOLDS = 4  # Walk-forward test chunks
+OPTIMIZER_CACHE_SIZE = 256  # Indicator columns cached per worker
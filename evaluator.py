@@ -0,0 +1,81 @@
+# evaluator.py
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CoalescingEvaluator:
+    """
+    Runs `callback(key)` on a pool of worker threads so the WebSocket reader
+    never waits on strategy evaluation.
+
+    `submit(key)` only flags that new data arrived for that key (a trading
+    pair). Each key is evaluated by at most one worker at a time; submits that
+    arrive while it is queued or running collapse into a single follow-up run,
+    which then sees the latest state. Those merged requests are counted as
+    coalesced. Different keys are evaluated in parallel.
+    """
+
+    def __init__(self, callback, workers=1, name='evaluator'):
+        self._callback = callback
+        self._name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> submits received since its worker last picked up work
+        self._active = set()  # Keys queued on or running in the pool
+
+        # Metrics
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.submitted = 0
+        self.evaluated = 0
+        self.coalesced = 0
+
+    def submit(self, key=None):
+        """Request an evaluation of `key` on its latest state. Never blocks on the callback."""
+        with self._lock:
+            self.submitted += 1
+            depth = self._pending.get(key, 0)
+            if depth > 0:
+                self.coalesced += 1
+            self._pending[key] = depth + 1
+            self.queue_depth += 1
+            if self.queue_depth > self.max_queue_depth:
+                self.max_queue_depth = self.queue_depth
+            if key in self._active:
+                return
+            self._active.add(key)
+        self._executor.submit(self._drain, key)
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and optionally wait for running evaluations."""
+        self._executor.shutdown(wait=wait)
+
+    def metrics(self):
+        """Snapshot of the queue depth and evaluation counters."""
+        with self._lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted,
+                'evaluated': self.evaluated,
+                'coalesced': self.coalesced,
+            }
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                depth = self._pending.pop(key, 0)
+                if depth == 0:
+                    self._active.discard(key)
+                    return
+                self.queue_depth -= depth
+
+            try:
+                self._callback(key)
+            except Exception as e:
+                logging.error(f"Error in {self._name} for {key}: {e}")
+
+            with self._lock:
+                self.evaluated += 1
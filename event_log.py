@@ -0,0 +1,190 @@
+# event_log.py
+
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import config
+
+def _clean(value):
+    """JSON-safe copy of an event field: NumPy scalars become Python numbers, NaN / inf become null."""
+    if isinstance(value, dict):
+        return {key: _clean(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(item) for item in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class _QueueHandler(logging.Handler):
+    """Hands stdlib log records to the EventLog writer instead of formatting and writing them in place."""
+
+    def __init__(self, log):
+        super().__init__()
+        self._log = log
+
+    def emit(self, record):
+        self._log._put(record)
+
+
+class EventLog:
+    """
+    Asynchronous structured log.
+
+    Hot paths call `emit(event, **fields)`: a level check, an optional 1-in-N
+    sample (config.LOG_SAMPLE_RATES) and a deque append, with no lock or
+    wake-up. A single writer thread drains the deque every
+    config.LOG_FLUSH_INTERVAL seconds, so no string formatting or file I/O
+    happens on the feed or evaluation threads. Beyond config.LOG_QUEUE_SIZE
+    waiting events, new ones are dropped and counted rather than buffered.
+
+    Stdlib `logging` records go through the same queue and file once
+    `start()` has run, so the log stays in order.
+
+    `audit(event, **fields)` is for trades and the decisions behind them:
+    never sampled or dropped, and also appended to config.AUDIT_FILE.
+
+    Lines are JSON objects ('json' format) or the classic
+    'time:LEVEL:message' layout with the fields as JSON ('text' format).
+    Until `start()` is called, events are discarded.
+    """
+
+    def __init__(self):
+        self.level = logging.INFO
+        self.sample_rates = dict(config.LOG_SAMPLE_RATES)
+        self.format = 'json'
+        self.running = False
+        self.written = 0
+        self.dropped = 0  # Events lost to a full queue
+        self._counts = {}  # Events seen per name, for sampling
+        self._pending = deque()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._file = None
+        self._audit_file = None
+        self._formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(message)s')
+
+    def start(self, path, audit_path=None, level='INFO', fmt='json'):
+        """Open the log files, route stdlib logging here and start the writer thread."""
+        if self.running:
+            self.stop()
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self.format = fmt
+        self._file = open(path, 'a', buffering=1 << 16)
+        self._audit_file = open(audit_path, 'a') if audit_path else None
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, _QueueHandler):
+                root.removeHandler(handler)
+        root.addHandler(_QueueHandler(self))
+        root.setLevel(self.level)
+        self._stopping.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write everything queued, then close the files."""
+        if not self.running:
+            return
+        self.running = False
+        self._stopping.set()
+        self._thread.join()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, _QueueHandler):
+                root.removeHandler(handler)
+        self._file.close()
+        if self._audit_file is not None:
+            self._audit_file.close()
+
+    # Producers
+
+    def emit(self, event, level=logging.INFO, **fields):
+        """Queue a structured event, subject to the level and the event's sample rate."""
+        if level < self.level or not self.running:
+            return
+        rate = self.sample_rates.get(event)
+        if rate is not None:
+            if rate <= 0:
+                return
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1  # Unlocked: a rare race only shifts which event is sampled
+            if count % rate:
+                return
+        self._put((time.time(), level, event, fields, False))
+
+    def audit(self, event, **fields):
+        """Queue a trade / decision record; never dropped, whatever the backlog."""
+        if self.running:
+            self._pending.append((time.time(), logging.INFO, event, fields, True))
+
+    def _put(self, item):
+        if len(self._pending) >= config.LOG_QUEUE_SIZE:
+            self.dropped += 1
+        else:
+            self._pending.append(item)
+
+    # Writer
+
+    def _run(self):
+        while True:
+            stopping = self._stopping.wait(config.LOG_FLUSH_INTERVAL)
+            pending = self._pending
+            if pending:
+                for _ in range(len(pending)):
+                    item = pending.popleft()
+                    try:
+                        self._write(item)
+                    except Exception as e:
+                        self._file.write(f"Unwritable log event {item!r}: {e}\n")
+                self._file.flush()
+                if self._audit_file is not None:
+                    self._audit_file.flush()
+            if stopping and not pending:
+                return
+
+    def _write(self, item):
+        if isinstance(item, logging.LogRecord):
+            if self.format == 'json':
+                line = json.dumps({
+                    'time': item.created, 'level': item.levelname, 'event': 'log', 'message': item.getMessage(),
+                    **({'exception': self._formatter.formatException(item.exc_info)} if item.exc_info else {}),
+                })
+            else:
+                line = self._formatter.format(item)
+            self._file.write(line + '\n')
+            self.written += 1
+            return
+
+        created, level, event, fields, audit = item
+        fields = _clean(fields)
+        record = {'time': created, 'level': logging.getLevelName(level), 'event': event, **fields}
+        if self.format == 'json':
+            line = json.dumps(record)
+        else:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+            line = f"{stamp},{int(created * 1000) % 1000:03d}:{record['level']}:{event} {json.dumps(fields)}"
+        self._file.write(line + '\n')
+        if audit and self._audit_file is not None:
+            self._audit_file.write(json.dumps(record) + '\n')
+        self.written += 1
+
+    def metrics(self):
+        return {'queued': len(self._pending), 'written': self.written, 'dropped': self.dropped}
+
+
+events = EventLog()
+emit = events.emit
+audit = events.audit
+
+
+def setup():
+    """Start the event log with the config.LOG_* settings."""
+    events.start(config.LOG_FILE, config.AUDIT_FILE, config.LOG_LEVEL, config.LOG_FORMAT)
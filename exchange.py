@@ -0,0 +1,153 @@
+# exchange.py
+
+import logging
+
+import krakenex
+import pandas as pd
+from requests.adapters import HTTPAdapter
+
+import config
+from paper_exchange import PaperExchange
+
+
+def get_client(api_key, api_secret):
+    """
+    Initialize and return a Kraken client for one account. With
+    config.PAPER_TRADING, a PaperExchange wraps it and only public calls
+    reach Kraken.
+    """
+    client = krakenex.API()
+    client.uri = config.REST_URL
+    # krakenex keeps one requests.Session; size its keep-alive pool for concurrent calls
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.REST_POOL_SIZE)
+    client.session.mount('https://', adapter)
+    client.session.mount('http://', adapter)
+    client.key = api_key
+    client.secret = api_secret
+    if config.PAPER_TRADING:
+        return PaperExchange(client)
+    return client
+
+
+class OrderStatusUnknown(Exception):
+    """An AddOrder call failed in a way that leaves open whether the exchange accepted the order."""
+
+
+# Errors for an order the exchange definitely did not accept; anything else (timeouts, EService:*) may have gone through
+REJECTION_PREFIXES = ('EOrder:', 'EAPI:', 'EGeneral:Invalid arguments', 'EGeneral:Permission denied')
+
+
+def place_order(client, pair, side, volume, ordertype='market', price=None, userref=None):
+    """
+    Place an order on Kraken (or, in paper trading, the PaperExchange standing
+    in for it), optionally tagged with an integer `userref` to find it by
+    later. Returns the response, or None if the order was rejected. Raises
+    OrderStatusUnknown if the call failed without a definite answer, so the
+    caller can look the order up by its userref instead of assuming either way.
+    """
+    request = {
+        'pair': pair,
+        'type': side.lower(),
+        'ordertype': ordertype,
+        'volume': volume
+    }
+    if price is not None:
+        request['price'] = price
+    if userref is not None:
+        request['userref'] = userref
+    try:
+        order = client.query_private('AddOrder', request)
+    except Exception as e:
+        logging.error(f"Error placing order, outcome unknown: {e!r}")
+        raise OrderStatusUnknown(repr(e)) from e
+    errors = order.get('error')
+    if errors:
+        if all(error.startswith(REJECTION_PREFIXES) for error in errors):
+            logging.error(f"Order rejected: {errors}")
+            return None
+        logging.error(f"Order failed, outcome unknown: {errors}")
+        raise OrderStatusUnknown(', '.join(errors))
+    logging.info(f"Order placed: {order}")
+    return order
+
+
+def cancel_order(client, txid):
+    """Cancel an open order. Returns True if Kraken accepted the cancel."""
+    try:
+        response = client.query_private('CancelOrder', {'txid': txid})
+        if response.get('error'):
+            logging.error(f"Cancel of {txid} rejected: {response['error']}")
+            return False
+        return True
+    except Exception as e:
+        logging.error(f"Error cancelling order {txid}: {e}")
+        return False
+
+
+def query_orders(client, txids):
+    """{txid: order info} for the given order ids (empty on error)."""
+    try:
+        response = client.query_private('QueryOrders', {'txid': ','.join(txids)})
+        if response.get('error'):
+            logging.error(f"QueryOrders failed: {response['error']}")
+            return {}
+        return response['result']
+    except Exception as e:
+        logging.error(f"Error querying orders {txids}: {e}")
+        return {}
+
+
+def find_orders(client, userref):
+    """{txid: order info} of the open and recent closed orders tagged with `userref`, or None on error."""
+    found = {}
+    for method, key in (('OpenOrders', 'open'), ('ClosedOrders', 'closed')):
+        try:
+            response = client.query_private(method, {'userref': userref})
+            if response.get('error'):
+                logging.error(f"{method} failed: {response['error']}")
+                return None
+            found.update(response['result'][key])
+        except Exception as e:
+            logging.error(f"Error listing orders with userref {userref}: {e}")
+            return None
+    return found
+
+
+def get_balances(client):
+    """{asset: amount} from Balance, or None on error."""
+    try:
+        response = client.query_private('Balance')
+        if response.get('error'):
+            logging.error(f"Balance failed: {response['error']}")
+            return None
+        return {asset: float(amount) for asset, amount in response['result'].items()}
+    except Exception as e:
+        logging.error(f"Error querying balances: {e}")
+        return None
+
+
+def get_historical_ohlc(client, pair, interval, since):
+    """Fetch historical OHLC data from Kraken."""
+    try:
+        ohlc_data = client.query_public('OHLC', {'pair': pair, 'interval': interval, 'since': since})
+
+        # Check if the pair data exists in the response
+        if 'result' in ohlc_data and pair in ohlc_data['result']:
+            # Kraken returns 8 columns in the OHLC data: timestamp, open, high, low, close, vwap, volume, count
+            data = pd.DataFrame(ohlc_data['result'][pair], columns=[
+                'timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count'
+            ])
+            data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
+
+            # Convert numeric columns to appropriate types
+            numeric_columns = ['open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
+            data[numeric_columns] = data[numeric_columns].apply(pd.to_numeric)
+
+            return data
+        else:
+            logging.error(f"No data found for pair {pair} or API error: {ohlc_data}")
+            return None
+
+    except Exception as e:
+        logging.error(f"Error fetching historical data for {pair} on {interval} interval: {e}")
+        return None
@@ -0,0 +1,96 @@
+# frame_decoder.py
+
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional: roughly twice as fast as the stdlib on the frames that still need a full parse
+    orjson = None
+
+loads = orjson.loads if orjson is not None else json.loads
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+# Frame kinds returned by FrameDecoder.decode
+OHLC = 'ohlc'
+TRADE = 'trade'
+BOOK = 'book'
+EVENT = 'event'
+
+HEARTBEAT = '"heartbeat"'
+# Quote-split layout of an OHLC frame: [id,["time","etime","open","high","low","close","vwap","volume",count],"ohlc-N","PAIR"]
+OHLC_PARTS = 21  # Quoted fields at odd indices 1..15; the unquoted count sits between them and the channel
+OHLC_COUNT = 16
+OHLC_CHANNEL = 17
+OHLC_PAIR = 19
+
+
+class FrameDecoder:
+    """
+    Decoder for Kraken v1 WebSocket frames.
+
+    `decode(message)` returns (kind, pair, interval, payload), or None for
+    frames with nothing to route:
+
+    - heartbeats are recognised by a substring test, without parsing;
+    - OHLC frames, the bulk of the feed, are split on their quotes and the
+      fields converted straight into the candle tuple Instrument.on_candle
+      takes (start time, open, high, low, close, vwap, volume, count);
+    - trade, book and event frames are parsed with `loads` (orjson when
+      installed), trades and books returning the payloads their handlers take.
+
+    Channels are routed through a table built once from the subscribed
+    channel names, so neither path inspects channel names piecemeal.
+    """
+
+    def __init__(self, intervals, trades=False, book_depth=0):
+        self.channels = {f'ohlc-{interval}': (OHLC, interval) for interval in intervals}
+        if trades:
+            self.channels['trade'] = (TRADE, None)
+        if book_depth:
+            self.channels[f'book-{book_depth}'] = (BOOK, None)
+        self.heartbeats = 0
+        self.parsed = 0  # Frames that needed a full JSON parse
+
+    def decode(self, message):
+        if message[0] == '{':
+            if HEARTBEAT in message:
+                self.heartbeats += 1
+                return None
+            self.parsed += 1
+            return EVENT, None, None, loads(message)
+
+        parts = message.split('"')
+        if len(parts) == OHLC_PARTS:
+            route = self.channels.get(parts[OHLC_CHANNEL])
+            if route is not None and route[0] == OHLC:
+                interval = route[1]
+                # Spelled out: six float() calls are cheaper here than map() over a slice
+                return OHLC, parts[OHLC_PAIR], interval, (
+                    float(parts[3]) - interval * 60,  # Candle start time, from the end time; matches REST
+                    float(parts[5]), float(parts[7]), float(parts[9]), float(parts[11]),  # open, high, low, close
+                    float(parts[13]), float(parts[15]),  # vwap, volume
+                    float(parts[OHLC_COUNT].strip(' ,]')),
+                )
+
+        # Anything else (or an OHLC frame in an unexpected layout) takes the general path
+        self.parsed += 1
+        msg = loads(message)
+        if not isinstance(msg, list):
+            return EVENT, None, None, msg
+        route = self.channels.get(msg[-2])
+        if route is None:
+            return None
+        kind, interval = route
+        if kind == TRADE:
+            return kind, msg[-1], None, msg[1]
+        if kind == BOOK:
+            # Updates carry the asks and bids in up to two dicts before the channel name
+            return kind, msg[-1], None, msg[1:-2]
+        ohlc = msg[1]
+        return kind, msg[-1], interval, (
+            float(ohlc[1]) - interval * 60,
+            *map(float, ohlc[2:9]),
+        )
+
+    def metrics(self):
+        return {'heartbeats': self.heartbeats, 'parsed': self.parsed, 'json_backend': JSON_BACKEND}
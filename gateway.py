@@ -0,0 +1,184 @@
+# gateway.py
+
+import asyncio
+import json
+import logging
+import random
+import time
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+import config
+
+# Kraken REST counter cost per private method; trading calls are limited separately by the matching engine
+PRIVATE_CALL_COST = {
+    'Ledgers': 2, 'QueryLedgers': 2, 'TradesHistory': 2, 'QueryTrades': 2,
+    'AddOrder': 0, 'AddOrderBatch': 0, 'EditOrder': 0, 'CancelOrder': 0, 'CancelAll': 0,
+}
+
+
+class RateLimiter:
+    """
+    Client-side copy of Kraken's per-key REST call counter: each private call
+    adds its cost, the counter decays by `decay` per second, and Kraken
+    throttles the key once it would exceed `limit`. `acquire()` waits just
+    long enough that the call fits, so bursts are spread out instead of
+    rejected with "EAPI:Rate limit exceeded".
+    """
+
+    def __init__(self, limit, decay):
+        self.limit = limit
+        self.decay = decay
+        self.counter = 0.0
+        self.waited = 0.0  # Total seconds spent waiting for headroom
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()  # Callers wait in turn, so concurrent ones cannot share one headroom check
+
+    def _decay(self):
+        now = time.monotonic()
+        self.counter = max(0.0, self.counter - (now - self._updated) * self.decay)
+        self._updated = now
+
+    async def acquire(self, cost):
+        if cost <= 0:
+            return
+        async with self._lock:
+            self._decay()
+            excess = self.counter + cost - self.limit
+            if excess > 0:
+                delay = excess / self.decay
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._decay()
+            self.counter += cost
+
+
+class KrakenGateway:
+    """
+    One asyncio event loop for Kraken market data and REST.
+
+    The WebSocket reader hands every frame to `on_message(message, received_ns)`
+    on the loop. Dropped connections are retried with jittered exponential
+    backoff, and every subscription is sent again on reconnect. The loop never
+    sleeps on a blocking call.
+
+    REST calls (krakenex, which is blocking) run on worker threads scheduled
+    by the loop, so orders and balance queries proceed while market data keeps
+    flowing. Private calls are serialized per client because Kraken rejects
+    out-of-order nonces from one API key, and are paced by a RateLimiter per
+    client so they stay under Kraken's call counter. Public calls share one
+    RateLimiter, since Kraken limits them per IP address.
+
+    `on_connect()`, if given, runs on the loop after every (re)connect, once
+    the subscriptions are sent.
+    """
+
+    def __init__(self, url, on_message, subscriptions, on_connect=None):
+        self.url = url
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.subscriptions = list(subscriptions)  # Payloads (dicts) sent on every connect
+        self.loop = None
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+        self._private_locks = {}
+        self._limiters = {}
+        self._public_limiter = RateLimiter(config.PUBLIC_RATE_LIMIT, config.PUBLIC_RATE_DECAY)
+        self._stopped = False
+        self._ws = None
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff delay for reconnect attempt `attempt` (1-based)."""
+        ceiling = min(config.RECONNECT_MAX_DELAY, config.RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    async def run(self):
+        """Connect, subscribe and pump messages until `stop()`, reconnecting as needed."""
+        self.loop = asyncio.get_running_loop()
+        attempt = 0
+        while not self._stopped:
+            try:
+                async with connect(self.url, ping_interval=20, ping_timeout=20) as ws:
+                    self._ws = ws
+                    attempt = 0
+                    logging.info(f"WebSocket connected to {self.url}")
+                    for payload in self.subscriptions:
+                        await ws.send(json.dumps(payload))
+                    self.connected.set()
+                    if self.on_connect is not None:
+                        self.on_connect()
+                    async for message in ws:
+                        self.on_message(message, time.perf_counter_ns())
+            except (OSError, ConnectionClosed, WebSocketException, asyncio.TimeoutError) as e:
+                # WebSocketException covers rejected handshakes (e.g. HTTP 429/5xx), which are not OSErrors
+                logging.warning(f"WebSocket connection lost: {e!r}")
+            except Exception as e:
+                # A failing handler or on_connect must not end the session; reconnecting resyncs state
+                logging.exception(f"WebSocket session failed: {e!r}")
+            finally:
+                self._ws = None
+                self.connected.clear()
+
+            if self._stopped:
+                break
+            attempt += 1
+            self.reconnects += 1
+            delay = self._backoff(attempt)
+            logging.info(f"Reconnecting WebSocket in {delay:.1f}s (attempt {attempt})...")
+            await asyncio.sleep(delay)
+
+    async def send(self, payload):
+        """Send a control message (e.g. a resubscribe) if connected; reconnects resend `subscriptions` anyway."""
+        if self._ws is not None:
+            await self._ws.send(json.dumps(payload))
+
+    async def stop(self):
+        self._stopped = True
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def rest(self, client, method, data=None, private=False):
+        """Run one krakenex call off the loop; private calls on the same client are serialized."""
+        if not private:
+            await self._public_limiter.acquire(1)
+            return await asyncio.to_thread(client.query_public, method, data)
+        lock = self._private_locks.setdefault(id(client), asyncio.Lock())
+        limiter = self._limiters.get(id(client))
+        if limiter is None:
+            limiter = self._limiters[id(client)] = RateLimiter(config.REST_RATE_LIMIT, config.REST_RATE_DECAY)
+        async with lock:
+            await limiter.acquire(PRIVATE_CALL_COST.get(method, 1))
+            return await asyncio.to_thread(client.query_private, method, data)
+
+    def metrics(self):
+        return {
+            'connected': self.connected.is_set(),
+            'reconnects': self.reconnects,
+            'rate_limit_counter': max((l.counter for l in self._limiters.values()), default=0.0),
+            'rate_limit_wait_s': round(sum(l.waited for l in self._limiters.values()), 2),
+            'public_rate_limit_wait_s': round(self._public_limiter.waited, 2),
+        }
+
+    def call(self, client, method, data=None, private=False, timeout=None):
+        """Thread-safe blocking wrapper around `rest()` for code running outside the loop."""
+        future = asyncio.run_coroutine_threadsafe(self.rest(client, method, data, private), self.loop)
+        return future.result(timeout if timeout is not None else config.REST_TIMEOUT)
+
+
+class GatewayClient:
+    """
+    krakenex-compatible client whose calls are scheduled on the gateway loop.
+    Lets strategy and order code keep calling `query_private`/`query_public`
+    from evaluation workers without touching the event loop directly.
+    """
+
+    def __init__(self, gateway, client):
+        self.gateway = gateway
+        self.client = client
+
+    def query_public(self, method, data=None):
+        return self.gateway.call(self.client, method, data)
+
+    def query_private(self, method, data=None):
+        return self.gateway.call(self.client, method, data, private=True)
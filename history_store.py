@@ -0,0 +1,108 @@
+# history_store.py
+
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from candle_store import CANDLE_COLUMNS
+
+RECORD_FIELDS = len(CANDLE_COLUMNS)
+RECORD_SIZE = RECORD_FIELDS * 8  # Bytes per candle: CANDLE_COLUMNS as float64
+
+
+class HistoryStore:
+    """
+    Persistent on-disk candle store with one flat binary file per
+    pair and interval. Each record is the 8 CANDLE_COLUMNS as float64 with
+    the timestamp as epoch seconds of the candle start, so a file can be
+    memory-mapped straight into an (n, 8) array.
+
+    Only closed candles are stored, always in timestamp order. Appends skip
+    anything not newer than the last stored candle.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._files = {}  # (pair, interval) -> open append handle
+        self._last = {}  # (pair, interval) -> last stored timestamp
+
+    def path(self, pair, interval):
+        return os.path.join(self.directory, f"{pair.replace('/', '')}_{interval}.bin")
+
+    def _records(self, pair, interval):
+        """Memory-mapped (n, 8) view of the stored candles, or None if nothing is stored."""
+        path = self.path(pair, interval)
+        if not os.path.exists(path):
+            return None
+        size = os.path.getsize(path)
+        count = size // RECORD_SIZE
+        if size % RECORD_SIZE:
+            # A crash mid-append can leave a partial record; drop it
+            logging.warning(f"Truncating partial record in {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(count * RECORD_SIZE)
+        if count == 0:
+            return None
+        return np.memmap(path, dtype=np.float64, mode='r', shape=(count, RECORD_FIELDS))
+
+    def last_timestamp(self, pair, interval):
+        """Start time of the newest stored candle, or None."""
+        with self._lock:
+            return self._last_timestamp(pair, interval)
+
+    def _last_timestamp(self, pair, interval):
+        key = (pair, interval)
+        if key not in self._last:
+            records = self._records(pair, interval)
+            self._last[key] = None if records is None else float(records[-1, 0])
+        return self._last[key]
+
+    def load(self, pair, interval, count=None):
+        """The newest `count` stored candles (all if None) as a DataFrame with CANDLE_COLUMNS."""
+        with self._lock:
+            records = self._records(pair, interval)
+        if records is None:
+            records = np.empty((0, RECORD_FIELDS))
+        elif count is not None:
+            records = records[-count:]
+        data = pd.DataFrame(np.array(records), columns=CANDLE_COLUMNS)
+        data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
+        return data
+
+    def append(self, pair, interval, rows):
+        """Append closed candles (iterable of CANDLE_COLUMNS rows, oldest first). Returns the number written."""
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, RECORD_FIELDS)
+        key = (pair, interval)
+        # Check and write under one lock, so concurrent appends cannot interleave or both pass the check
+        with self._lock:
+            last = self._last_timestamp(pair, interval)
+            if last is not None:
+                rows = rows[rows[:, 0] > last]
+            if len(rows) == 0:
+                return 0
+            f = self._files.get(key)
+            if f is None:
+                f = self._files[key] = open(self.path(pair, interval), 'ab')
+            f.write(rows.tobytes())
+            f.flush()
+            self._last[key] = float(rows[-1, 0])
+        return len(rows)
+
+    def append_frame(self, pair, interval, data):
+        """Append closed candles from a DataFrame holding CANDLE_COLUMNS."""
+        timestamps = data['timestamp']
+        if pd.api.types.is_datetime64_any_dtype(timestamps):
+            timestamps = timestamps.to_numpy(dtype='datetime64[s]').astype(np.int64)
+        rows = data[CANDLE_COLUMNS[1:]].to_numpy(dtype=np.float64)
+        return self.append(pair, interval, np.column_stack([np.asarray(timestamps, dtype=np.float64), rows]))
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
@@ -0,0 +1,144 @@
+# indicator_kernels.py
+
+import functools
+import logging
+import math
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Optional: compiles the EMA recursion into a plain loop that runs without the GIL
+    numba = None
+
+# Largest exponent the blocked NumPy EMA lets its rescaling factors reach (e^200 is far from float64 overflow)
+EXPONENT_LIMIT = 200.0
+
+
+def _starts(values):
+    """Index of each row's first finite value (the row length for all-NaN rows)."""
+    finite = np.isfinite(values)
+    return np.where(finite.any(axis=1), finite.argmax(axis=1), values.shape[1])
+
+
+def _before(limits, n):
+    """Mask of the positions left of each row's limit."""
+    return np.arange(n) < np.asarray(limits)[:, None]
+
+
+@functools.lru_cache(maxsize=64)
+def _powers(decay, block):
+    """(decay^-k, decay^k) for k in [0, block), shared by every call with the same smoothing."""
+    steps = np.arange(block, dtype=np.float64)
+    return decay ** -steps, decay ** steps
+
+
+def _ema_numpy(values, alpha):
+    """
+    y[t] = (1 - alpha) * y[t-1] + alpha * x[t], with y[0] = x[0], along each
+    row. Within a block, the recursion is a cumulative sum of x rescaled by
+    (1 - alpha)^-k; blocks are short enough for that factor to stay finite.
+    """
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        return values.copy()
+    n = values.shape[1]
+    out = np.empty_like(values)
+    block = min(n, max(1, int(EXPONENT_LIMIT / -math.log(decay))))
+    growth, shrink = _powers(decay, block)
+    previous = values[:, 0]  # y[-1] = x[0] makes y[0] = x[0]
+    for start in range(0, n, block):
+        chunk = values[:, start:start + block]
+        m = chunk.shape[1]
+        sums = np.cumsum(chunk * growth[:m], axis=1)
+        out[:, start:start + m] = shrink[:m] * (decay * previous[:, None] + alpha * sums)
+        previous = out[:, start + m - 1]
+    return out
+
+
+def _ema_loop(values, alpha):
+    """The same recursion as _ema_numpy as a plain loop, for Numba to compile."""
+    out = np.empty_like(values)
+    decay = 1.0 - alpha
+    for row in range(values.shape[0]):
+        y = values[row, 0]
+        for t in range(values.shape[1]):
+            y = decay * y + alpha * values[row, t]
+            out[row, t] = y
+    return out
+
+
+EMA_KERNELS = {'numpy': _ema_numpy}
+if numba is not None:
+    EMA_KERNELS['numba'] = numba.njit(nogil=True, cache=True)(_ema_loop)
+
+
+def backend_name(name):
+    """Kernel backend for a config.INDICATOR_BACKEND value: 'auto' is Numba when installed, else NumPy."""
+    if name == 'auto':
+        return 'numba' if 'numba' in EMA_KERNELS else 'numpy'
+    if name == 'ta':
+        return 'numpy'  # The library has no array form; indicators.indicator_column calls it directly
+    if name not in EMA_KERNELS:
+        logging.warning(f"Indicator backend {name!r} is not available; using numpy.")
+        return 'numpy'
+    return name
+
+
+def ema(values, alpha, min_periods, backend='numpy'):
+    """
+    pandas `ewm(alpha=alpha, min_periods=min_periods, adjust=False).mean()`
+    along each row of a 2-D array. Rows may be left-padded with NaN; each
+    starts at its first finite value. Values inside a row must be finite.
+    """
+    n = values.shape[1]
+    start = _starts(values)
+    first = values[np.arange(len(values)), np.minimum(start, n - 1)]
+    # Padding repeats the first value, which leaves the recursion exactly at it when the row starts
+    filled = np.where(_before(start, n), first[:, None], values)
+    out = EMA_KERNELS[backend](np.ascontiguousarray(filled, dtype=np.float64), alpha)
+    out[_before(start + min_periods - 1, n)] = np.nan
+    return out
+
+
+def rsi(close, window, backend='numpy'):
+    """ta's RSIIndicator along each row: Wilder averages of the up and down moves."""
+    diff = np.diff(close, axis=1, prepend=np.nan)
+    padding = np.isnan(close)
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    up[padding] = np.nan
+    down[padding] = np.nan
+    avg_up = ema(up, 1 / window, window, backend)
+    avg_down = ema(down, 1 / window, window, backend)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(avg_down == 0, 100.0, 100 - 100 / (1 + avg_up / avg_down))
+
+
+def atr(high, low, close, window, backend='numpy'):
+    """indicators.average_true_range along each row: 0 before the first full window, NaN over padding."""
+    n = close.shape[1]
+    previous = np.concatenate([np.full((len(close), 1), np.nan), close[:, :-1]], axis=1)
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - previous), np.abs(low - previous)))
+    start = _starts(true_range)
+    seed_at = start + window - 1
+    seeded = np.where(_before(seed_at, n), np.nan, true_range)
+    rows = np.flatnonzero(seed_at < n)
+    # Wilder smoothing starts from the plain mean of the first `window` true ranges
+    sums = np.cumsum(np.nan_to_num(true_range), axis=1)
+    seeded[rows, seed_at[rows]] = sums[rows, seed_at[rows]] / window
+    out = ema(seeded, 1 / window, 1, backend)
+    out[_before(seed_at, n)] = 0.0
+    out[_before(start, n)] = np.nan
+    return out
+
+
+def rolling_mean(values, window):
+    """pandas `rolling(window).mean()` along each row."""
+    n = values.shape[1]
+    sums = np.cumsum(np.nan_to_num(values), axis=1)
+    out = sums.copy()
+    out[:, window:] -= sums[:, :-window]
+    out /= window
+    out[_before(_starts(values) + window - 1, n)] = np.nan
+    return out
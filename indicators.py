@@ -1,47 +1,412 @@
 # indicators.py
 
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 from ta.trend import EMAIndicator, MACD
 from ta.momentum import RSIIndicator
-from ta.volatility import AverageTrueRange
 import config
+import indicator_kernels as kernels
+
+# Batched indicator calls split their series across these threads; the kernels spend most of their time outside the GIL
+_kernel_workers = config.INDICATOR_WORKERS or os.cpu_count() or 1
+_kernel_executor = ThreadPoolExecutor(max_workers=_kernel_workers, thread_name_prefix='indicators')
+
+
+def apply_technical_indicators(data, columns=None):
+    """Calculate technical indicators (all, or those `columns` need) and add them to the DataFrame."""
+    names = INDICATOR_COLUMNS if columns is None else resolve(columns)
+    if config.INDICATOR_BACKEND == 'ta':
+        for name in names:
+            data[name] = _ta_column(data, name)
+        return data
+    values = indicator_arrays(names, *_candle_arrays(data))
+    for name in names:
+        data[name] = values[name][0]
+    return data
+
+
+def _candle_arrays(data):
+    """(high, low, close, volume) of a candle frame as 1-row float64 arrays for indicator_arrays."""
+    return [data[field].to_numpy(dtype=np.float64)[None, :] for field in ('high', 'low', 'close', 'volume')]
+
 
-def apply_technical_indicators(data):
-    """Calculate technical indicators and add them to the DataFrame."""
+def indicator_column(data, name, backend=None):
+    """
+    One column of apply_technical_indicators, computed with the current
+    config settings by `backend` (default config.INDICATOR_BACKEND).
+    """
+    backend = backend or config.INDICATOR_BACKEND
+    if backend == 'ta':
+        return _ta_column(data, name)
+    return pd.Series(indicator_arrays([name], *_candle_arrays(data), backend=backend)[name][0], index=data.index)
+
+
+def _ta_column(data, name):
+    """indicator_column computed by the `ta` library, which the kernels are checked against."""
     # EMAs
-    data['ema9'] = EMAIndicator(
-        close=data['close'], window=config.EMA_9_WINDOW).ema_indicator()
-    data['ema21'] = EMAIndicator(
-        close=data['close'], window=config.EMA_21_WINDOW).ema_indicator()
-    data['ema50'] = EMAIndicator(
-        close=data['close'], window=config.EMA_50_WINDOW).ema_indicator()
-    data['ema200'] = EMAIndicator(
-        close=data['close'], window=config.EMA_200_WINDOW).ema_indicator()
-    
+    if name in EMA_WINDOWS:
+        return EMAIndicator(close=data['close'], window=getattr(config, EMA_WINDOWS[name])).ema_indicator()
+
     # RSI
-    data['rsi'] = RSIIndicator(
-        close=data['close'], window=config.RSI_WINDOW).rsi()
-    
+    if name == 'rsi':
+        return RSIIndicator(close=data['close'], window=config.RSI_WINDOW).rsi()
+
     # MACD
-    macd_indicator = MACD(
-        close=data['close'],
-        window_slow=config.MACD_SLOW,
-        window_fast=config.MACD_FAST,
-        window_sign=config.MACD_SIGNAL
-    )
-    data['macd'] = macd_indicator.macd()
-    data['macd_signal'] = macd_indicator.macd_signal()
-    
-    # ATR 
-    atr_indicator = AverageTrueRange(
-        high=data['high'],
-        low=data['low'],
-        close=data['close'],
-        window=config.ATR_WINDOW
-    )
-    data['atr'] = atr_indicator.average_true_range()
-    
+    if name in ('macd', 'macd_signal'):
+        macd_indicator = MACD(
+            close=data['close'],
+            window_slow=config.MACD_SLOW,
+            window_fast=config.MACD_FAST,
+            window_sign=config.MACD_SIGNAL
+        )
+        return macd_indicator.macd() if name == 'macd' else macd_indicator.macd_signal()
+
+    # ATR
+    if name == 'atr':
+        return average_true_range(data['high'], data['low'], data['close'], config.ATR_WINDOW)
+
     # Volume Moving Average
-    data['volume_ma'] = data['volume'].rolling(window=20).mean()
-    
-    return data
+    if name == 'volume_ma':
+        return data['volume'].rolling(window=config.VOLUME_MA_WINDOW).mean()
+
+    raise KeyError(f"Unknown indicator column: {name}")
+
+
+def average_true_range(high, low, close, window):
+    """
+    ATR seeded and smoothed exactly like ta's AverageTrueRange, but as one
+    `ewm` pass instead of its per-row Python loop, so long histories stay fast.
+    """
+    prev_close = close.shift(1)
+    true_range = pd.concat(
+        [high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1
+    ).max(axis=1)
+    # Wilder smoothing: the first value is the plain mean of the first `window` true ranges
+    seeded = true_range.copy()
+    seeded.iloc[:window] = np.nan
+    seeded.iloc[window - 1] = true_range.iloc[:window].mean()
+    atr = seeded.ewm(alpha=1 / window, adjust=False).mean()
+    return atr.fillna(0.0)  # ta reports 0 before the first full window
+
+
+# Columns produced by apply_technical_indicators / IncrementalIndicators
+INDICATOR_COLUMNS = ['ema9', 'ema21', 'ema50', 'ema200', 'rsi', 'macd', 'macd_signal', 'atr', 'volume_ma']
+EMA_WINDOWS = {
+    'ema9': 'EMA_9_WINDOW',
+    'ema21': 'EMA_21_WINDOW',
+    'ema50': 'EMA_50_WINDOW',
+    'ema200': 'EMA_200_WINDOW',
+}
+# The config settings each indicator column depends on
+INDICATOR_SETTINGS = {
+    **{name: (setting,) for name, setting in EMA_WINDOWS.items()},
+    'rsi': ('RSI_WINDOW',),
+    'macd': ('MACD_FAST', 'MACD_SLOW'),
+    'macd_signal': ('MACD_FAST', 'MACD_SLOW', 'MACD_SIGNAL'),
+    'atr': ('ATR_WINDOW',),
+    'volume_ma': ('VOLUME_MA_WINDOW',),
+}
+# Indicator columns each indicator is derived from, besides the candles themselves
+INDICATOR_DEPENDENCIES = {
+    'macd_signal': ('macd',),
+}
+
+
+def resolve(columns):
+    """Indicator columns needed to produce `columns`, dependencies included, in INDICATOR_COLUMNS order."""
+    needed = set()
+    pending = [name for name in columns if name in INDICATOR_SETTINGS]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(INDICATOR_DEPENDENCIES.get(name, ()))
+    return [name for name in INDICATOR_COLUMNS if name in needed]
+
+
+def indicator_arrays(columns, high, low, close, volume, backend=None):
+    """
+    {column: values} for `columns` and the indicators they depend on, over
+    2-D candle arrays holding one series per row (rows may be left-padded
+    with NaN to a common length), in one call to the indicator_kernels.
+    """
+    backend = kernels.backend_name(backend or config.INDICATOR_BACKEND)
+    values = {}
+    for name in resolve(columns):
+        if name in EMA_WINDOWS:
+            window = getattr(config, EMA_WINDOWS[name])
+            values[name] = kernels.ema(close, 2 / (window + 1), window, backend)
+        elif name == 'rsi':
+            values[name] = kernels.rsi(close, config.RSI_WINDOW, backend)
+        elif name == 'macd':
+            fast, slow = config.MACD_FAST, config.MACD_SLOW
+            values[name] = (kernels.ema(close, 2 / (fast + 1), fast, backend)
+                            - kernels.ema(close, 2 / (slow + 1), slow, backend))
+        elif name == 'macd_signal':
+            values[name] = kernels.ema(values['macd'], 2 / (config.MACD_SIGNAL + 1), config.MACD_SIGNAL, backend)
+        elif name == 'atr':
+            values[name] = kernels.atr(high, low, close, config.ATR_WINDOW, backend)
+        elif name == 'volume_ma':
+            values[name] = kernels.rolling_mean(volume, config.VOLUME_MA_WINDOW)
+    return values
+
+
+def batch_indicators(frames, columns=None, backend=None, workers=None):
+    """
+    Indicator columns for many candle frames (pairs, timeframes) at once:
+    the frames are stacked into left-padded 2-D arrays and their rows split
+    across up to `workers` threads (default config.INDICATOR_WORKERS).
+    Returns one {column: values} dict per frame, values aligned to its rows.
+    """
+    columns = INDICATOR_COLUMNS if columns is None else columns
+    if (backend or config.INDICATOR_BACKEND) == 'ta':
+        return [{name: _ta_column(frame, name).to_numpy() for name in resolve(columns)} for frame in frames]
+    if not frames:
+        return []
+    width = max(len(frame) for frame in frames)
+    arrays = []
+    for field in ('high', 'low', 'close', 'volume'):
+        stacked = np.full((len(frames), width), np.nan)
+        for row, frame in enumerate(frames):
+            if len(frame):
+                stacked[row, width - len(frame):] = frame[field].to_numpy(dtype=np.float64)
+        arrays.append(stacked)
+
+    workers = min(workers or _kernel_workers, len(frames))
+    bounds = np.linspace(0, len(frames), workers + 1).astype(int)
+    parts = [_kernel_executor.submit(indicator_arrays, columns, *(a[lo:hi] for a in arrays), backend=backend)
+             for lo, hi in zip(bounds[:-1], bounds[1:])]
+    results = []
+    for (lo, hi), part in zip(zip(bounds[:-1], bounds[1:]), parts):
+        values = part.result()
+        for row in range(hi - lo):
+            length = len(frames[lo + row])
+            results.append({name: column[row, width - length:] for name, column in values.items()})
+    return results
+
+
+def compare_backends(data, backend=None):
+    """
+    Largest difference per column between `backend` and the `ta` library on
+    a candle frame, relative to the values' size (absolute below 1).
+    """
+    values = indicator_arrays(INDICATOR_COLUMNS, *_candle_arrays(data), backend=backend)
+    differences = {}
+    for name in INDICATOR_COLUMNS:
+        expected = _ta_column(data, name).to_numpy(dtype=np.float64)
+        actual = values[name][0]
+        if not np.array_equal(np.isnan(expected), np.isnan(actual)):
+            differences[name] = math.inf  # NaN in different places
+        else:
+            error = np.abs(expected - actual) / np.maximum(np.abs(expected), 1.0)
+            differences[name] = float(np.nanmax(error, initial=0.0))
+    return differences
+
+
+class _StreamingEMA:
+    """Recursive EMA matching pandas ewm(adjust=False, min_periods=...) as used by `ta`."""
+
+    __slots__ = ('alpha', 'min_periods', 'value', 'count')
+
+    def __init__(self, alpha, min_periods):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.value = math.nan
+        self.count = 0
+
+    def peek(self, x):
+        """EMA value if `x` were the next observation, without committing it."""
+        if self.count == 0:
+            return x
+        return (1 - self.alpha) * self.value + self.alpha * x
+
+    def ready(self):
+        """Whether the next observation reaches min_periods (i.e. `ta` would output a value)."""
+        return self.count + 1 >= self.min_periods
+
+    def commit(self, x):
+        self.value = self.peek(x)
+        self.count += 1
+
+
+class IncrementalIndicators:
+    """
+    Stateful, O(1)-per-update version of apply_technical_indicators for one timeframe.
+
+    The engine keeps the running state up to the last *closed* candle plus the
+    current open candle. `update(..., new_candle=False)` revises the open candle;
+    `new_candle=True` first commits the previous open candle and then starts a
+    new one.
+
+    Only `columns` (default: all of INDICATOR_COLUMNS) and the indicators they
+    depend on are tracked. Updates just record the open candle; its values are
+    computed by `compute()` / `write_last()` when something reads them, once
+    per revision of the open candle.
+
+    Outputs match the `ta` library applied to the full series the engine has
+    been fed (since `warm_up`), within floating point tolerance.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = list(INDICATOR_COLUMNS) if columns is None else resolve(columns)
+        self.reset()
+
+    def reset(self):
+        active = set(self.columns)
+        self._emas = {
+            name: _StreamingEMA(2 / (getattr(config, setting) + 1), getattr(config, setting))
+            for name, setting in EMA_WINDOWS.items() if name in active
+        }
+        self._rsi = 'rsi' in active
+        self._rsi_up = _StreamingEMA(1 / config.RSI_WINDOW, config.RSI_WINDOW)
+        self._rsi_down = _StreamingEMA(1 / config.RSI_WINDOW, config.RSI_WINDOW)
+        self._macd = 'macd' in active
+        self._macd_signal_wanted = 'macd_signal' in active
+        self._macd_fast = _StreamingEMA(2 / (config.MACD_FAST + 1), config.MACD_FAST)
+        self._macd_slow = _StreamingEMA(2 / (config.MACD_SLOW + 1), config.MACD_SLOW)
+        self._macd_signal = _StreamingEMA(2 / (config.MACD_SIGNAL + 1), config.MACD_SIGNAL)
+        self._atr_wanted = 'atr' in active
+        self._atr = 0.0
+        self._atr_count = 0
+        self._tr_sum = 0.0
+        self._volume_ma = 'volume_ma' in active
+        self._volumes = deque(maxlen=config.VOLUME_MA_WINDOW - 1)
+        self._prev_close = None  # Close of the last committed candle
+        self._open = None  # (high, low, close, volume) of the open candle
+        self.revision = 0  # Bumped by every update
+        self._computed = -1  # Revision `values` was computed for
+        self._written = -1  # Revision last written to the buffer
+        self.values = dict.fromkeys(self.columns, math.nan)
+
+    def _true_range(self, high, low):
+        if self._prev_close is None:
+            return high - low
+        return max(high - low, abs(high - self._prev_close), abs(low - self._prev_close))
+
+    def _rsi_moves(self, close):
+        if self._prev_close is None:
+            return 0.0, 0.0
+        diff = close - self._prev_close
+        return (diff if diff > 0 else 0.0), (-diff if diff < 0 else 0.0)
+
+    def _compute(self, high, low, close, volume):
+        values = self.values
+
+        for name, ema in self._emas.items():
+            values[name] = ema.peek(close) if ema.ready() else math.nan
+
+        if self._rsi:
+            up, down = self._rsi_moves(close)
+            if self._rsi_up.ready():
+                avg_up = self._rsi_up.peek(up)
+                avg_down = self._rsi_down.peek(down)
+                values['rsi'] = 100.0 if avg_down == 0 else 100 - (100 / (1 + avg_up / avg_down))
+            else:
+                values['rsi'] = math.nan
+
+        if self._macd:
+            if self._macd_slow.ready():
+                macd = self._macd_fast.peek(close) - self._macd_slow.peek(close)
+                values['macd'] = macd
+                if self._macd_signal_wanted:
+                    values['macd_signal'] = self._macd_signal.peek(macd) if self._macd_signal.ready() else math.nan
+            else:
+                values['macd'] = math.nan
+                if self._macd_signal_wanted:
+                    values['macd_signal'] = math.nan
+
+        if self._atr_wanted:
+            window = config.ATR_WINDOW
+            true_range = self._true_range(high, low)
+            if self._atr_count + 1 < window:
+                values['atr'] = 0.0  # `ta` reports 0 (not NaN) before the first full window
+            elif self._atr_count + 1 == window:
+                values['atr'] = (self._tr_sum + true_range) / window
+            else:
+                values['atr'] = (self._atr * (window - 1) + true_range) / window
+
+        if self._volume_ma:
+            if len(self._volumes) == self._volumes.maxlen:
+                values['volume_ma'] = (sum(self._volumes) + volume) / config.VOLUME_MA_WINDOW
+            else:
+                values['volume_ma'] = math.nan
+
+    def _commit(self, high, low, close, volume):
+        for ema in self._emas.values():
+            ema.commit(close)
+
+        if self._rsi:
+            up, down = self._rsi_moves(close)
+            self._rsi_up.commit(up)
+            self._rsi_down.commit(down)
+
+        if self._macd:
+            # The MACD signal line only starts once the MACD itself is defined
+            macd_ready = self._macd_slow.ready()
+            macd = self._macd_fast.peek(close) - self._macd_slow.peek(close)
+            self._macd_fast.commit(close)
+            self._macd_slow.commit(close)
+            if macd_ready and self._macd_signal_wanted:
+                self._macd_signal.commit(macd)
+
+        if self._atr_wanted:
+            window = config.ATR_WINDOW
+            true_range = self._true_range(high, low)
+            if self._atr_count + 1 < window:
+                self._tr_sum += true_range
+            elif self._atr_count + 1 == window:
+                self._atr = (self._tr_sum + true_range) / window
+            else:
+                self._atr = (self._atr * (window - 1) + true_range) / window
+            self._atr_count += 1
+
+        if self._volume_ma:
+            self._volumes.append(volume)
+        self._prev_close = close
+
+    def update(self, high, low, close, volume, new_candle):
+        """
+        Feed the latest state of the open candle. Set `new_candle` when this
+        candle just started, which closes the previous one.
+        """
+        if new_candle and self._open is not None:
+            self._commit(*self._open)
+        self._open = (high, low, close, volume)
+        self.revision += 1
+
+    def compute(self):
+        """Indicator values of the open candle, computed at most once per revision."""
+        if self._computed != self.revision and self._open is not None:
+            self._compute(*self._open)
+            self._computed = self.revision
+        return self.values
+
+    def write_last(self, buffer, offset=1):
+        """
+        Store the open candle's values on a CandleBuffer row, `offset` rows
+        from the end (2 once the next candle has been appended). Skipped if
+        this revision is already written.
+        """
+        if self._written == self.revision or self._open is None:
+            return
+        for name, value in self.compute().items():
+            buffer.set_last(name, value, offset)
+        self._written = self.revision
+
+    def warm_up(self, buffer):
+        """Rebuild state from every candle in a CandleBuffer and fill its indicator columns."""
+        self.reset()
+        columns = {name: [] for name in self.columns}
+        rows = zip(buffer.column('high'), buffer.column('low'), buffer.column('close'), buffer.column('volume'))
+        for high, low, close, volume in rows:
+            self.update(float(high), float(low), float(close), float(volume), new_candle=True)
+            for name, value in self.compute().items():
+                columns[name].append(value)
+        for name, values in columns.items():
+            buffer.set_column(name, values)
+        self._written = self.revision
@@ -0,0 +1,499 @@
+# instrument.py
+
+import contextlib
+import logging
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+import indicators
+import rules
+import snapshot_store
+import strategy
+from candle_store import CandleBuffer, CANDLE_COLUMNS
+from event_log import audit
+from exchange import get_historical_ohlc
+from latency import recorder, span
+from levels import SupportResistanceTracker
+from order_book import OrderBook
+from orders import OrderManager
+from resampler import CandleAggregator
+
+# Candle buffers carry the OHLC fields plus the columns maintained by IncrementalIndicators and SupportResistanceTracker
+BUFFER_COLUMNS = CANDLE_COLUMNS + indicators.INDICATOR_COLUMNS + SupportResistanceTracker.columns()
+TIMEFRAMES = tuple(config.TIMEFRAMES)
+BASE_TIMEFRAME = TIMEFRAMES[0]
+# Timeframes fed by the WebSocket; the rest are aggregated locally from the base feed
+SUBSCRIBED_TIMEFRAMES = (BASE_TIMEFRAME,) if config.RESAMPLE_FROM_BASE else TIMEFRAMES
+
+# Indicator/level columns tracked per timeframe: only what the strategy reads, or every column
+FEATURE_COLUMNS = strategy.required_columns() if config.LAZY_FEATURES else {
+    interval: set(BUFFER_COLUMNS) for interval in TIMEFRAMES
+}
+# Timeframes the strategy snapshots, in generate_signals argument order
+SNAPSHOT_TIMEFRAMES = (config.TIMEFRAME_SHORT, config.TIMEFRAME_LONG, config.TIMEFRAME_CONFIRM)
+
+# Settings the saved tracker state depends on; a snapshot saved under different ones is not restored
+STATE_SETTINGS = sorted({setting for names in indicators.INDICATOR_SETTINGS.values() for setting in names} | {
+    'SUPPORT_RESISTANCE_WINDOW', 'SUPPORT_RESISTANCE_EXTRA_WINDOWS', 'PIVOT_STRENGTH', 'REQUIRED_DATA_LENGTH',
+})
+
+# Gap backfills wait on REST, so they run here rather than on the feed
+_backfill_executor = ThreadPoolExecutor(max_workers=config.BACKFILL_WORKERS, thread_name_prefix='backfill')
+
+
+def state_settings():
+    """Config and layout a snapshot has to match to be restored."""
+    return {
+        'columns': BUFFER_COLUMNS,
+        'dtype': str(np.dtype(config.CANDLE_DTYPE)),
+        'timeframes': TIMEFRAMES,
+        'features': {interval: sorted(columns) for interval, columns in FEATURE_COLUMNS.items()},
+        **{setting: getattr(config, setting) for setting in STATE_SETTINGS},
+    }
+
+
+class Instrument:
+    """
+    Everything the bot tracks for one trading pair: candle buffers and
+    indicator state for each timeframe, plus its OrderManager. Each
+    instrument trades through the Kraken client of its own account and sizes
+    positions from that account's cached AccountState.
+
+    With a HistoryStore, history is loaded from disk and only the gap since
+    the last stored candle is fetched; closed live candles are appended to it.
+
+    With config.RESAMPLE_FROM_BASE, only base-timeframe candles are fed in and
+    every higher timeframe is aggregated from them on the same tick.
+
+    With a MarketDataBus, the buffers live in its shared memory and every
+    update is published to strategy processes reading the bus.
+
+    A feed candle that skips one or more candles (or the first new candle
+    after a reconnect, whose predecessor may never have received its final
+    update) starts a REST backfill. Feed candles are held back meanwhile;
+    then the fetched candles from the last buffered one onwards and the held
+    candles are applied in order through the usual incremental path, so
+    indicator state continues from the gap instead of being reloaded. Only
+    a gap longer than REST's 720-candle window forces a full history reload.
+
+    Only the FEATURE_COLUMNS of each timeframe are tracked (no level tracker
+    where no level is read). Updates only advance the trackers' state; the
+    open candle's values are computed and written when a snapshot reads them
+    and once more when the candle closes. With a bus, whose readers see the
+    buffers directly, or with config.LAZY_FEATURES off, they are written on
+    every update as before.
+
+    `save_state` writes the buffers and tracker state to a binary snapshot
+    in config.STATE_DIR; `restore_state` warm-starts from it without
+    fetching history or recomputing indicators, and the candles missed
+    meanwhile arrive through the gap backfill on the first feed candle.
+
+    With config.SUBSCRIBE_TRADES, every trade print is checked against the
+    exit levels; with config.BOOK_DEPTH, an L2 OrderBook gives the expected
+    fill price used for sizing and stops.
+    """
+
+    def __init__(self, pair, rest_pair, client, account, history=None, bus=None):
+        self.pair = pair  # WebSocket notation, e.g. 'XBT/USD'
+        self.rest_pair = rest_pair  # REST notation, e.g. 'XXBTZUSD'
+        self.client = client
+        self.account = account
+        self.history = history
+        self.bus = bus
+        self.buffers = {
+            interval: CandleBuffer(config.REQUIRED_DATA_LENGTH, interval, BUFFER_COLUMNS, config.CANDLE_DTYPE,
+                                   bus.storage(pair, interval) if bus is not None else None)
+            for interval in TIMEFRAMES
+        }
+        needed = {interval: FEATURE_COLUMNS.get(interval, set()) for interval in TIMEFRAMES}
+        self.engines = {interval: indicators.IncrementalIndicators(needed[interval]) for interval in TIMEFRAMES}
+        self.levels = {interval: SupportResistanceTracker() for interval in TIMEFRAMES
+                       if needed[interval] & set(SupportResistanceTracker.columns())}
+        self._eager = bus is not None or not config.LAZY_FEATURES  # Write indicator values on every update
+        self._open_candles = {}  # Latest revision of each timeframe's open candle, at full precision
+        self.aggregators = {}
+        if config.RESAMPLE_FROM_BASE:
+            self.aggregators = {interval: CandleAggregator(interval) for interval in TIMEFRAMES[1:]}
+        self.lock = threading.Lock()  # Guards buffers, engines and level trackers
+        self.last_tick_ns = None  # perf_counter_ns when the newest feed message arrived
+        self._resync = set()  # Intervals whose first new candle after a (re)connect is treated as a gap
+        self._held = None  # Feed candles waiting for a backfill in flight, or None
+        self.gaps = 0
+        self.backfilled = 0  # Candles recovered over REST
+        self.reloads = 0
+        self.state_path = None
+        if config.STATE_DIR and config.SNAPSHOT_INTERVAL:
+            os.makedirs(config.STATE_DIR, exist_ok=True)
+            self.state_path = os.path.join(config.STATE_DIR, f"{rest_pair}.snapshot")
+
+        # Position, fills and exits; stop-loss / take-profit are checked on every base tick
+        self.orders = OrderManager(pair, rest_pair, client, config.STATE_DIR)
+        self.book = OrderBook(config.BOOK_DEPTH) if config.BOOK_DEPTH else None
+        self.last_trade = None  # Price of the newest trade print
+
+    def set_client(self, client):
+        """Route this instrument's REST calls (history, orders) through `client`."""
+        self.client = client
+        self.orders.client = client
+
+    def _writing(self):
+        """Context for changing the buffers: publishes the change on the bus, if there is one."""
+        if self.bus is None:
+            return contextlib.nullcontext()
+        return self.bus.writing(self.pair, self.buffers)
+
+    def resync(self):
+        """Called on every WebSocket (re)connect: candles may have been missed while disconnected."""
+        with self.lock:
+            self._resync = set(SUBSCRIBED_TIMEFRAMES)
+
+    def fetch_history(self):
+        """Fetch historical OHLC data for every timeframe and warm up the indicators."""
+        current_timestamp = int(time.time())
+        frames = {}
+        for interval in TIMEFRAMES:
+            since = current_timestamp - (config.REQUIRED_DATA_LENGTH * interval * 60)
+            if self.history is not None:
+                data = self._sync_history(interval, since)
+            else:
+                data = get_historical_ohlc(self.client, self.rest_pair, interval, since)
+            # Ensure we have enough data before starting
+            if data is None or len(data) < config.REQUIRED_DATA_LENGTH:
+                logging.error(f"Not enough {interval}-minute historical data for {self.pair}.")
+                return False
+            frames[interval] = data
+
+        with self.lock, self._writing():
+            for interval, data in frames.items():
+                self.buffers[interval].load_frame(data)
+                self.engines[interval].warm_up(self.buffers[interval])
+                if interval in self.levels:
+                    self.levels[interval].warm_up(self.buffers[interval])
+            self._seed_aggregators()
+        logging.info(f"*** Historical Data Successfully Loaded for {self.pair} ***")
+        return True
+
+    def save_state(self):
+        """Snapshot the candle buffers and indicator/level state to disk. Returns the bytes written."""
+        if self.state_path is None:
+            return 0
+        with self.lock:
+            if not all(len(buffer) for buffer in self.buffers.values()):
+                return 0  # History not loaded yet
+            state = {
+                'saved_at': time.time(),
+                'settings': state_settings(),
+                'buffers': {interval: buffer.rows() for interval, buffer in self.buffers.items()},
+                'trackers': pickle.dumps((self.engines, self.levels, self._open_candles)),
+            }
+        try:
+            return snapshot_store.save(self.state_path, state)
+        except OSError as e:
+            logging.error(f"Could not save {self.pair} snapshot: {e}")
+            return 0
+
+    def restore_state(self):
+        """
+        Load the snapshot `save_state` wrote, if there is a recent one saved
+        under the current settings. Returns True if restored; the candles
+        since then are backfilled once the feed (re)connects.
+        """
+        if self.state_path is None:
+            return False
+        state = snapshot_store.load(self.state_path)
+        if state is None:
+            return False
+        age = time.time() - state['saved_at']
+        if state['settings'] != state_settings():
+            logging.info(f"{self.pair}: settings changed since the last snapshot; fetching history.")
+            return False
+        if age > config.SNAPSHOT_MAX_AGE:
+            logging.info(f"{self.pair}: snapshot is {age:.0f}s old; fetching history.")
+            return False
+        engines, levels, open_candles = pickle.loads(state['trackers'])
+        with self.lock, self._writing():
+            for interval, (times, data) in state['buffers'].items():
+                self.buffers[interval].load_rows(times, data)
+            self.engines, self.levels, self._open_candles = engines, levels, open_candles
+            self._seed_aggregators()
+        logging.info(f"*** Restored {self.pair} from a {age:.0f}s old snapshot ***")
+        return True
+
+    def _sync_history(self, interval, since):
+        """Stored candles plus whatever REST returns after the last stored one; persists the new closed candles."""
+        stored = self.history.load(self.rest_pair, interval, config.REQUIRED_DATA_LENGTH)
+        last_stored = self.history.last_timestamp(self.rest_pair, interval)
+        if last_stored is not None and last_stored >= since:
+            since = int(last_stored)
+        else:
+            stored = stored.iloc[0:0]  # Too old to be contiguous with the requested window
+
+        fresh = get_historical_ohlc(self.client, self.rest_pair, interval, since)
+        if fresh is None:
+            return None
+        if len(stored) and len(fresh) and fresh['timestamp'].iloc[0] > stored['timestamp'].iloc[-1] + pd.Timedelta(minutes=interval):
+            # REST only returns the newest 720 candles, so a long downtime leaves a hole
+            logging.warning(f"Stored {interval}-minute history for {self.pair} does not reach the REST data; discarding it.")
+            stored = stored.iloc[0:0]
+
+        # The newest REST candle is still open, so only the ones before it are persisted
+        self.history.append_frame(self.rest_pair, interval, fresh.iloc[:-1])
+        logging.info(f"{self.pair} {interval}m: {len(stored)} candles from disk, {len(fresh)} from REST")
+
+        data = pd.concat([stored, fresh], ignore_index=True)
+        return data.drop_duplicates('timestamp', keep='last').reset_index(drop=True)
+
+    def _seed_aggregators(self):
+        """Replace each derived timeframe's open candle with the aggregate of the base history, so both agree exactly."""
+        base = self.buffers[BASE_TIMEFRAME]
+        for interval, aggregator in self.aggregators.items():
+            candle = aggregator.seed(base)
+            if candle is None:
+                logging.warning(f"{self.pair}: base history does not cover the open {interval}-minute candle.")
+                continue
+            self._apply(interval, candle, [])
+
+    def _apply(self, interval, candle, closed):
+        """Upsert a candle and its indicators; collects candles that just closed into `closed`. Caller holds the lock."""
+        buffer = self.buffers[interval]
+        appended = buffer.upsert(candle)
+        if appended is not None:
+            engine = self.engines[interval]
+            levels = self.levels.get(interval)
+            if appended and len(buffer) > 1:
+                # The previous candle just closed: settle its row before the trackers move on
+                engine.write_last(buffer, 2)
+                if levels is not None:
+                    levels.write_last(buffer, 2)
+            with span('indicators'):
+                engine.update(candle[2], candle[3], candle[4], candle[6], appended)
+                if self._eager:
+                    engine.write_last(buffer)
+            if levels is not None:
+                with span('levels'):
+                    levels.update(candle[2], candle[3], appended)
+                    if self._eager:
+                        levels.write_last(buffer)
+            if appended and len(buffer) > 1 and self.history is not None:
+                # A new candle started, so the previous one is final; persist it as received, not as stored
+                previous = self._open_candles.get(interval)
+                if previous is None or previous[0] != buffer.last('timestamp', 2):
+                    previous = [buffer.last(name, 2) for name in CANDLE_COLUMNS]
+                closed.append((interval, previous))
+            self._open_candles[interval] = candle
+        return appended
+
+    def _ingest(self, interval, candle, received_ns, closed):
+        """Apply a feed candle and roll it into the derived timeframes. Caller holds the lock."""
+        self.last_tick_ns = received_ns
+        appended = self._apply(interval, candle, closed)
+        if appended is not None and interval == BASE_TIMEFRAME:
+            for higher, aggregator in self.aggregators.items():
+                self._apply(higher, aggregator.update(candle, appended), closed)
+        return appended
+
+    def _gap(self, interval, candle):
+        """True if `candle` does not follow on from the buffered ones without a possible hole. Caller holds the lock."""
+        last = self.buffers[interval].last_timestamp
+        if interval in self._resync:
+            self._resync.discard(interval)
+            return last is not None and candle[0] > last
+        return last is not None and candle[0] > last + interval * 60
+
+    def on_candle(self, interval, candle, received_ns=None):
+        """
+        Store a live candle (CANDLE_COLUMNS order) and update its indicators,
+        then roll it into the derived timeframes. Returns the CandleBuffer.upsert
+        result, or None for intervals this instrument does not take from the feed
+        and for candles held back during a backfill.
+        `received_ns` is the message arrival time used for tick-to-order latency.
+        """
+        if interval not in SUBSCRIBED_TIMEFRAMES:
+            return None
+        closed = []
+        with self.lock:
+            with self._writing():
+                if self._held is None and self._gap(interval, candle):
+                    self.gaps += 1
+                    self._held = []
+                    _backfill_executor.submit(self._backfill)
+                if self._held is not None:
+                    self._held.append((interval, candle, received_ns))
+                    return None
+                appended = self._ingest(interval, candle, received_ns, closed)
+            self._persist(closed)
+        if appended is not None and interval == BASE_TIMEFRAME:
+            self.orders.on_price(candle[4])
+        return appended
+
+    def on_trades(self, trades):
+        """Trade prints from the `trade` channel ([price, volume, time, side, ...] strings): tick-level exit checks."""
+        on_price = self.orders.on_price
+        for trade in trades:
+            price = float(trade[0])
+            on_price(price)
+            self.last_trade = price
+
+    def on_book(self, payloads):
+        """Apply a `book` channel message; False if the checksum failed and the book needs a fresh snapshot."""
+        return self.book is None or self.book.apply(payloads)
+
+    def _persist(self, closed):
+        """Store closed candles; called under the lock, so they reach the history store in the order they closed."""
+        if self.history is not None:
+            for closed_interval, row in closed:
+                self.history.append(self.rest_pair, closed_interval, row)
+
+    def _backfill(self):
+        """Fetch the candles missed before the held feed candles, then apply both in order."""
+        try:
+            with self.lock:
+                starts = {interval: self.buffers[interval].last_timestamp for interval, _, _ in self._held}
+            # The buffers do not change while candles are held, so the REST calls can run unlocked
+            fetched = {}
+            for interval, start in starts.items():
+                fetched[interval] = self._fetch_since(interval, start)
+                if fetched[interval] is None:
+                    break
+            if any(rows is None for rows in fetched.values()):
+                logging.error(f"{self.pair}: backfill failed; continuing with a gap in the candles.")
+                fetched = {}
+            elif any(len(rows) == 0 or rows[0, 0] > starts[interval] for interval, rows in fetched.items()):
+                logging.warning(f"{self.pair}: gap is older than the REST window; reloading history.")
+                self.reloads += 1
+                if not self._reload():
+                    logging.error(f"{self.pair}: history reload failed; continuing with a gap in the candles.")
+                fetched = {}
+        except Exception as e:
+            logging.error(f"Error backfilling {self.pair}: {e}")
+            fetched = {}
+
+        closed = []
+        price = None
+        with self.lock:
+            with self._writing():
+                held, self._held = self._held, None
+                for interval, rows in fetched.items():
+                    first_live = min(candle[0] for held_interval, candle, _ in held if held_interval == interval)
+                    rows = rows[(rows[:, 0] >= starts[interval]) & (rows[:, 0] < first_live)]
+                    for row in rows:
+                        self._ingest(interval, tuple(row.tolist()), None, closed)
+                    self.backfilled += len(rows)
+                    logging.info(f"{self.pair} {interval}m: backfilled {len(rows)} candles from REST")
+                for interval, candle, received_ns in held:
+                    if self._ingest(interval, candle, received_ns, closed) is not None and interval == BASE_TIMEFRAME:
+                        price = candle[4]
+            self._persist(closed)
+        if price is not None:
+            self.orders.on_price(price)
+
+    def _reload(self):
+        """fetch_history, retried like a backfill. Returns True once the buffers hold the reloaded history."""
+        for attempt in range(config.BACKFILL_RETRIES):
+            if self.fetch_history():
+                return True
+            if attempt + 1 < config.BACKFILL_RETRIES:
+                time.sleep(config.BACKFILL_RETRY_DELAY * (attempt + 1))
+        return False
+
+    def _fetch_since(self, interval, start):
+        """CANDLE_COLUMNS rows from REST covering `start` onwards (one earlier candle is requested for margin)."""
+        for attempt in range(config.BACKFILL_RETRIES):
+            data = get_historical_ohlc(self.client, self.rest_pair, interval, int(start) - interval * 60)
+            if data is not None:
+                timestamps = data['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+                values = data[CANDLE_COLUMNS[1:]].to_numpy(dtype=np.float64)
+                return np.column_stack([timestamps.astype(np.float64), values])
+            time.sleep(config.BACKFILL_RETRY_DELAY * (attempt + 1))
+        return None
+
+    def metrics(self):
+        return {'gaps': self.gaps, 'backfilled': self.backfilled, 'reloads': self.reloads,
+                'backfilling': self._held is not None, 'last_trade': self.last_trade,
+                'book': self.book.metrics() if self.book is not None else None}
+
+    def snapshot(self):
+        """
+        Private copies of the newest config.SNAPSHOT_ROWS candles of the 1m,
+        5m and 1h frames, taken under the lock. The copy is bounded, so its
+        cost does not grow with the history length. The open candles'
+        indicator values are brought up to date first.
+        """
+        with self.lock:
+            for interval in SNAPSHOT_TIMEFRAMES:
+                buffer = self.buffers[interval]
+                self.engines[interval].write_last(buffer)
+                if interval in self.levels:
+                    self.levels[interval].write_last(buffer)
+            return tuple(
+                self.buffers[interval].to_frame(copy=True, tail=config.SNAPSHOT_ROWS)
+                for interval in SNAPSHOT_TIMEFRAMES
+            )
+
+    def memory(self):
+        """Bytes held by the candle buffers, per timeframe and in total."""
+        usage = {f'{interval}m': buffer.nbytes for interval, buffer in self.buffers.items()}
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def evaluate(self):
+        """Run the trading bot logic for this pair."""
+        if self._held is not None:
+            return  # Candles are missing until the backfill lands
+        try:
+            tick_ns = self.last_tick_ns
+            # Use the 1-minute data for decision making, confirm trend using 5-minute and 1-hour data
+            with span('snapshot'):
+                data_1m, data_5m, data_1h = self.snapshot()
+            with span('generate_signals'):
+                signal, last_price, rule = strategy.generate_signals(data_1m, data_5m, data_1h, self.pair)
+            if tick_ns is not None:
+                recorder.record('tick_to_signal', time.perf_counter_ns() - tick_ns)
+
+            orders = self.orders
+            position = orders.position
+            if position is None and signal == 'BUY':
+                with span('sizing'):
+                    atr_value = data_1m['atr'].iloc[-1]
+                    # Size once off the last close, then again off what that size is expected to fill at
+                    stop_loss_price = strategy.calculate_stop_loss(last_price, atr_value)
+                    quantity = strategy.calculate_quantity(self.account, last_price, stop_loss_price)
+                    entry_price = strategy.expected_fill_price(self.book, 'BUY', quantity, last_price)
+                    if entry_price != last_price:
+                        stop_loss_price = strategy.calculate_stop_loss(entry_price, atr_value)
+                        quantity = strategy.calculate_quantity(self.account, entry_price, stop_loss_price)
+                    take_profit_price = strategy.calculate_take_profit(entry_price, stop_loss_price)
+                if quantity > 0:
+                    with span('order'):
+                        opened = orders.open_long(quantity, entry_price, stop_loss_price, take_profit_price, rule)
+                    if tick_ns is not None:
+                        recorder.record('tick_to_order', time.perf_counter_ns() - tick_ns)
+                    if opened:
+                        self.account.invalidate()
+                        self._audit(signal, rule, entry_price, (data_1m, data_5m, data_1h), quantity=quantity,
+                                    last_price=last_price, stop_loss=stop_loss_price, take_profit=take_profit_price)
+            elif position is not None and signal == 'SELL':
+                # Stop-loss / take-profit exits are handled by OrderManager.on_price on the tick path
+                exit_price = strategy.expected_fill_price(self.book, 'SELL', position.quantity, last_price)
+                with span('order'):
+                    closed = orders.close(rule, exit_price)
+                if tick_ns is not None:
+                    recorder.record('tick_to_order', time.perf_counter_ns() - tick_ns)
+                if closed:
+                    self.account.invalidate()
+                    self._audit(signal, rule, exit_price, (data_1m, data_5m, data_1h), last_price=last_price)
+        except Exception as e:
+            logging.error(f"Error evaluating {self.pair}: {e}")
+
+    def _audit(self, signal, rule, price, frames, **fields):
+        """Audit record of a trade decision with the feature values the rules saw."""
+        f = rules.feature_vector(dict(zip(SNAPSHOT_TIMEFRAMES, frames)))
+        audit('decision', pair=self.pair, signal=signal, rule=rule, price=price, **fields,
+              features=dict(zip(rules.FEATURE_NAMES, f)))
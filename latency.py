@@ -0,0 +1,158 @@
+# latency.py
+
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import config
+
+
+class _Span:
+    """Context manager timing one stage with perf_counter_ns."""
+
+    __slots__ = ('_recorder', '_stage', '_start')
+
+    def __init__(self, recorder, stage):
+        self._recorder = recorder
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._recorder.record(self._stage, time.perf_counter_ns() - self._start)
+        return False
+
+
+class LatencyRecorder:
+    """
+    Rolling latency samples per pipeline stage. Each stage keeps its last
+    `window` durations (nanoseconds); percentiles are only computed when
+    stats are requested, so recording stays a short locked append.
+    """
+
+    def __init__(self, window=None):
+        self.window = window or config.LATENCY_WINDOW
+        self.enabled = config.LATENCY_ENABLED
+        self._samples = {}
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def span(self, stage):
+        """`with recorder.span('stage'):` times the block."""
+        return _Span(self, stage)
+
+    def record(self, stage, duration_ns):
+        if not self.enabled:
+            return
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(duration_ns)
+            self._counts[stage] += 1
+
+    def stats(self):
+        """{stage: {count, p50_us, p99_us, max_us}} over the rolling window."""
+        with self._lock:
+            stages = [(stage, list(samples)) for stage, samples in self._samples.items()]
+            counts = dict(self._counts)
+        result = {}
+        for stage, samples in stages:
+            values = np.array(samples, dtype=np.float64) / 1000.0
+            if len(values) == 0:
+                continue
+            p50, p99 = np.percentile(values, [50, 99])
+            result[stage] = {
+                'count': counts[stage],
+                'p50_us': round(float(p50), 1),
+                'p99_us': round(float(p99), 1),
+                'max_us': round(float(values.max()), 1),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler: a background thread snapshots every
+    other thread's stack each `interval` seconds and counts where they are.
+    """
+
+    def __init__(self, interval=None, depth=6):
+        self.interval = interval or config.PROFILER_INTERVAL
+        self.depth = depth
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            # Skip the profiler itself and the stats server, which only ever sit idle
+            ignored = {t.ident for t in threading.enumerate() if t.name in ('sampling-profiler', 'stats-server')}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in ignored:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.samples[' <- '.join(stack)] += 1
+
+    def report(self, top=15):
+        """The `top` most sampled stacks with their share of samples."""
+        total = sum(self.samples.values()) or 1
+        return [
+            {'stack': stack, 'samples': count, 'share': round(count / total, 4)}
+            for stack, count in self.samples.most_common(top)
+        ]
+
+
+def start_stats_server(port, collect):
+    """
+    Serve `collect()` as JSON on http://127.0.0.1:<port>/ from a daemon
+    thread. Local only; meant for curl / dashboards on the same box.
+    """
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(collect(), default=str).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep polling out of the trading log
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), StatsHandler)
+    threading.Thread(target=server.serve_forever, name='stats-server', daemon=True).start()
+    logging.info(f"Stats endpoint listening on http://127.0.0.1:{port}/")
+    return server
+
+
+# Shared recorder used across the pipeline
+recorder = LatencyRecorder()
+span = recorder.span
@@ -0,0 +1,147 @@
+# levels.py
+
+import math
+from collections import deque
+
+import config
+
+
+class RollingExtreme:
+    """
+    Rolling min or max over the last `window` candles (the open one included)
+    using a monotonic deque: each committed value is pushed and popped at most
+    once, so updates are O(1) amortized. Matches pandas
+    `rolling(window, min_periods=1).min()` / `.max()`.
+    """
+
+    __slots__ = ('window', 'sign', 'count', '_deque')
+
+    def __init__(self, window, mode):
+        self.window = window
+        self.sign = 1.0 if mode == 'max' else -1.0  # Track the max of sign * value
+        self.count = 0  # Committed candles
+        self._deque = deque()  # (index, sign * value), values strictly decreasing
+
+    def value(self, x):
+        """Extreme of the committed window plus `x` as the open candle's value."""
+        # The open candle has index `count`; committed candles older than count - window + 1 fall out
+        while self._deque and self._deque[0][0] <= self.count - self.window:
+            self._deque.popleft()
+        y = self.sign * x
+        if self._deque and self._deque[0][1] > y:
+            return self.sign * self._deque[0][1]
+        return x
+
+    def commit(self, x):
+        y = self.sign * x
+        # Expire here too, so the deque stays bounded when `value` is not called for a while
+        while self._deque and self._deque[0][0] <= self.count - self.window:
+            self._deque.popleft()
+        while self._deque and self._deque[-1][1] <= y:
+            self._deque.pop()
+        self._deque.append((self.count, y))
+        self.count += 1
+
+
+class SupportResistanceTracker:
+    """
+    Incremental support/resistance for one timeframe, with the same
+    committed-plus-open candle model (and on-demand `compute()`) as
+    IncrementalIndicators.
+
+    'support'/'resistance' are the rolling low/high over
+    config.SUPPORT_RESISTANCE_WINDOW (what calculate_support_resistance
+    returns); every window in config.SUPPORT_RESISTANCE_EXTRA_WINDOWS adds
+    'support_<w>'/'resistance_<w>'. With config.PIVOT_STRENGTH = k > 0,
+    'pivot_low'/'pivot_high' hold the latest swing levels: a candle whose
+    low/high is the extreme of the k candles on each side, known k candles
+    after it closes.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    @staticmethod
+    def columns():
+        """Buffer columns the tracker maintains, under the current config."""
+        names = ['support', 'resistance']
+        for window in config.SUPPORT_RESISTANCE_EXTRA_WINDOWS:
+            names += [f'support_{window}', f'resistance_{window}']
+        if config.PIVOT_STRENGTH > 0:
+            names += ['pivot_low', 'pivot_high']
+        return names
+
+    def reset(self):
+        windows = {'': config.SUPPORT_RESISTANCE_WINDOW}
+        windows.update({f'_{w}': w for w in config.SUPPORT_RESISTANCE_EXTRA_WINDOWS})
+        self._lows = {f'support{suffix}': RollingExtreme(w, 'min') for suffix, w in windows.items()}
+        self._highs = {f'resistance{suffix}': RollingExtreme(w, 'max') for suffix, w in windows.items()}
+        self._strength = config.PIVOT_STRENGTH
+        self._recent = deque(maxlen=2 * self._strength + 1)  # (low, high) of the latest committed candles
+        self._pivot_low = math.nan
+        self._pivot_high = math.nan
+        self._open = None
+        self.revision = 0  # Bumped by every update
+        self._computed = -1  # Revision `values` was computed for
+        self._written = -1  # Revision last written to the buffer
+        self.values = dict.fromkeys(self.columns(), math.nan)
+
+    def _commit(self, high, low):
+        for extreme in self._lows.values():
+            extreme.commit(low)
+        for extreme in self._highs.values():
+            extreme.commit(high)
+        if self._strength > 0:
+            self._recent.append((low, high))
+            if len(self._recent) == self._recent.maxlen:
+                lows = [candle[0] for candle in self._recent]
+                highs = [candle[1] for candle in self._recent]
+                k = self._strength
+                # Strict on the left so a flat run yields one pivot, not one per candle
+                if lows[k] == min(lows) and lows[k] < min(lows[:k]):
+                    self._pivot_low = lows[k]
+                if highs[k] == max(highs) and highs[k] > max(highs[:k]):
+                    self._pivot_high = highs[k]
+
+    def update(self, high, low, new_candle):
+        """Feed the latest state of the open candle (`new_candle` closes the previous one)."""
+        if new_candle and self._open is not None:
+            self._commit(*self._open)
+        self._open = (high, low)
+        self.revision += 1
+
+    def compute(self):
+        """Levels including the open candle, computed at most once per revision."""
+        if self._computed == self.revision or self._open is None:
+            return self.values
+        high, low = self._open
+        values = self.values
+        for name, extreme in self._lows.items():
+            values[name] = extreme.value(low)
+        for name, extreme in self._highs.items():
+            values[name] = extreme.value(high)
+        if self._strength > 0:
+            values['pivot_low'] = self._pivot_low
+            values['pivot_high'] = self._pivot_high
+        self._computed = self.revision
+        return values
+
+    def write_last(self, buffer, offset=1):
+        """Store the levels on a CandleBuffer row `offset` rows from the end, unless this revision already is."""
+        if self._written == self.revision or self._open is None:
+            return
+        for name, value in self.compute().items():
+            buffer.set_last(name, value, offset)
+        self._written = self.revision
+
+    def warm_up(self, buffer):
+        """Rebuild state from every candle in a CandleBuffer and fill its level columns."""
+        self.reset()
+        columns = {name: [] for name in self.values}
+        for high, low in zip(buffer.column('high'), buffer.column('low')):
+            self.update(float(high), float(low), new_candle=True)
+            for name, value in self.compute().items():
+                columns[name].append(value)
+        for name, values in columns.items():
+            buffer.set_column(name, values)
+        self._written = self.revision
@@ -0,0 +1,349 @@
+# market_bus.py
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import config
+import rules
+import strategy
+from candle_store import CandleBuffer
+
+ALIGNMENT = 64  # Sections start on cache-line boundaries
+# Global header slots
+BUS_SEQUENCE = 0  # Bumped after every published update, on any pair
+BUS_PUBLISHER_PID = 1
+BUS_CLOSED = 2  # Set when the publisher shuts down
+HEADER_SLOTS = 8
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _int64s(shm, offset, count):
+    # A memoryview rather than an ndarray: scalar reads and writes are several times cheaper
+    return shm.buf[offset:offset + 8 * count].cast('q')
+
+
+class MarketDataBus:
+    """
+    Publisher side of a shared-memory market data bus.
+
+    One `multiprocessing.shared_memory` block holds, for every pair and
+    timeframe, the storage of a CandleBuffer. The
+    publisher's Instruments build their buffers on that storage (see
+    `storage()`), so candles, indicators and levels are published by the
+    writes the bot already makes; nothing is copied.
+
+    Each pair has a seqlock header: [sequence, then (head, size, version)
+    per timeframe]. `writing()` makes the sequence odd while a tick is being
+    applied and even again once the cursors are published, so a reader that
+    sees the same even sequence before and after reading got a consistent
+    view of all the pair's timeframes. A global sequence bumped after every
+    update lets subscribers wait for changes on any pair.
+
+    The block starts with a JSON manifest describing the layout, so
+    BusSubscriber only needs the bus name.
+    """
+
+    def __init__(self, name, pairs, intervals, columns, capacity, dtype=np.float64):
+        self.name = name
+        self.pairs = list(pairs)
+        self.intervals = list(intervals)
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+
+        # Offsets are relative to the first aligned byte after the manifest
+        manifest = {'pairs': self.pairs, 'intervals': self.intervals, 'columns': self.columns,
+                    'capacity': capacity, 'dtype': self.dtype.str, 'headers': {}, 'data': {}}
+        header_size = 8 * (1 + 3 * len(self.intervals))
+        self._data_size = data_size = CandleBuffer.storage_size(capacity, self.columns, self.dtype)
+        offset = _align(8 * HEADER_SLOTS)
+        for pair in self.pairs:
+            manifest['headers'][pair] = offset
+            offset = _align(offset + header_size)
+            manifest['data'][pair] = {}
+            for interval in self.intervals:
+                manifest['data'][pair][str(interval)] = offset
+                offset = _align(offset + data_size)
+        encoded = json.dumps(manifest).encode()
+        base = _align(8 + len(encoded))
+
+        self._shm = _create(name, base + offset)
+        self._shm.buf[:8] = np.int64(len(encoded)).tobytes()
+        self._shm.buf[8:8 + len(encoded)] = encoded
+        self._base = base
+        self._header = _int64s(self._shm, base, HEADER_SLOTS)
+        self._header[BUS_PUBLISHER_PID] = multiprocessing.current_process().pid
+        self._pair_headers = {
+            pair: _int64s(self._shm, base + manifest['headers'][pair], 1 + 3 * len(self.intervals))
+            for pair in self.pairs
+        }
+        self._manifest = manifest
+        logging.info(f"Market data bus '{name}' published: {len(self.pairs)} pairs, {(base + offset) / 1e6:.1f} MB")
+
+    def storage(self, pair, interval):
+        """Slice of shared memory to back `pair`'s `interval` CandleBuffer."""
+        offset = self._base + self._manifest['data'][pair][str(interval)]
+        return self._shm.buf[offset:offset + self._data_size]
+
+    @contextlib.contextmanager
+    def writing(self, pair, buffers):
+        """Wrap every change to `pair`'s buffers; publishes their cursors and notifies subscribers on exit."""
+        header = self._pair_headers[pair]
+        header[0] += 1  # Odd: update in progress
+        try:
+            yield
+        finally:
+            slot = 1
+            for interval in self.intervals:
+                header[slot], header[slot + 1], header[slot + 2] = buffers[interval].cursor()
+                slot += 3
+            header[0] += 1
+            self._header[BUS_SEQUENCE] += 1
+
+    def close(self):
+        """Mark the bus closed for subscribers and remove the shared block."""
+        self._header[BUS_CLOSED] = 1
+        self._header.release()
+        for header in self._pair_headers.values():
+            header.release()
+        self._pair_headers = {}
+        self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # Instrument buffers still map it; the mapping goes away with the process
+
+
+def _create(name, size):
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        # Left behind by a publisher that did not shut down cleanly
+        logging.warning(f"Replacing stale market data bus '{name}'.")
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    # Only the publisher owns the block; keep it out of this process's resource tracker, which would unlink it at exit
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class BusSubscriber:
+    """
+    Reader side of a MarketDataBus, for strategy processes.
+
+    `read(pair, fn)` calls `fn` with zero-copy CandleBuffers over the
+    shared storage and retries if the publisher updated the pair meanwhile,
+    so `fn` always works on one consistent tick. `wait()` blocks until the
+    publisher has published something new.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._shm = _attach(name)
+        length = int(np.frombuffer(self._shm.buf, np.int64, 1)[0])
+        manifest = json.loads(bytes(self._shm.buf[8:8 + length]))
+        base = _align(8 + length)
+        self.pairs = manifest['pairs']
+        self.intervals = manifest['intervals']
+        self.columns = manifest['columns']
+        self.capacity = manifest['capacity']
+        self.dtype = np.dtype(manifest['dtype'])
+        size = CandleBuffer.storage_size(self.capacity, self.columns, self.dtype)
+        self._header = _int64s(self._shm, base, HEADER_SLOTS)
+        self._pair_headers = {
+            pair: _int64s(self._shm, base + manifest['headers'][pair], 1 + 3 * len(self.intervals))
+            for pair in self.pairs
+        }
+        self._storage = {}
+        for pair in self.pairs:
+            self._storage[pair] = {}
+            for interval in self.intervals:
+                offset = base + manifest['data'][pair][str(interval)]
+                self._storage[pair][interval] = self._shm.buf[offset:offset + size]
+        self._buffers = {
+            pair: {
+                interval: CandleBuffer(self.capacity, interval, self.columns, self.dtype, storage, clear=False)
+                for interval, storage in storages.items()
+            }
+            for pair, storages in self._storage.items()
+        }
+        self._seen = dict.fromkeys(self.pairs, 0)
+        self.retries = 0  # Reads repeated because the publisher wrote during them
+        self.copies = 0  # Reads that fell back to a private copy
+
+    @property
+    def closed(self):
+        return bool(self._header[BUS_CLOSED])
+
+    def sequence(self):
+        return self._header[BUS_SEQUENCE]
+
+    def wait(self, last, timeout=None):
+        """Block until the bus sequence moves past `last` (or the timeout / bus closing); returns the sequence."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._header[BUS_SEQUENCE]
+            if current != last or self._header[BUS_CLOSED]:
+                return current
+            if deadline is not None and time.monotonic() >= deadline:
+                return current
+            time.sleep(config.BUS_POLL_INTERVAL)
+
+    def changed(self):
+        """Pairs with a completed update since the previous call."""
+        pairs = []
+        for pair, header in self._pair_headers.items():
+            sequence = header[0]
+            if sequence != self._seen[pair] and not sequence & 1:
+                self._seen[pair] = sequence
+                pairs.append(pair)
+        return pairs
+
+    def _cursors(self, pair, header):
+        buffers = self._buffers[pair]
+        for i, interval in enumerate(self.intervals):
+            buffers[interval].set_cursor(header[1 + 3 * i], header[2 + 3 * i], header[3 + 3 * i])
+        return buffers
+
+    def copy(self, pair):
+        """Private copies of `pair`'s buffers, taken at one consistent tick."""
+        header = self._pair_headers[pair]
+        while True:
+            sequence = header[0]
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            copies = {}
+            for interval, buffer in self._cursors(pair, header).items():
+                copy = CandleBuffer(self.capacity, interval, self.columns, self.dtype,
+                                    bytearray(self._storage[pair][interval]), clear=False)
+                copy.set_cursor(*buffer.cursor())
+                copies[interval] = copy
+            if header[0] == sequence:
+                return copies
+            self.retries += 1
+
+    def read(self, pair, fn):
+        """
+        `fn(buffers)` over a consistent view of `pair` (interval -> CandleBuffer).
+        Reads zero-copy; if the publisher keeps writing through
+        config.BUS_READ_RETRIES attempts, runs `fn` on a private copy instead.
+        """
+        header = self._pair_headers[pair]
+        for _ in range(config.BUS_READ_RETRIES):
+            sequence = header[0]
+            if sequence & 1:
+                self.retries += 1
+                time.sleep(0)
+                continue
+            buffers = self._cursors(pair, header)
+            try:
+                result = fn(buffers)
+            except Exception:
+                if header[0] == sequence:
+                    raise
+                result = None  # Torn read; retried below
+            if header[0] == sequence:
+                return result
+            self.retries += 1
+        self.copies += 1
+        return fn(self.copy(pair))
+
+    def close(self):
+        self._buffers = {}
+        self._storage = {}
+        self._header.release()
+        for header in self._pair_headers.values():
+            header.release()
+        self._pair_headers = {}
+        self._shm.close()
+
+
+def _signals(pair):
+    def evaluate(buffers):
+        return strategy.generate_signals(*(
+            buffers[interval].to_frame(tail=config.SNAPSHOT_ROWS)
+            for interval in (config.TIMEFRAME_SHORT, config.TIMEFRAME_LONG, config.TIMEFRAME_CONFIRM)
+        ), pair)
+    return evaluate
+
+
+def run_strategy(bus_name, rules_file=None, variant=None):
+    """Run generate_signals on every update from the bus, with the rules in `rules_file` (default: the active set)."""
+    if rules_file:
+        rules.active = rules.load_rules(rules_file)
+    variant = variant or rules_file or 'default'
+    subscriber = BusSubscriber(bus_name)
+    logging.info(f"[{variant}] Subscribed to market data bus '{bus_name}': {', '.join(subscriber.pairs)}")
+    sequence = subscriber.sequence()
+    try:
+        while not subscriber.closed:
+            sequence = subscriber.wait(sequence, timeout=1.0)
+            for pair in subscriber.changed():
+                try:
+                    signal, last_price, rule = subscriber.read(pair, _signals(pair))
+                except Exception as e:
+                    logging.error(f"[{variant}] Error evaluating {pair}: {e}")
+                    continue
+                if signal:
+                    logging.info(f"[{variant}] {signal} {pair} at {last_price} (rule: {rule})")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info(f"[{variant}] Rule hits: {json.dumps(rules.active.hit_counts())}")
+        subscriber.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run strategy variants against the bot's shared-memory market data bus.")
+    parser.add_argument('--bus', default=config.BUS_NAME, help="Bus name (default: config.BUS_NAME)")
+    parser.add_argument('--rules', action='append', default=[],
+                        help="Rules JSON file for one variant; repeat to run several, each in its own process")
+    args = parser.parse_args()
+    if not args.bus:
+        parser.error("no bus name: pass --bus or set config.BUS_NAME")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(processName)s:%(message)s')
+    variants = args.rules or [None]
+    if len(variants) == 1:
+        run_strategy(args.bus, variants[0])
+        return
+    processes = [
+        multiprocessing.Process(target=run_strategy, args=(args.bus, path), name=f'variant-{i}')
+        for i, path in enumerate(variants)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()
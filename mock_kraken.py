@@ -0,0 +1,183 @@
+# mock_kraken.py
+
+import argparse
+import asyncio
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from websockets.asyncio.server import serve
+
+
+class MockKrakenServer:
+    """
+    Local stand-in for Kraken's v1 WebSocket and REST APIs, for exercising the
+    gateway without network access.
+
+    WebSocket: answers `subscribe` with `subscriptionStatus`, then streams
+    synthetic OHLC frames for every subscribed pair/interval plus heartbeats.
+    `disconnect_all()` drops every client to test reconnect and resubscribe.
+
+    REST: `/0/public/OHLC`, `/0/private/Balance` and `/0/private/AddOrder`
+    with canned responses; signatures are not checked. Point a krakenex client
+    at it by setting `client.uri` to `rest_url` (or config.REST_URL).
+    """
+
+    def __init__(self, host='127.0.0.1', ws_port=0, rest_port=0, tick_interval=0.05, balance='10000.0'):
+        self.host = host
+        self.ws_port = ws_port
+        self.rest_port = rest_port
+        self.tick_interval = tick_interval
+        self.balance = balance
+        self.subscriptions = []  # Every subscribe payload received, in order
+        self.orders = []  # Every AddOrder payload received
+        self.connections = 0
+        self._clients = set()
+        self._server = None
+        self._http = None
+
+    @property
+    def ws_url(self):
+        return f"ws://{self.host}:{self.ws_port}/"
+
+    @property
+    def rest_url(self):
+        return f"http://{self.host}:{self.rest_port}"
+
+    # WebSocket side
+
+    async def _feed(self, ws, channels):
+        price = 30000.0
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            now = time.time()
+            price += 1.0
+            for channel_id, (pair, interval) in list(channels.items()):
+                end = now - now % (interval * 60) + interval * 60
+                await ws.send(json.dumps([channel_id, [
+                    f"{now:.6f}", f"{end:.6f}", f"{price:.1f}", f"{price + 5:.1f}", f"{price - 5:.1f}",
+                    f"{price:.1f}", f"{price:.1f}", "1.00000000", 1,
+                ], f"ohlc-{interval}", pair]))
+            await ws.send('{"event":"heartbeat"}')
+
+    async def _handler(self, ws):
+        self.connections += 1
+        self._clients.add(ws)
+        channels = {}
+        feed = asyncio.create_task(self._feed(ws, channels))
+        try:
+            await ws.send(json.dumps({'event': 'systemStatus', 'status': 'online', 'version': '1.9.0'}))
+            async for raw in ws:
+                msg = json.loads(raw)
+                if msg.get('event') != 'subscribe':
+                    continue
+                self.subscriptions.append(msg)
+                interval = msg['subscription'].get('interval', 1)
+                for pair in msg['pair']:
+                    channel_id = len(channels) + 1
+                    channels[channel_id] = (pair, interval)
+                    await ws.send(json.dumps({
+                        'channelID': channel_id, 'channelName': f'ohlc-{interval}', 'event': 'subscriptionStatus',
+                        'pair': pair, 'status': 'subscribed', 'subscription': msg['subscription'],
+                    }))
+        except Exception:
+            pass
+        finally:
+            feed.cancel()
+            self._clients.discard(ws)
+
+    async def disconnect_all(self):
+        """Close every client connection, as Kraken does during maintenance."""
+        for ws in list(self._clients):
+            await ws.close()
+
+    # REST side
+
+    def _rest_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path == '/0/public/OHLC':
+                    self._reply({'error': [], 'result': server.ohlc(params)})
+                else:
+                    self._reply({'error': ['EGeneral:Unknown method'], 'result': {}})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                path = urlparse(self.path).path
+                if path == '/0/private/Balance':
+                    self._reply({'error': [], 'result': {'ZUSD': server.balance}})
+                elif path == '/0/private/AddOrder':
+                    server.orders.append(params)
+                    self._reply({'error': [], 'result': {'txid': [f'MOCK-{len(server.orders)}']}})
+                else:
+                    self._reply({'error': ['EGeneral:Unknown method'], 'result': {}})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def ohlc(self, params):
+        """A flat 720-candle history ending now for the requested pair and interval."""
+        interval = int(params.get('interval', 1))
+        step = interval * 60
+        now = int(time.time())
+        last = now - now % step
+        rows = [[last - step * i, '30000.0', '30005.0', '29995.0', '30000.0', '30000.0', '1.0', 1]
+                for i in range(719, -1, -1)]
+        return {params.get('pair', ''): rows, 'last': last}
+
+    # Lifecycle
+
+    async def start(self):
+        self._server = await serve(self._handler, self.host, self.ws_port)
+        self.ws_port = self._server.sockets[0].getsockname()[1]
+        self._http = ThreadingHTTPServer((self.host, self.rest_port), self._rest_handler())
+        self.rest_port = self._http.server_address[1]
+        threading.Thread(target=self._http.serve_forever, name='mock-kraken-rest', daemon=True).start()
+        logging.info(f"Mock Kraken listening on {self.ws_url} and {self.rest_url}")
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._http.shutdown()
+        self._http.server_close()
+
+
+async def _serve_forever(args):
+    server = MockKrakenServer(ws_port=args.ws_port, rest_port=args.rest_port, tick_interval=args.tick)
+    await server.start()
+    print(f"WEBSOCKET_URL = '{server.ws_url}'\nREST_URL = '{server.rest_url}'")
+    while True:
+        await asyncio.sleep(args.drop_every or 3600)
+        if args.drop_every:
+            await server.disconnect_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Kraken WebSocket and REST APIs.")
+    parser.add_argument('--ws-port', type=int, default=8790)
+    parser.add_argument('--rest-port', type=int, default=8791)
+    parser.add_argument('--tick', type=float, default=0.5, help="Seconds between OHLC updates")
+    parser.add_argument('--drop-every', type=float, default=0, help="Disconnect all clients every N seconds")
+    asyncio.run(_serve_forever(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+# optimizer.py
+
+import argparse
+import contextlib
+import itertools
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import config
+import indicators
+import rules
+import strategy
+from candle_store import CANDLE_COLUMNS
+
+# Default values tried per strategy setting (config attribute names)
+SEARCH_SPACE = {
+    'EMA_9_WINDOW': [5, 7, 9, 12],
+    'EMA_21_WINDOW': [18, 21, 26],
+    'EMA_50_WINDOW': [40, 50, 60],
+    'EMA_200_WINDOW': [150, 200],
+    'RSI_WINDOW': [10, 14, 21],
+    'MACD_FAST': [8, 12],
+    'MACD_SLOW': [21, 26],
+    'MACD_SIGNAL': [7, 9],
+    'S_R_BUFFER': [0.0005, 0.0011, 0.002],
+    'VOLUME_SPIKE_BUFFER': [1.1, 1.2, 1.5],
+    'ATR_MULTIPLIER': [1.0, 1.5, 2.0],
+    'RISK_REWARD_RATIO': [1.5, 2, 3],
+    'SUPPORT_RESISTANCE_WINDOW': [30, 50, 80],
+}
+TIMEFRAMES = (config.TIMEFRAME_SHORT, config.TIMEFRAME_LONG, config.TIMEFRAME_CONFIRM)
+
+
+@contextlib.contextmanager
+def override_config(params):
+    """Temporarily set config attributes, so indicators, rules and sizing all see `params`."""
+    saved = {name: getattr(config, name) for name in params}
+    for name, value in params.items():
+        setattr(config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+def is_valid(params):
+    """Reject combinations the indicators cannot represent."""
+    fast = params.get('MACD_FAST', config.MACD_FAST)
+    slow = params.get('MACD_SLOW', config.MACD_SLOW)
+    return fast < slow
+
+
+def walk_forward_splits(bars, folds, anchored=True):
+    """
+    Cut `bars` into folds + 1 equal chunks. Split k trains on the chunks before
+    chunk k (all of them when `anchored`, else only the previous one) and tests
+    on chunk k. Returns [((train_start, train_end), (test_start, test_end)), ...].
+    """
+    edges = np.linspace(0, bars, folds + 2).astype(int)
+    splits = []
+    for k in range(1, folds + 1):
+        train_start = 0 if anchored else edges[k - 1]
+        splits.append(((int(train_start), int(edges[k])), (int(edges[k]), int(edges[k + 1]))))
+    return splits
+
+
+# Parameter proposals
+
+def grid_search(space):
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(space, count, rng, seen=()):
+    """Up to `count` distinct random parameter sets not already in `seen`."""
+    seen = set(seen)
+    total = int(np.prod([len(values) for values in space.values()]))
+    proposals = []
+    for _ in range(count * 20):
+        if len(proposals) == count or len(seen) >= total:
+            break
+        params = {name: values[rng.integers(len(values))] for name, values in space.items()}
+        key = tuple(params.items())
+        if key not in seen:
+            seen.add(key)
+            proposals.append(params)
+    return proposals
+
+
+def _categorical_density(values, group, name):
+    counts = np.ones(len(values))  # Laplace smoothing keeps every value reachable
+    for params in group:
+        counts[values.index(params[name])] += 1
+    return counts / counts.sum()
+
+
+def tpe_search(space, history, count, rng, gamma=0.25, candidates=32):
+    """
+    Bayesian proposals with a Tree-structured Parzen Estimator over the
+    discrete space: evaluated sets are split into the best `gamma` fraction
+    and the rest, and candidates drawn from the good distribution are kept
+    when they maximise good/bad likelihood. `history` is [(params, score)].
+    """
+    ranked = sorted(history, key=lambda item: item[1], reverse=True)
+    n_good = max(1, int(len(ranked) * gamma))
+    good = [params for params, _ in ranked[:n_good]]
+    bad = [params for params, _ in ranked[n_good:]] or good
+    densities = {
+        name: (_categorical_density(values, good, name), _categorical_density(values, bad, name))
+        for name, values in space.items()
+    }
+    seen = {tuple(params.items()) for params, _ in history}
+    proposals = []
+    for _ in range(count):
+        best, best_ratio = None, -np.inf
+        for _ in range(candidates):
+            params, ratio = {}, 0.0
+            for name, values in space.items():
+                l, g = densities[name]
+                i = rng.choice(len(values), p=l)
+                params[name] = values[i]
+                ratio += np.log(l[i]) - np.log(g[i])
+            key = tuple(params.items())
+            if key not in seen and is_valid(params) and ratio > best_ratio:
+                best, best_ratio = params, ratio
+        if best is None:
+            break
+        seen.add(tuple(best.items()))
+        proposals.append(best)
+    return proposals
+
+
+# Shared market data
+
+def share_frames(frames):
+    """Copy each timeframe's candles into shared memory once. Returns (blocks, specs for workers)."""
+    blocks, specs = [], {}
+    for interval, data in frames.items():
+        timestamps = backtest._epoch_seconds(data).astype(np.float64)
+        values = np.column_stack([timestamps, data[CANDLE_COLUMNS[1:]].to_numpy(dtype=np.float64)])
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=np.float64, buffer=block.buf)[:] = values
+        blocks.append(block)
+        specs[interval] = (block.name, values.shape)
+    return blocks, specs
+
+
+class FeatureCache:
+    """
+    Indicator and support/resistance columns keyed by timeframe, column and
+    the settings that column depends on, so parameter sets that share e.g. an
+    EMA window reuse it. Least recently used columns are evicted past `size`.
+    """
+
+    def __init__(self, frames, size):
+        self.frames = frames
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._columns = OrderedDict()
+
+    def _get(self, key, compute):
+        column = self._columns.get(key)
+        if column is not None:
+            self.hits += 1
+            self._columns.move_to_end(key)
+            return column
+        self.misses += 1
+        column = self._columns[key] = compute()
+        if len(self._columns) > self.size:
+            self._columns.popitem(last=False)
+        return column
+
+    def _levels(self, interval):
+        data = self.frames[interval]
+        window = config.SUPPORT_RESISTANCE_WINDOW
+
+        def compute():
+            levels = strategy.calculate_support_resistance(
+                pd.DataFrame({'low': data['low'], 'high': data['high']}, copy=False), window)
+            return levels['support'].to_numpy(), levels['resistance'].to_numpy()
+
+        return self._get((interval, 'support_resistance', window), compute)
+
+    def frame(self, interval):
+        """The candles of `interval` with the columns prepare_frame adds for the strategy, under the current config."""
+        data = self.frames[interval]
+        needed = strategy.required_columns().get(interval, set())
+        columns = {name: data[name] for name in data.columns}
+        for name in indicators.resolve(needed):
+            key = (interval, name) + tuple(getattr(config, s) for s in indicators.INDICATOR_SETTINGS[name])
+            columns[name] = self._get(key, lambda: indicators.indicator_column(data, name).to_numpy())
+        if needed & {'support', 'resistance'}:
+            columns['support'], columns['resistance'] = self._levels(interval)
+        return pd.DataFrame(columns, copy=False)
+
+
+# Worker process state
+_blocks = []
+_cache = None
+
+
+def _init_worker(specs, cache_size):
+    global _cache
+    frames = {}
+    for interval, (name, shape) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _blocks.append(block)  # Keep the mapping alive for the worker's lifetime
+        values = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+        columns = {column: values[:, i] for i, column in enumerate(CANDLE_COLUMNS)}
+        columns['timestamp'] = pd.to_datetime(values[:, 0].astype(np.int64), unit='s')
+        frames[interval] = pd.DataFrame(columns, copy=False)
+    _cache = FeatureCache(frames, cache_size)
+
+
+def _evaluate_batch(batch, windows, starting_balance, fee_percentage):
+    """Backtest each parameter set over every window. Returns [[summary per window] per set]."""
+    results = []
+    for params in batch:
+        with override_config(params):
+            data_1m, data_5m, data_1h = (_cache.frame(interval) for interval in TIMEFRAMES)
+            features, valid = backtest.align_features(data_1m, data_5m, data_1h)
+            signals, _ = backtest.generate_signal_array(features, valid)
+            summaries = []
+            for start, end in windows:
+                trades = backtest.simulate_trades(
+                    data_1m.iloc[start:end], signals[start:end], features[rules.FEATURE_INDEX['atr_1m'], start:end],
+                    starting_balance, fee_percentage)
+                summaries.append(backtest.summarize(trades, starting_balance))
+        results.append(summaries)
+    return results
+
+
+def _indicator_key(params):
+    """Sort key grouping parameter sets that share indicator settings, so a worker's cache hits."""
+    settings = sorted({s for names in indicators.INDICATOR_SETTINGS.values() for s in names} |
+                      {'SUPPORT_RESISTANCE_WINDOW'})
+    return tuple(params.get(s, getattr(config, s)) for s in settings)
+
+
+class Optimizer:
+    """
+    Runs strategy backtests for many parameter sets on a process pool.
+
+    The 1m/5m/1h candles are placed in shared memory once and mapped by every
+    worker. Each worker keeps a FeatureCache, and parameter sets are batched
+    by their indicator settings so most indicator columns are computed once
+    per worker. Every set is scored on walk-forward train and test windows.
+    """
+
+    def __init__(self, data_1m, data_5m=None, data_1h=None, folds=None, anchored=True, metric='return_pct',
+                 workers=None, starting_balance=None, fee_percentage=None):
+        if data_5m is None:
+            data_5m = backtest.resample_ohlc(data_1m, config.TIMEFRAME_LONG)
+        if data_1h is None:
+            data_1h = backtest.resample_ohlc(data_1m, config.TIMEFRAME_CONFIRM)
+        self.frames = dict(zip(TIMEFRAMES, (data_1m, data_5m, data_1h)))
+        self.splits = walk_forward_splits(len(data_1m), folds or config.OPTIMIZER_FOLDS, anchored)
+        self.windows = sorted({window for split in self.splits for window in split})
+        self.metric = metric
+        self.workers = workers or config.OPTIMIZER_WORKERS or os.cpu_count()
+        self.starting_balance = starting_balance or config.BACKTEST_STARTING_BALANCE
+        self.fee_percentage = config.BACKTEST_FEE_PERCENTAGE if fee_percentage is None else fee_percentage
+        self.results = []  # One row per evaluated parameter set
+
+    def __enter__(self):
+        self._blocks, specs = share_frames(self.frames)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(specs, config.OPTIMIZER_CACHE_SIZE))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._pool.shutdown()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        return False
+
+    def evaluate(self, param_sets):
+        """Backtest `param_sets` in parallel and record them. Returns their rows."""
+        param_sets = sorted((p for p in param_sets if is_valid(p)), key=_indicator_key)
+        if not param_sets:
+            return []
+        size = max(1, -(-len(param_sets) // (self.workers * 4)))
+        batches = [param_sets[i:i + size] for i in range(0, len(param_sets), size)]
+        futures = [
+            self._pool.submit(_evaluate_batch, batch, self.windows, self.starting_balance, self.fee_percentage)
+            for batch in batches
+        ]
+        rows = []
+        for batch, future in zip(batches, futures):
+            for params, summaries in zip(batch, future.result()):
+                rows.append(self._row(params, dict(zip(self.windows, summaries))))
+        self.results.extend(rows)
+        logging.info(f"Evaluated {len(self.results)} parameter sets")
+        return rows
+
+    def _row(self, params, by_window):
+        row = dict(params)
+        for k, (train, test) in enumerate(self.splits):
+            row[f'train_{k}'] = by_window[train][self.metric]
+            row[f'test_{k}'] = by_window[test][self.metric]
+            row[f'test_trades_{k}'] = by_window[test]['trades']
+        folds = range(len(self.splits))
+        row['train_score'] = float(np.mean([row[f'train_{k}'] for k in folds]))
+        row['test_score'] = float(np.mean([row[f'test_{k}'] for k in folds]))
+        row['test_trades'] = int(sum(row[f'test_trades_{k}'] for k in folds))
+        return row
+
+    def run(self, space, method='grid', evals=200, batch=None, seed=0):
+        """Search `space` ({setting: [values]}) by 'grid', 'random' or 'bayes'."""
+        rng = np.random.default_rng(seed)
+        if method == 'grid':
+            self.evaluate(list(grid_search(space)))
+        elif method == 'random':
+            self.evaluate(random_search(space, evals, rng))
+        elif method == 'bayes':
+            batch = batch or self.workers * 2
+            self.evaluate(random_search(space, min(evals, batch), rng))
+            while len(self.results) < evals:
+                history = [({name: row[name] for name in space}, row['train_score']) for row in self.results]
+                proposals = tpe_search(space, history, min(batch, evals - len(self.results)), rng)
+                if not proposals:
+                    break
+                self.evaluate(proposals)
+        else:
+            raise ValueError(f"Unknown search method: {method}")
+        return self.ranked()
+
+    def ranked(self):
+        """Every evaluated set, best mean in-sample (train) score first, with its out-of-sample score."""
+        table = pd.DataFrame(self.results)
+        if table.empty:
+            return table
+        return table.sort_values('train_score', ascending=False).reset_index(drop=True)
+
+    def walk_forward(self, names):
+        """Per split, the set that scored best in training and how it did on the following test chunk."""
+        table = pd.DataFrame(self.results)
+        rows = []
+        for k, (train, test) in enumerate(self.splits):
+            best = table.loc[table[f'train_{k}'].idxmax()]
+            rows.append({
+                'split': k, 'train_bars': train[1] - train[0], 'test_bars': test[1] - test[0],
+                'train_score': best[f'train_{k}'], 'test_score': best[f'test_{k}'],
+                'test_trades': best[f'test_trades_{k}'], **{name: best[name] for name in names},
+            })
+        return pd.DataFrame(rows)
+
+
+def _parse_values(text):
+    values = []
+    for item in text.split(','):
+        number = float(item)
+        values.append(int(number) if number.is_integer() and '.' not in item else number)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep of the strategy with walk-forward validation.")
+    parser.add_argument('data_1m', nargs='?', help="CSV of 1-minute candles")
+    parser.add_argument('--pair', help="Load candles for this REST pair from the on-disk history store instead")
+    parser.add_argument('--data-5m', help="CSV of 5-minute candles (resampled from 1m if omitted)")
+    parser.add_argument('--data-1h', help="CSV of 1-hour candles (resampled from 1m if omitted)")
+    parser.add_argument('--method', choices=('grid', 'random', 'bayes'), default='random')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="Values to try for a config setting; repeat per setting (default: SEARCH_SPACE)")
+    parser.add_argument('--evals', type=int, default=200, help="Parameter sets to try (random / bayes)")
+    parser.add_argument('--folds', type=int, default=config.OPTIMIZER_FOLDS, help="Walk-forward test chunks")
+    parser.add_argument('--rolling', action='store_true', help="Train on the previous chunk only instead of all prior ones")
+    parser.add_argument('--metric', default='return_pct', help="backtest.summarize key to maximise")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=20, help="Rows of the ranked table to print")
+    parser.add_argument('--out', help="Write the full ranked table to this CSV file")
+    args = parser.parse_args()
+
+    if args.pair:
+        data_1m, data_5m, data_1h = backtest.load_pair(args.pair)
+        if data_1m is None:
+            parser.error(f"no 1-minute history stored for {args.pair}")
+    elif args.data_1m:
+        data_1m = backtest.load_ohlc(args.data_1m)
+        data_5m = backtest.load_ohlc(args.data_5m) if args.data_5m else None
+        data_1h = backtest.load_ohlc(args.data_1h) if args.data_1h else None
+    else:
+        parser.error("either a 1-minute CSV or --pair is required")
+
+    space = SEARCH_SPACE
+    if args.param:
+        space = {}
+        for spec in args.param:
+            name, _, values = spec.partition('=')
+            if not hasattr(config, name):
+                parser.error(f"unknown config setting: {name}")
+            space[name] = _parse_values(values)
+
+    with Optimizer(data_1m, data_5m, data_1h, args.folds, not args.rolling, args.metric, args.workers) as optimizer:
+        ranked = optimizer.run(space, args.method, args.evals, seed=args.seed)
+    if ranked.empty:
+        print("No valid parameter sets.")
+        return
+
+    columns = list(space) + ['train_score', 'test_score', 'test_trades']
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(ranked[columns].head(args.top).to_string())
+        print("\nWalk-forward (best in-sample set per split):")
+        print(optimizer.walk_forward(list(space)).to_string(index=False))
+    if args.out:
+        ranked.to_csv(args.out, index=False)
+        logging.info(f"Wrote {len(ranked)} parameter sets to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
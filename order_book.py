@@ -0,0 +1,131 @@
+# order_book.py
+
+import threading
+import zlib
+from bisect import bisect_left
+
+CHECKSUM_LEVELS = 10  # Kraken's book checksum covers the top 10 levels of each side
+
+
+def _checksum_text(text):
+    # Kraken drops the decimal point and leading zeros of each price and volume
+    return text.replace('.', '').lstrip('0')
+
+
+class BookSide:
+    """
+    One side of an L2 book, best level first, kept as parallel sorted lists
+    located with bisect. Asks sort by price and bids by negated price, so the
+    same search works for both. Levels beyond `depth` are dropped, so the
+    lists never grow past depth + 1 and updates only shift elements in place.
+    Each level's checksum fragment is built from the strings as received
+    when the level changes, so a checksum is one join and one CRC32.
+    """
+
+    __slots__ = ('depth', 'sign', 'keys', 'volumes', 'texts')
+
+    def __init__(self, depth, sign):
+        self.depth = depth
+        self.sign = sign  # 1 for asks, -1 for bids
+        self.keys = []  # sign * price, ascending
+        self.volumes = []
+        self.texts = []  # Checksum fragment per level
+
+    def clear(self):
+        del self.keys[:], self.volumes[:], self.texts[:]
+
+    def update(self, price_text, volume_text):
+        """Apply one level: a zero volume removes it, anything else inserts or replaces it."""
+        key = self.sign * float(price_text)
+        volume = float(volume_text)
+        keys = self.keys
+        i = bisect_left(keys, key)
+        found = i < len(keys) and keys[i] == key
+        if volume == 0.0:
+            if found:
+                del keys[i], self.volumes[i], self.texts[i]
+        elif found:
+            self.volumes[i] = volume
+            self.texts[i] = _checksum_text(price_text) + _checksum_text(volume_text)
+        elif i < self.depth:
+            keys.insert(i, key)
+            self.volumes.insert(i, volume)
+            self.texts.insert(i, _checksum_text(price_text) + _checksum_text(volume_text))
+            if len(keys) > self.depth:
+                keys.pop(), self.volumes.pop(), self.texts.pop()
+
+    def best(self):
+        return self.sign * self.keys[0] if self.keys else None
+
+    def checksum_text(self):
+        return ''.join(self.texts[:CHECKSUM_LEVELS])
+
+    def fill_price(self, quantity):
+        """Average price for taking `quantity` from this side, or None if the book is too thin."""
+        remaining = quantity
+        cost = 0.0
+        for key, volume in zip(self.keys, self.volumes):
+            take = volume if volume < remaining else remaining
+            cost += take * key
+            remaining -= take
+            if remaining <= 0.0:
+                return self.sign * cost / quantity
+        return None
+
+
+class OrderBook:
+    """
+    L2 order book for one pair, maintained from Kraken's `book` channel.
+
+    `apply(payloads)` takes the dicts of one book message (snapshot 'as'/'bs'
+    or update 'a'/'b', with the checksum 'c'), and returns False when the
+    CRC32 checksum of the top 10 levels disagrees with Kraken's. The book is
+    then marked invalid until the next snapshot, and the caller should
+    resubscribe.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.asks = BookSide(depth, 1)
+        self.bids = BookSide(depth, -1)
+        self.valid = False  # A snapshot has been applied and every checksum since matched
+        self.updates = 0
+        self.mismatches = 0
+        self.lock = threading.Lock()  # Readers are evaluation threads; updates come from the feed
+
+    def apply(self, payloads):
+        checksum = None
+        with self.lock:
+            for payload in payloads:
+                if 'as' in payload or 'bs' in payload:
+                    self.asks.clear()
+                    self.bids.clear()
+                    self.valid = True
+                for key, side in (('as', self.asks), ('a', self.asks), ('bs', self.bids), ('b', self.bids)):
+                    for level in payload.get(key, ()):
+                        side.update(level[0], level[1])
+                checksum = payload.get('c', checksum)
+            self.updates += 1
+            if checksum is None or not self.valid:
+                return True
+            if zlib.crc32((self.asks.checksum_text() + self.bids.checksum_text()).encode()) == int(checksum):
+                return True
+            self.valid = False
+            self.mismatches += 1
+            return False
+
+    def spread(self):
+        with self.lock:
+            ask, bid = self.asks.best(), self.bids.best()
+        return None if ask is None or bid is None else ask - bid
+
+    def expected_price(self, side, quantity):
+        """Average fill price of a `side` ('BUY' / 'SELL') market order for `quantity`, or None if unknown."""
+        with self.lock:
+            if not self.valid:
+                return None
+            return (self.asks if side == 'BUY' else self.bids).fill_price(quantity)
+
+    def metrics(self):
+        return {'valid': self.valid, 'updates': self.updates, 'mismatches': self.mismatches,
+                'best_bid': self.bids.best(), 'best_ask': self.asks.best()}
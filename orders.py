@@ -0,0 +1,562 @@
+# orders.py
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from event_log import audit
+from exchange import OrderStatusUnknown, cancel_order, find_orders, get_balances, place_order, query_orders
+from paper_exchange import split_pair
+from snapshot_store import atomic_write
+
+# Exits triggered from the price feed run here, so the feed never waits on REST
+_executor = ThreadPoolExecutor(max_workers=config.ORDER_WORKERS, thread_name_prefix='order')
+# Native exit orders: reason -> Kraken order type
+EXIT_ORDER_TYPES = {'stop_loss': 'stop-loss', 'take_profit': 'take-profit'}
+
+
+class Position:
+    """An open long position and the levels that close it."""
+
+    __slots__ = ('quantity', 'entry_price', 'stop_loss', 'take_profit', 'opened_at', 'rule', 'entry_txid',
+                 'exit_orders', 'exit_deadline', 'userref')
+
+    def __init__(self, quantity, entry_price, stop_loss, take_profit, opened_at=None, rule=None, entry_txid=None,
+                 exit_orders=None, exit_deadline=None, userref=None):
+        self.quantity = quantity
+        self.entry_price = entry_price
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.opened_at = opened_at if opened_at is not None else time.time()
+        self.rule = rule  # Rule that opened it
+        self.entry_txid = entry_txid
+        self.exit_orders = exit_orders or {}  # Reason ('stop_loss' / 'take_profit') -> txid of the native order
+        self.exit_deadline = exit_deadline  # When to stop waiting on a triggered native order
+        self.userref = userref  # Tag on the entry and native exit orders, to find them on the exchange
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__})
+
+
+class OrderManager:
+    """
+    Position, fills and exit handling for one pair.
+
+    Entries and signal exits come from strategy evaluation. Stop-loss and
+    take-profit are checked by `on_price` on every feed tick with two
+    comparisons; a crossing hands the exit to a small order thread pool, so
+    exits never wait for indicators or the strategy. Market orders are
+    booked at the price and volume the exchange reports for them in
+    QueryOrders, not at the price the strategy expected.
+
+    With config.NATIVE_EXIT_ORDERS, stop-loss and take-profit orders are
+    also placed on Kraken (or the paper simulator) after each entry, so the
+    exchange closes the position even if the bot is down. A local crossing
+    then settles from the order that filled and cancels the other one,
+    falling back to a market sell if neither fills within
+    config.NATIVE_EXIT_GRACE seconds.
+
+    The position and recent fills are saved to config.STATE_DIR after every
+    change and restored on startup. Every order is also written ahead to an
+    append-only journal, synced before the order is sent, and its fill once
+    it is known; saving the state truncates the journal. On startup, records
+    newer than the saved state are replayed, so a crash between a fill and
+    the save loses nothing.
+
+    `reconcile()` then checks the restored state against the exchange: an
+    order the journal shows in flight is looked up by its `userref`, native
+    exit orders that filled meanwhile are settled and missing ones placed
+    again, and a position the account no longer holds is dropped. An order
+    whose placement fails without a definite answer (e.g. a REST timeout) is
+    kept pending and looked up the same way before it counts as rejected.
+    """
+
+    def __init__(self, pair, rest_pair, client, state_dir=None):
+        self.pair = pair
+        self.rest_pair = rest_pair  # Orders use the REST pair name
+        self.client = client
+        self.position = None
+        self.fills = []  # Most recent fills, newest last
+        self.realized_pnl = 0.0
+        self.lock = threading.Lock()
+        self._busy = False  # An entry or exit is in flight
+        self._next_check = 0.0  # Earliest time to poll triggered native orders or retry a failed exit
+        self._exit_failures = 0  # Failed exit attempts in a row, for the retry backoff
+        self.pending = None  # Journal record of an order sent before a crash whose outcome is unknown
+        self.reconciled = 0  # Changes made by `reconcile`
+        self._seq = 0  # Sequence number of the last journal record
+        self.path = None
+        self.journal = None
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            self.path = os.path.join(state_dir, f"{rest_pair}.json")
+            self.journal_path = os.path.join(state_dir, f"{rest_pair}.journal")
+            self._load()
+            replayed = self._replay()
+            self.journal = open(self.journal_path, 'a')
+            if replayed:
+                self._save()
+
+    # Persistence
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read order state {self.path}: {e}")
+            return
+        self.position = Position.from_dict(state['position']) if state.get('position') else None
+        self.fills = state.get('fills', [])
+        self.realized_pnl = state.get('realized_pnl', 0.0)
+        self._seq = state.get('seq', 0)
+        self.pending = state.get('pending')
+        if self.position is not None:
+            logging.info(f"Recovered {self.pair} position: {self.position.to_dict()}")
+
+    def _replay(self):
+        """Apply the journal records written after the saved state. Returns how many there were."""
+        try:
+            with open(self.journal_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+        replayed = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # A torn final write; nothing after it was acted on
+            if record['seq'] <= self._seq:
+                continue  # Already in the saved state (the crash came between saving and truncating)
+            self._seq = record['seq']
+            replayed += 1
+            if record['event'] == 'order':
+                self.pending = record
+            elif record['event'] == 'rejected':
+                self.pending = None
+            elif record['event'] == 'fill':
+                self.pending = None
+                self.fills.append(record['fill'])
+                del self.fills[:-config.ORDER_STATE_FILLS]
+                self.position = Position.from_dict(record['position']) if record['position'] else None
+                self.realized_pnl = record['realized_pnl']
+        if replayed:
+            logging.warning(f"{self.pair}: replayed {replayed} journal records; position: "
+                            f"{self.position.to_dict() if self.position else None}")
+        return replayed
+
+    def _journal(self, event, **fields):
+        """Append a record to the journal and sync it to disk before the caller acts on it. Returns the record."""
+        self._seq += 1
+        record = {'seq': self._seq, 'event': event, 'time': time.time(), **fields}
+        if self.journal is not None:
+            self.journal.write(json.dumps(record) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        return record
+
+    def _save(self):
+        if self.path is None:
+            return
+        state = {
+            'pair': self.pair,
+            'position': self.position.to_dict() if self.position else None,
+            'fills': self.fills[-config.ORDER_STATE_FILLS:],
+            'realized_pnl': self.realized_pnl,
+            'seq': self._seq,
+            'pending': self.pending,
+        }
+        atomic_write(self.path, json.dumps(state).encode())
+        if self.journal is not None:
+            self.journal.truncate(0)  # Everything in it is part of the saved state now
+
+    # Helpers
+
+    def _claim(self):
+        """Mark an order action as in flight; False if one already is."""
+        with self.lock:
+            if self._busy:
+                return False
+            self._busy = True
+            return True
+
+    def _release(self):
+        with self.lock:
+            self._busy = False
+
+    def _record_fill(self, side, quantity, price, txid, reason, position):
+        """Record a fill and journal it with the `position` it leaves (None once closed)."""
+        fill = {'time': time.time(), 'side': side, 'quantity': quantity, 'price': price, 'txid': txid, 'reason': reason}
+        self.fills.append(fill)
+        del self.fills[:-config.ORDER_STATE_FILLS]
+        self._journal('fill', fill=fill, position=position.to_dict() if position else None,
+                      realized_pnl=self.realized_pnl)
+        audit('fill', pair=self.pair, paper=config.PAPER_TRADING, **fill)
+
+    @staticmethod
+    def _txid(order):
+        txids = order.get('result', {}).get('txid') if isinstance(order, dict) else None
+        return txids[0] if txids else None
+
+    def _round_price(self, price):
+        return round(price, config.PRICE_DECIMALS)
+
+    @staticmethod
+    def _new_userref():
+        """A fresh 32-bit order tag (milliseconds, wrapping every ~25 days)."""
+        return int(time.time() * 1000) % 2 ** 31
+
+    def _place_exits(self, position):
+        """Place the native stop-loss / take-profit orders the position does not have yet."""
+        for reason, ordertype in EXIT_ORDER_TYPES.items():
+            if reason in position.exit_orders:
+                continue
+            level = position.stop_loss if reason == 'stop_loss' else position.take_profit
+            try:
+                native = place_order(self.client, self.rest_pair, 'SELL', position.quantity, ordertype,
+                                     self._round_price(level), position.userref)
+                txid = self._txid(native) if native else None
+            except OrderStatusUnknown:
+                txid = self._resting_exits(position).get(reason)  # Adopt it if it did reach the exchange
+            if txid:
+                position.exit_orders[reason] = txid
+            else:
+                logging.warning(f"{self.pair}: native {ordertype} order failed; exit is tracked locally only.")
+
+    # Entry / exit
+
+    def open_long(self, quantity, price, stop_loss, take_profit, rule=None):
+        """Market-buy `quantity` and start tracking the exit levels. Returns True if the order went through."""
+        if self.position is not None or not self._claim():
+            return False
+        try:
+            if self.pending is not None and not self._resolve_pending():
+                return False  # An earlier order may still be live; never risk a second one
+            if self.position is not None:
+                return False
+            userref = self._new_userref()
+            record = self._journal('order', side='BUY', quantity=quantity, price=price, stop_loss=stop_loss,
+                                   take_profit=take_profit, rule=rule, userref=userref)
+            try:
+                order = place_order(self.client, self.rest_pair, 'BUY', quantity, userref=userref)
+            except OrderStatusUnknown:
+                self._resolve_unknown(record)
+                if self.position is not None and config.NATIVE_EXIT_ORDERS:
+                    self._place_exits(self.position)
+                    self._save()
+                return self.position is not None
+            if not order:
+                self._journal('rejected', userref=userref)
+                return False
+            txid = self._txid(order)
+            filled = self._await_fill(txid)
+            if filled is not None:
+                if filled[0] <= 0:
+                    self._journal('rejected', userref=userref)
+                    return False
+                quantity, price = filled[0], filled[1] or price
+            position = Position(quantity, price, stop_loss, take_profit, rule=rule, entry_txid=txid, userref=userref)
+            self._record_fill('BUY', quantity, price, txid, rule, position)
+            if config.NATIVE_EXIT_ORDERS:
+                self._place_exits(position)
+            self.position = position
+            self._save()
+            logging.info(f"Bought {quantity} {self.pair} at {price} (rule: {rule}, SL {stop_loss}, TP {take_profit})")
+            return True
+        finally:
+            self._release()
+
+    def close(self, reason, price):
+        """Exit the whole position at market (cancelling any native exit orders first)."""
+        if self.position is None or not self._claim():
+            return False
+        try:
+            return self._close(reason, price)
+        finally:
+            self._release()
+
+    def _close(self, reason, price):
+        if self.pending is not None and not self._resolve_pending():
+            return False  # The last sell may still be live; selling again could open a short
+        position = self.position
+        if position is None:
+            return True  # That sell went through
+        if position.exit_orders:
+            filled = self._cancel_native(position)
+            if filled is not None:
+                return self._settle(*filled)
+        record = self._journal('order', side='SELL', quantity=position.quantity, price=price, reason=reason,
+                               userref=position.userref)
+        try:
+            order = place_order(self.client, self.rest_pair, 'SELL', position.quantity, userref=position.userref)
+        except OrderStatusUnknown:
+            self._resolve_unknown(record)
+            return self.position is None
+        if not order:
+            self._journal('rejected', userref=position.userref)
+            return False
+        txid = self._txid(order)
+        filled = self._await_fill(txid)
+        if filled is not None:
+            if filled[0] <= 0:
+                self._journal('rejected', userref=position.userref)
+                return False
+            price = filled[1] or price
+        return self._settle(reason, price, txid)
+
+    def _settle(self, reason, price, txid):
+        position = self.position
+        self.realized_pnl += (price - position.entry_price) * position.quantity
+        self._record_fill('SELL', position.quantity, price, txid, reason, None)
+        self.position = None
+        self._save()
+        logging.info(f"Sold {position.quantity} {self.pair} at {price} ({reason})")
+        return True
+
+    def _await_fill(self, txid):
+        """
+        (executed volume, average price) of market order `txid` once the
+        exchange is done with it, volume 0 if it was cancelled unfilled, or
+        None if it is still working after config.FILL_POLL_ATTEMPTS checks.
+        """
+        if txid is None:
+            return None
+        for attempt in range(config.FILL_POLL_ATTEMPTS):
+            if attempt:
+                time.sleep(config.FILL_POLL_INTERVAL)
+            info = query_orders(self.client, [txid]).get(txid)
+            if info is not None and info.get('status') in ('closed', 'canceled', 'expired'):
+                return float(info.get('vol_exec') or 0.0), float(info.get('price') or 0.0)
+        logging.warning(f"{self.pair}: fill of order {txid} not confirmed yet; booking the expected price.")
+        return None
+
+    def _filled_native(self, position):
+        """(reason, average price, txid) of a native exit order that has filled, or None."""
+        orders = query_orders(self.client, list(position.exit_orders.values()))
+        for reason, txid in position.exit_orders.items():
+            info = orders.get(txid)
+            if info and info.get('status') == 'closed':
+                return reason, float(info.get('price') or 0.0), txid
+        return None
+
+    def _cancel_native(self, position):
+        """Cancel the native exit orders; returns the fill if one of them had already closed the position."""
+        filled = self._filled_native(position)
+        for reason, txid in position.exit_orders.items():
+            if filled is None or txid != filled[2]:
+                if not cancel_order(self.client, txid) and filled is None:
+                    filled = self._filled_native(position)  # It may have filled since the query
+        position.exit_orders = {}
+        return filled
+
+    # Startup
+
+    def reconcile(self):
+        """Check the restored position, and any order left in flight by a crash, against the exchange."""
+        if not self._claim():
+            return
+        try:
+            if self.pending is not None:
+                self._resolve_pending()
+            position = self.position
+            if position is not None and config.NATIVE_EXIT_ORDERS:
+                position = self._sync_exits(position)
+            if position is not None:
+                self._check_holding(position)
+        except Exception as e:
+            logging.error(f"Error reconciling {self.pair}: {e}")
+        finally:
+            self._release()
+
+    def _resolve_unknown(self, record):
+        """Keep an order whose outcome is unknown pending and look it up by userref until it is settled."""
+        self.pending = record
+        self._save()
+        time.sleep(config.ORDER_LOOKUP_DELAY)  # Let the exchange finish with it before the first lookup
+        self._resolve_pending(config.ORDER_LOOKUP_ATTEMPTS)
+
+    def _resolve_pending(self, attempts=1):
+        """
+        Apply the outcome of the order the journal shows in flight, found on
+        the exchange by its userref. It counts as rejected only once `attempts`
+        lookups have all come back without it. Returns True once resolved; the
+        record stays pending while lookups fail or the order is still working.
+        """
+        record = self.pending
+        side = record['side']
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(config.ORDER_LOOKUP_DELAY)
+            orders = find_orders(self.client, record['userref']) if record.get('userref') is not None else {}
+            if orders is None:
+                continue
+            working = False
+            for txid, info in orders.items():
+                descr = info.get('descr', {})
+                if descr.get('type') != side.lower() or descr.get('ordertype') != 'market':
+                    continue
+                executed = float(info.get('vol_exec') or 0.0)
+                if info.get('status') in ('pending', 'open'):
+                    working = True
+                if info.get('status') != 'closed' or executed <= 0:
+                    continue
+                self._apply_pending(record, txid, executed, float(info.get('price') or record['price']))
+                return True
+            if not working and attempt == attempts - 1:
+                logging.warning(f"{self.pair}: in-flight {side} order {record['userref']} was not placed.")
+                self._journal('rejected', userref=record['userref'])
+                self.pending = None
+                self._save()
+                return True
+        logging.warning(f"{self.pair}: could not resolve in-flight order {record}; keeping it pending.")
+        return False
+
+    def _apply_pending(self, record, txid, executed, price):
+        side = record['side']
+        logging.warning(f"{self.pair}: in-flight {side} order {txid} filled at {price}.")
+        self.pending = None
+        if side == 'BUY' and self.position is None:
+            position = Position(executed, price, record['stop_loss'], record['take_profit'], rule=record['rule'],
+                                entry_txid=txid, userref=record['userref'])
+            self._record_fill('BUY', executed, price, txid, record['rule'], position)
+            self.position = position
+        elif side == 'SELL' and self.position is not None:
+            self._settle(record['reason'], price, txid)
+        self.reconciled += 1
+        self._save()
+
+    def _sync_exits(self, position):
+        """
+        Settle the position if a native exit order filled while the bot was
+        down; otherwise make sure both exit orders are resting, adopting ones
+        placed just before a crash. Returns the position, or None if settled.
+        """
+        if position.exit_orders:
+            filled = self._filled_native(position)
+            if filled is not None:
+                logging.warning(f"{self.pair}: native {filled[0]} order filled while the bot was down.")
+                self._cancel_native(position)
+                self._settle(*filled)
+                self.reconciled += 1
+                return None
+        known = query_orders(self.client, list(position.exit_orders.values())) if position.exit_orders else {}
+        resting = {reason: txid for reason, txid in position.exit_orders.items()
+                   if known.get(txid, {}).get('status') == 'open'}
+        for reason, txid in self._resting_exits(position).items():
+            resting.setdefault(reason, txid)
+        if resting != position.exit_orders:
+            self.reconciled += 1
+        position.exit_orders = resting
+        self._place_exits(position)
+        self._save()
+        return position
+
+    def _resting_exits(self, position):
+        """{reason: txid} of the open native exit orders tagged with the position's userref."""
+        if position.userref is None:
+            return {}
+        reasons = {ordertype: reason for reason, ordertype in EXIT_ORDER_TYPES.items()}
+        resting = {}
+        for txid, info in (find_orders(self.client, position.userref) or {}).items():
+            reason = reasons.get(info.get('descr', {}).get('ordertype'))
+            if reason is not None and info.get('status') == 'open':
+                resting.setdefault(reason, txid)
+        return resting
+
+    def _check_holding(self, position):
+        """Drop the position if the account no longer holds it (e.g. it was sold outside the bot)."""
+        try:
+            base = split_pair(self.rest_pair)[0]
+        except ValueError:
+            return
+        balances = get_balances(self.client)
+        if balances is None:
+            return
+        held = balances.get(base, 0.0)
+        if held >= position.quantity * (1 - config.RECONCILE_TOLERANCE):
+            return
+        logging.warning(f"{self.pair}: account holds {held} {base} but the position is {position.quantity}; "
+                        f"dropping it as closed outside the bot.")
+        if position.exit_orders:
+            self._cancel_native(position)
+        audit('reconcile', pair=self.pair, held=held, position=position.to_dict())
+        self.position = None
+        self.reconciled += 1
+        self._save()
+
+    # Tick path
+
+    def on_price(self, price):
+        """Check the exit levels against the latest trade price. Cheap; safe to call on every tick."""
+        position = self.position
+        if position is None or self._busy:
+            return
+        if price <= position.stop_loss:
+            reason = 'stop_loss'
+        elif price >= position.take_profit:
+            reason = 'take_profit'
+        else:
+            if position.exit_deadline is not None:
+                position.exit_deadline = None  # Back inside the levels; restart the grace period next time
+            return
+        if time.monotonic() < self._next_check:
+            return
+        if self._claim():
+            _executor.submit(self._exit, reason, price)
+
+    def _exit(self, reason, price):
+        try:
+            position = self.position
+            if position is None:
+                return
+            if position.exit_orders:
+                filled = self._filled_native(position)
+                if filled is not None:
+                    self._cancel_native(position)
+                    self._settle(*filled)
+                    return
+                # Give the exchange a moment to trigger its own order before selling at market
+                now = time.time()
+                if position.exit_deadline is None:
+                    position.exit_deadline = now + config.NATIVE_EXIT_GRACE
+                    self._save()
+                if now < position.exit_deadline:
+                    self._next_check = time.monotonic() + config.NATIVE_EXIT_POLL_INTERVAL
+                    return
+                logging.warning(f"{self.pair}: native {reason} order has not filled; closing at market.")
+            if self._close(reason, price):
+                self._exit_failures = 0
+                return
+            self._retry_later()
+        except Exception as e:
+            logging.error(f"Error exiting {self.pair} position: {e}")
+            self._retry_later()
+        finally:
+            self._release()
+
+    def _retry_later(self):
+        """Back off before the next exit attempt, doubling the wait after each failure in a row."""
+        self._exit_failures += 1
+        delay = min(config.EXIT_RETRY_MAX_DELAY, config.NATIVE_EXIT_POLL_INTERVAL * 2 ** (self._exit_failures - 1))
+        self._next_check = time.monotonic() + delay
+        logging.warning(f"{self.pair}: exit failed ({self._exit_failures} in a row); retrying in {delay}s.")
+
+    def metrics(self):
+        position = self.position
+        return {
+            'position': position.to_dict() if position else None,
+            'realized_pnl': round(self.realized_pnl, 8),
+            'fills': len(self.fills),
+            'reconciled': self.reconciled,
+        }
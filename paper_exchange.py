@@ -0,0 +1,400 @@
+# paper_exchange.py
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+
+import config
+
+FEE_WINDOW = 30 * 24 * 3600  # Kraken tiers fees on 30-day traded volume
+ORDER_TYPES = ('market', 'limit', 'stop-loss', 'take-profit')
+
+
+def _ok(result):
+    return {'error': [], 'result': result}
+
+
+def _error(message):
+    return {'error': [message], 'result': {}}
+
+
+def split_pair(pair):
+    """(base, quote) assets of a REST pair in config.QUOTE_ASSET, e.g. 'XXBTZUSD' -> ('XXBT', 'ZUSD')."""
+    quote = config.QUOTE_ASSET
+    for suffix in (quote, quote[1:] if quote[0] in 'XZ' and len(quote) == 4 else None):
+        if suffix and pair.endswith(suffix) and len(pair) > len(suffix):
+            return pair[:-len(suffix)], quote
+    raise ValueError(f"{pair} is not quoted in {quote}")
+
+
+class PaperOrder:
+    """One simulated order; `info()` renders it the way Kraken's QueryOrders does."""
+
+    __slots__ = ('txid', 'pair', 'side', 'ordertype', 'volume', 'price', 'opened', 'active_at', 'status',
+                 'closed', 'fill_price', 'cost', 'fee', 'reason', 'rested', 'userref')
+
+    def __init__(self, txid, pair, side, ordertype, volume, price, opened, active_at, userref=None):
+        self.txid = txid
+        self.pair = pair
+        self.side = side  # 'buy' / 'sell'
+        self.ordertype = ordertype
+        self.volume = volume
+        self.price = price  # Limit price, or trigger price for stop-loss / take-profit
+        self.opened = opened
+        self.active_at = active_at  # When the order reaches the simulated matching engine
+        self.status = 'open'
+        self.closed = None
+        self.fill_price = 0.0
+        self.cost = 0.0
+        self.fee = 0.0
+        self.reason = None
+        self.rested = False  # A limit order that was not marketable on arrival, so it fills as maker
+        self.userref = userref
+
+    def description(self):
+        at = 'market' if self.ordertype == 'market' else f'{self.ordertype} {self.price}'
+        return f'{self.side} {self.volume:.8f} {self.pair} @ {at}'
+
+    def info(self):
+        filled = self.status == 'closed'
+        return {
+            'status': self.status, 'opentm': self.opened, 'closetm': self.closed, 'reason': self.reason,
+            'userref': self.userref,
+            'descr': {'pair': self.pair, 'type': self.side, 'ordertype': self.ordertype,
+                      'price': f'{self.price or 0:.8f}', 'order': self.description()},
+            'vol': f'{self.volume:.8f}', 'vol_exec': f'{self.volume if filled else 0:.8f}',
+            'cost': f'{self.cost:.8f}', 'fee': f'{self.fee:.8f}', 'price': f'{self.fill_price:.8f}',
+        }
+
+
+class PaperExchange:
+    """
+    Local matching simulator with the krakenex client interface, used in
+    place of Kraken for private calls when config.PAPER_TRADING is set.
+
+    Supports Balance, AddOrder (market, limit, stop-loss, take-profit),
+    CancelOrder, QueryOrders, OpenOrders, ClosedOrders and TradesHistory
+    (orders optionally tagged and listed by `userref`), answering in Kraken's response format and error strings. Public calls
+    (OHLC history) go to the wrapped `public` client.
+
+    Orders are matched against the market stream fed through `on_candle`
+    and `on_price` (trade prints); the simulator's clock is the time of the
+    latest event, so the same code serves live paper trading and offline
+    replay. An order reaches the book config.PAPER_LATENCY seconds after it
+    is placed and is matched against the first prices after that:
+
+    - market orders fill at the price of that event, walking the pair's
+      OrderBook when one is attached (`attach_book`) and otherwise paying
+      config.PAPER_SLIPPAGE_BPS;
+    - stop-loss / take-profit orders trigger when the price crosses their
+      level and fill there (or at the first price past it, on a gap), with
+      the same slippage;
+    - limit orders fill at their price as maker once they have rested, or
+      at the market as taker if marketable on arrival.
+
+    Only price movement since the previous event can trigger an order, so
+    live revisions of an open candle do not replay its earlier range.
+
+    Fees follow config.PAPER_FEE_SCHEDULE on the rolling 30-day volume and
+    are charged in the quote asset. Fills debit and credit the balances
+    that Balance (and so position sizing) reports; an order that cannot be
+    paid for when it fills is cancelled with 'Insufficient funds'.
+
+    An event for a pair without open orders only records the price, so
+    replaying millions of events costs little beyond the feed itself.
+    """
+
+    def __init__(self, public=None, balances=None, latency=None, fee_schedule=None, slippage_bps=None):
+        self.public = public
+        self.balances = dict(config.PAPER_BALANCES if balances is None else balances)
+        self.starting_balances = dict(self.balances)
+        self.latency = config.PAPER_LATENCY if latency is None else latency
+        schedule = sorted(config.PAPER_FEE_SCHEDULE if fee_schedule is None else fee_schedule)
+        self._tiers = [volume for volume, _, _ in schedule]
+        self._rates = [(maker / 100, taker / 100) for _, maker, taker in schedule]
+        self.slippage = (config.PAPER_SLIPPAGE_BPS if slippage_bps is None else slippage_bps) / 10000
+        self.now = time.time()
+        self.events = 0
+        self.fees_paid = 0.0
+        self.deposited = 0.0  # Quote value of assets credited by `deposit`, for P&L
+        self.orders = {}  # txid -> PaperOrder, open and recent closed
+        self.trades = {}  # Trade id -> Kraken TradesHistory entry
+        self._open = {}  # Pair -> open orders; a pair is only present while it has some
+        self._last = {}  # Pair -> latest price
+        self._candles = {}  # Pair -> (start, high, low, close) of the latest candle revision
+        self._books = {}
+        self._volume = deque()  # (time, quote volume) of fills inside the fee window
+        self._volume_total = 0.0
+        self._ids = 0
+        self._trade_ids = 0
+        self._lock = threading.Lock()
+
+    def deposit(self, asset, amount, price=0.0):
+        """Credit `amount` of `asset`, worth `price` each in the quote asset (e.g. a restored position)."""
+        with self._lock:
+            self.balances[asset] = self.balances.get(asset, 0.0) + amount
+            self.deposited += amount * price
+
+    # Market stream
+
+    def attach_book(self, pair, book):
+        """Fill `pair`'s market orders by walking `book` (an OrderBook) while it is valid."""
+        self._books[pair] = book
+
+    def on_price(self, pair, price, timestamp=None):
+        """A trade or quote at `price`."""
+        self.events += 1
+        self.now = time.time() if timestamp is None else timestamp
+        start = self._last.get(pair, price)
+        self._last[pair] = price
+        if pair in self._open:
+            with self._lock:
+                self._match(pair, start, min(start, price), max(start, price), price)
+
+    def on_candle(self, pair, candle, timestamp=None):
+        """
+        A base-timeframe candle or revision of the open candle (CANDLE_COLUMNS
+        order) at `timestamp`; live feeds pass the arrival time, and replayed
+        candles default to their close time.
+        """
+        self.events += 1
+        start_time, open_, high, low, close = candle[0], candle[1], candle[2], candle[3], candle[4]
+        previous = self._candles.get(pair)
+        self._candles[pair] = (start_time, high, low, close)
+        if previous is not None and previous[0] == start_time:
+            # Same candle: only new extremes and the move from the last close happened since the previous event
+            start = previous[3]
+            low = low if low < previous[2] else min(start, close)
+            high = high if high > previous[1] else max(start, close)
+        else:
+            start = open_
+        self.now = start_time + config.TIMEFRAMES[0] * 60 if timestamp is None else timestamp
+        self._last[pair] = close
+        if pair in self._open:
+            with self._lock:
+                self._match(pair, start, low, high, close)
+
+    def _match(self, pair, start, low, high, last):
+        """Fill or trigger `pair`'s open orders on a move from `start` through [low, high] to `last`."""
+        remaining = []
+        for order in self._open[pair]:
+            if order.status != 'open':
+                continue
+            if self.now < order.active_at:
+                remaining.append(order)
+                continue
+            buy = order.side == 'buy'
+            if order.ordertype == 'market':
+                self._fill(order, self._market_price(pair, buy, order.volume, last), taker=True)
+            elif order.ordertype == 'limit':
+                if not order.rested:
+                    if (start <= order.price) if buy else (start >= order.price):
+                        self._fill(order, self._market_price(pair, buy, order.volume, start), taker=True)
+                        continue
+                    order.rested = True
+                if (low <= order.price) if buy else (high >= order.price):
+                    self._fill(order, order.price, taker=False)
+                else:
+                    remaining.append(order)
+            else:
+                # Stop-loss triggers on a move against the position, take-profit on a move in its favour
+                rising = (order.ordertype == 'stop-loss') == buy
+                if rising and high >= order.price:
+                    self._fill(order, self._slipped(max(order.price, start), buy), taker=True)
+                elif not rising and low <= order.price:
+                    self._fill(order, self._slipped(min(order.price, start), buy), taker=True)
+                else:
+                    remaining.append(order)
+        if remaining:
+            self._open[pair] = remaining
+        else:
+            del self._open[pair]
+
+    def _pending(self, pair, side):
+        """Volume of `pair` market orders on `side` that have not reached the book yet."""
+        return sum(order.volume for order in self._open.get(pair, ())
+                   if order.status == 'open' and order.side == side and order.ordertype == 'market')
+
+    def _slipped(self, price, buy):
+        return price * (1 + self.slippage) if buy else price * (1 - self.slippage)
+
+    def _market_price(self, pair, buy, volume, last):
+        book = self._books.get(pair)
+        if book is not None:
+            price = book.expected_price('BUY' if buy else 'SELL', volume)
+            if price is not None:
+                return price
+        return self._slipped(last, buy)
+
+    # Fills and fees
+
+    def fee_rates(self):
+        """(maker, taker) fee fractions for the current 30-day volume."""
+        horizon = self.now - FEE_WINDOW
+        volume = self._volume
+        while volume and volume[0][0] < horizon:
+            self._volume_total -= volume.popleft()[1]
+        tier = bisect.bisect_right(self._tiers, self._volume_total) - 1
+        return self._rates[max(tier, 0)]
+
+    def _fill(self, order, price, taker):
+        base, quote = split_pair(order.pair)
+        cost = order.volume * price
+        fee = cost * self.fee_rates()[1 if taker else 0]
+        balances = self.balances
+        if order.side == 'buy':
+            if balances.get(quote, 0.0) < cost + fee:
+                return self._cancel(order, 'Insufficient funds')
+            balances[quote] -= cost + fee
+            balances[base] = balances.get(base, 0.0) + order.volume
+        else:
+            if balances.get(base, 0.0) < order.volume - 1e-12:
+                return self._cancel(order, 'Insufficient funds')
+            balances[base] = max(0.0, balances[base] - order.volume)
+            balances[quote] = balances.get(quote, 0.0) + cost - fee
+        order.status = 'closed'
+        order.closed = self.now
+        order.fill_price = price
+        order.cost = cost
+        order.fee = fee
+        self.fees_paid += fee
+        self._volume.append((self.now, cost))
+        self._volume_total += cost
+        self._trade_ids += 1
+        self.trades[f'PAPER-T{self._trade_ids}'] = {
+            'ordertxid': order.txid, 'pair': order.pair, 'time': self.now, 'type': order.side,
+            'ordertype': order.ordertype, 'price': f'{price:.8f}', 'cost': f'{cost:.8f}', 'fee': f'{fee:.8f}',
+            'vol': f'{order.volume:.8f}', 'maker': not taker,
+        }
+        self._prune(self.trades)
+        logging.debug(f"Paper fill {order.txid}: {order.description()} at {price} (fee {fee:.4f})")
+
+    def _cancel(self, order, reason):
+        order.status = 'canceled'
+        order.closed = self.now
+        order.reason = reason
+
+    @staticmethod
+    def _prune(records):
+        excess = len(records) - config.PAPER_HISTORY_SIZE
+        if excess > 0:
+            for key in list(records)[:excess]:
+                del records[key]
+
+    # krakenex interface
+
+    def query_public(self, method, data=None):
+        if self.public is None:
+            return _error('EGeneral:Unknown method')
+        return self.public.query_public(method, data)
+
+    def query_private(self, method, data=None):
+        handler = getattr(self, f'_private_{method}', None)
+        if handler is None:
+            return _error('EGeneral:Unknown method')
+        with self._lock:
+            try:
+                return handler(data or {})
+            except (KeyError, ValueError) as e:
+                return _error(f'EGeneral:Invalid arguments:{e}')
+
+    def _private_Balance(self, data):
+        return _ok({asset: f'{amount:.8f}' for asset, amount in self.balances.items()})
+
+    def _private_AddOrder(self, data):
+        pair = data['pair']
+        side = data['type'].lower()
+        ordertype = data.get('ordertype', 'market')
+        volume = float(data['volume'])
+        price = float(data['price']) if data.get('price') is not None else None
+        userref = int(data['userref']) if data.get('userref') is not None else None
+        if side not in ('buy', 'sell') or ordertype not in ORDER_TYPES:
+            return _error('EGeneral:Invalid arguments')
+        if volume <= 0 or (ordertype != 'market' and not price):
+            return _error('EGeneral:Invalid arguments:volume/price')
+        base, quote = split_pair(pair)
+        last = self._last.get(pair)
+        # Resting orders are only checked when they fill: exits are placed while the entry may still be in flight
+        if ordertype == 'market':
+            if side == 'buy' and last is not None:
+                # Priced the way _fill will charge it: slipped (or book-walked) cost plus the taker fee
+                cost = volume * self._market_price(pair, True, volume, last)
+                if self.balances.get(quote, 0.0) < cost * (1 + self.fee_rates()[1]):
+                    return _error('EOrder:Insufficient funds')
+            if side == 'sell' and self.balances.get(base, 0.0) + self._pending(pair, 'buy') < volume - 1e-12:
+                return _error('EOrder:Insufficient funds')
+
+        self._ids += 1
+        order = PaperOrder(f'PAPER-{self._ids}', pair, side, ordertype, volume, price, self.now,
+                           self.now + self.latency, userref)
+        if data.get('validate'):
+            return _ok({'descr': {'order': order.description()}})
+        self.orders[order.txid] = order
+        self._prune(self.orders)
+        self._open.setdefault(pair, []).append(order)
+        if self.latency <= 0 and last is not None:
+            self._match(pair, last, last, last, last)
+        return _ok({'descr': {'order': order.description()}, 'txid': [order.txid]})
+
+    def _private_CancelOrder(self, data):
+        order = self.orders.get(data['txid'])
+        if order is None:
+            return _error('EOrder:Unknown order')
+        if order.status != 'open':
+            return _ok({'count': 0})
+        self._cancel(order, 'User requested')
+        return _ok({'count': 1})
+
+    def _private_QueryOrders(self, data):
+        result = {}
+        for txid in str(data['txid']).split(','):
+            order = self.orders.get(txid)
+            if order is None:
+                return _error('EOrder:Unknown order')
+            result[txid] = order.info()
+        return _ok(result)
+
+    def _listed(self, data, is_open):
+        userref = int(data['userref']) if data.get('userref') is not None else None
+        return {txid: order.info() for txid, order in self.orders.items()
+                if (order.status == 'open') == is_open and (userref is None or order.userref == userref)}
+
+    def _private_OpenOrders(self, data):
+        return _ok({'open': self._listed(data, True)})
+
+    def _private_ClosedOrders(self, data):
+        closed = self._listed(data, False)
+        return _ok({'closed': closed, 'count': len(closed)})
+
+    def _private_TradesHistory(self, data):
+        return _ok({'trades': dict(self.trades), 'count': len(self.trades)})
+
+    # Reporting
+
+    def equity(self):
+        """Balances marked to the latest prices, in the quote asset."""
+        quote = config.QUOTE_ASSET
+        value = self.balances.get(quote, 0.0)
+        for pair, price in self._last.items():
+            try:
+                base = split_pair(pair)[0]
+            except ValueError:
+                continue
+            value += self.balances.get(base, 0.0) * price
+        return value
+
+    def metrics(self):
+        start = self.starting_balances.get(config.QUOTE_ASSET, 0.0) + self.deposited
+        equity = self.equity()
+        return {
+            'equity': round(equity, 8),
+            'pnl': round(equity - start, 8),  # Against the starting quote balance plus deposits
+            'fees': round(self.fees_paid, 8),
+            'volume_30d': round(self._volume_total, 2),
+            'open_orders': sum(order.status == 'open' for orders in self._open.values() for order in orders),
+            'fills': len(self.trades),
+            'events': self.events,
+            'balances': {asset: round(amount, 8) for asset, amount in self.balances.items()},
+        }
@@ -0,0 +1,98 @@
+# resampler.py
+
+import math
+
+import numpy as np
+
+from candle_store import CANDLE_COLUMNS
+
+
+class CandleAggregator:
+    """
+    Builds `interval`-minute candles incrementally from a finer base stream
+    (normally the 1m OHLC feed), so higher timeframes never need their own
+    subscription and always agree exactly with the base candles.
+
+    Closed base candles in the current bucket are folded into a committed
+    aggregate; the open base candle is combined with it on every update, so
+    revising the open base candle is O(1) as well. Candles use CANDLE_COLUMNS
+    order with the start time as timestamp.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.seconds = interval * 60
+        self._bucket = None
+        self._open = None  # Latest revision of the open base candle
+        self._reset()
+
+    def _reset(self):
+        self._count = 0  # Committed base candles in the bucket
+        self._first_open = math.nan
+        self._high = -math.inf
+        self._low = math.inf
+        self._volume = 0.0
+        self._traded = 0.0  # Sum of vwap * volume, for the bucket VWAP
+        self._trades = 0.0
+
+    def _commit(self, candle):
+        if self._count == 0:
+            self._first_open = candle[1]
+        self._high = max(self._high, candle[2])
+        self._low = min(self._low, candle[3])
+        self._volume += candle[6]
+        self._traded += candle[5] * candle[6]
+        self._trades += candle[7]
+        self._count += 1
+
+    def _current(self):
+        candle = self._open
+        volume = self._volume + candle[6]
+        traded = self._traded + candle[5] * candle[6]
+        return (
+            float(self._bucket),
+            self._first_open if self._count else candle[1],
+            max(self._high, candle[2]),
+            min(self._low, candle[3]),
+            candle[4],
+            traded / volume if volume > 0 else candle[5],
+            volume,
+            self._trades + candle[7],
+        )
+
+    def update(self, candle, new_candle):
+        """
+        Feed the latest revision of the open base candle (`new_candle` when it
+        just started). Returns the higher-timeframe candle it belongs to.
+        """
+        bucket = candle[0] - candle[0] % self.seconds
+        if new_candle and self._open is not None and bucket == self._bucket:
+            self._commit(self._open)
+        if bucket != self._bucket:
+            self._bucket = bucket
+            self._reset()
+        self._open = candle
+        return self._current()
+
+    def seed(self, buffer):
+        """
+        Rebuild the current bucket from a base CandleBuffer whose newest row is
+        the open candle. Returns the aggregated candle, or None if the buffer
+        is empty or does not reach back to the start of the bucket.
+        """
+        if len(buffer) == 0:
+            return None
+        timestamps = buffer.column('timestamp')
+        bucket = timestamps[-1] - timestamps[-1] % self.seconds
+        first = int(np.searchsorted(timestamps, bucket))
+        if first == 0 and timestamps[0] > bucket:
+            return None
+
+        columns = [buffer.column(name) for name in CANDLE_COLUMNS]
+        rows = [tuple(float(column[i]) for column in columns) for i in range(first, len(buffer))]
+        self._bucket = bucket
+        self._reset()
+        for row in rows[:-1]:
+            self._commit(row)
+        self._open = rows[-1]
+        return self._current()
@@ -0,0 +1,326 @@
+# rules.py
+
+import ast
+import json
+import threading
+
+import numpy as np
+
+import config
+
+SHORT, LONG, CONFIRM = config.TIMEFRAME_SHORT, config.TIMEFRAME_LONG, config.TIMEFRAME_CONFIRM
+
+# Features the rules read: name -> (timeframe, column, candles back from the newest)
+FEATURES = {
+    'last_price': (SHORT, 'close', 0),
+    'prev_close_1m': (SHORT, 'close', 1),
+    'low_1m': (SHORT, 'low', 0),
+    'high_1m': (SHORT, 'high', 0),
+    'atr_1m': (SHORT, 'atr', 0),
+
+    # Support and Resistance from both 5-minute and 1-hour data
+    'support_5m': (LONG, 'support', 0),
+    'resistance_5m': (LONG, 'resistance', 0),
+    'support_1h': (CONFIRM, 'support', 0),
+    'resistance_1h': (CONFIRM, 'resistance', 0),
+
+    # EMAs from 5-minute data
+    'ema9': (LONG, 'ema9', 0),
+    'ema21': (LONG, 'ema21', 0),
+    'ema50': (LONG, 'ema50', 0),
+    'ema200': (LONG, 'ema21', 0),  # Reads ema21, as the strategy always has
+    'ema50_prev': (LONG, 'ema50', 1),
+    'ema200_prev': (LONG, 'ema200', 1),
+
+    'low_5m': (LONG, 'low', 0),
+    'low_5m_prev': (LONG, 'low', 1),
+    'high_5m': (LONG, 'high', 0),
+    'high_5m_prev': (LONG, 'high', 1),
+    'rsi': (LONG, 'rsi', 0),
+    'rsi_prev': (LONG, 'rsi', 1),
+    'macd': (LONG, 'macd', 0),
+    'macd_prev': (LONG, 'macd', 1),
+    'macd_signal': (LONG, 'macd_signal', 0),
+    'macd_signal_prev': (LONG, 'macd_signal', 1),
+    'volume_5m': (LONG, 'volume', 0),
+    'volume_ma_5m': (LONG, 'volume_ma', 0),
+
+    # Trend on 1-hour timeframe
+    'ema50_1h': (CONFIRM, 'ema50', 0),
+    'ema200_1h': (CONFIRM, 'ema200', 0),
+}
+FEATURE_NAMES = list(FEATURES)
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+
+def feature_columns():
+    """{timeframe: set of columns} that FEATURES read."""
+    columns = {}
+    for interval, column, _ in FEATURES.values():
+        columns.setdefault(interval, set()).add(column)
+    return columns
+
+
+# Named sub-conditions, each may use features, UPPERCASE config settings and the ones defined above it
+CONDITIONS = {
+    # Trend
+    'uptrend': '(ema9 > ema21) & (ema21 > ema50)',  # Stronger uptrend confirmation
+    'downtrend': '(ema9 < ema21) & (ema21 < ema50)',  # Stronger downtrend confirmation
+
+    # Break and retest of resistance as support
+    'break_above_resistance': '(last_price > resistance_5m) & (prev_close_1m <= resistance_5m)',
+    'retest_support': '(low_1m <= resistance_5m) & (last_price > resistance_5m)',
+
+    # Break and retest of support as resistance
+    'break_below_support': '(last_price < support_5m) & (prev_close_1m >= support_5m)',
+    'retest_resistance': '(high_1m >= support_5m) & (last_price < support_5m)',
+
+    # Price bouncing off / rejecting at EMA 200
+    'bounce_off_ema200': '(low_5m <= ema200) & (last_price > ema200) & uptrend',
+    'reject_at_ema200': '(high_5m >= ema200) & (last_price < ema200) & downtrend',
+
+    # RSI Signal (Healthy RSI range: 40-65)
+    'healthy_rsi': '40 <= rsi <= 65',
+
+    # RSI divergences
+    'bullish_divergence': '(low_5m < low_5m_prev) & (rsi > rsi_prev)',
+    'bearish_divergence': '(high_5m > high_5m_prev) & (rsi < rsi_prev)',
+
+    # MACD crossovers
+    'macd_cross_bullish': '(macd > macd_signal) & (macd_prev <= macd_signal_prev)',
+    'macd_cross_bearish': '(macd < macd_signal) & (macd_prev >= macd_signal_prev)',
+
+    # Volume Spike
+    'volume_spike': 'volume_5m > volume_ma_5m * VOLUME_SPIKE_BUFFER',
+
+    # Golden / Death Cross
+    'golden_cross': '(ema50 > ema200) & (ema50_prev <= ema200_prev)',
+    'death_cross': '(ema50 < ema200) & (ema50_prev >= ema200_prev)',
+
+    # Trend on 1-hour timeframe
+    'uptrend_1h': 'ema50_1h >= ema200_1h',
+    'downtrend_1h': 'ema50_1h < ema200_1h',
+
+    # Price sitting just above a support / resistance level
+    'near_support': '(support_5m < last_price <= support_5m * (1 + S_R_BUFFER)) | '
+                    '(support_1h < last_price <= support_1h * (1 + S_R_BUFFER))',
+    'above_resistance': '(resistance_5m < last_price <= resistance_5m * (1 + S_R_BUFFER)) | '
+                        '(resistance_1h < last_price <= resistance_1h * (1 + S_R_BUFFER))',
+}
+
+# Lower priority wins when several rules match
+RULES = [
+    ############ Bullish Flags
+    {'name': 'breakout_retest', 'signal': 'BUY', 'priority': 1,
+     'when': 'break_above_resistance & retest_support & uptrend',
+     'message': "Buy signal: Breakout above resistance followed by successful retest as support."},
+    {'name': 'volume_near_support', 'signal': 'BUY', 'priority': 2,
+     'when': 'near_support & volume_spike & uptrend',
+     'message': "Buy signal: Volume surge near support with price close above support."},
+    {'name': 'ema200_bounce', 'signal': 'BUY', 'priority': 3,
+     'when': 'bounce_off_ema200 & macd_cross_bullish',
+     'message': "Buy signal: Price bounced off EMA 200 in an uptrend with MACD bullish crossover."},
+    {'name': 'support_macd_bullish', 'signal': 'BUY', 'priority': 4,
+     'when': 'near_support & macd_cross_bullish',
+     'message': "Buy signal: Price bounced off support with MACD turning bullish."},
+    {'name': 'resistance_breakout', 'signal': 'BUY', 'priority': 5,
+     'when': 'above_resistance & healthy_rsi & uptrend',
+     'message': "Buy signal: Price broke through resistance with healthy RSI."},
+    {'name': 'bullish_divergence', 'signal': 'BUY', 'priority': 6,
+     'when': 'bullish_divergence & (abs(last_price - support_5m) <= S_R_BUFFER * last_price)',
+     'message': "Buy signal: Bullish RSI divergence near support."},
+    {'name': 'trend_confirmed_up', 'signal': 'BUY', 'priority': 7,
+     'when': 'uptrend & uptrend_1h & macd_cross_bullish & healthy_rsi',
+     'message': "Buy signal: Uptrend confirmed on both 5-minute and 1-hour charts."},
+    {'name': 'golden_cross', 'signal': 'BUY', 'priority': 8,
+     'when': 'golden_cross & uptrend',
+     'message': "Buy signal: Golden cross detected in an uptrend."},
+
+    ############ Bearish Flags
+    {'name': 'death_cross', 'signal': 'SELL', 'priority': 9,
+     'when': 'death_cross & downtrend',
+     'message': "Sell signal: Death cross detected in a downtrend."},
+    {'name': 'breakdown_retest', 'signal': 'SELL', 'priority': 10,
+     'when': 'break_below_support & retest_resistance & downtrend',
+     'message': "Sell signal: Breakdown below support followed by successful retest as resistance."},
+    {'name': 'bearish_divergence', 'signal': 'SELL', 'priority': 11,
+     'when': 'bearish_divergence & (abs(last_price - resistance_5m) <= S_R_BUFFER * last_price)',
+     'message': "Sell signal: Bearish RSI divergence near resistance."},
+    {'name': 'trend_confirmed_down', 'signal': 'SELL', 'priority': 12,
+     'when': 'downtrend & downtrend_1h & macd_cross_bearish & (rsi < 40)',
+     'message': "Sell signal: Downtrend confirmed on both 5-minute and 1-hour charts."},
+    {'name': 'support_macd_bearish', 'signal': 'SELL', 'priority': 13,
+     'when': '(macd_cross_bearish & (last_price < support_5m)) | (macd_cross_bearish & (last_price < support_1h))',
+     'message': "Sell signal: MACD bearish crossover with price breaking support."},
+    {'name': 'overbought_resistance', 'signal': 'SELL', 'priority': 14,
+     'when': '(rsi > 70) & ((last_price >= resistance_5m * (1 - S_R_BUFFER)) | '
+             '(last_price >= resistance_1h * (1 - S_R_BUFFER)))',
+     'message': "Sell signal: Overbought RSI and price near resistance."},
+    {'name': 'ema200_rejection', 'signal': 'SELL', 'priority': 15,
+     'when': 'reject_at_ema200 & macd_cross_bearish',
+     'message': "Sell signal: Price rejected at EMA 200 in a downtrend with MACD bearish crossover."},
+    {'name': 'support_break_5m', 'signal': 'SELL', 'priority': 16,
+     'when': '(last_price < support_5m) & (prev_close_1m >= support_5m) & downtrend',
+     'message': "Sell signal: Price broke 5-minute support."},
+    {'name': 'support_break_1h', 'signal': 'SELL', 'priority': 17,
+     'when': '(last_price < support_1h) & (prev_close_1m >= support_1h) & downtrend',
+     'message': "Sell signal: Price broke 1-hour support."},
+]
+
+
+class _Compiler(ast.NodeTransformer):
+    """
+    Rewrites a rule expression into Python over the feature vector `v` and
+    the `config` module. Scalar mode turns `&`, `|` and `~` into short-circuit
+    `and`/`or`/`not` and inlines sub-conditions; vector mode keeps the
+    element-wise operators, splits chained comparisons into `&`-ed pairs and
+    refers to sub-conditions computed once beforehand.
+    """
+
+    def __init__(self, conditions, scalar):
+        self.conditions = conditions  # name -> compiled AST (scalar) or None (vector local)
+        self.scalar = scalar
+
+    def visit_Name(self, node):
+        if node.id in FEATURE_INDEX:
+            return ast.Subscript(value=ast.Name('v', ast.Load()), slice=ast.Constant(FEATURE_INDEX[node.id]), ctx=ast.Load())
+        if node.id in self.conditions:
+            compiled = self.conditions[node.id]
+            return compiled if compiled is not None else node
+        if node.id.isupper() and hasattr(config, node.id):
+            # Read at call time so runtime config changes (e.g. the optimizer) apply
+            return ast.Attribute(value=ast.Name('config', ast.Load()), attr=node.id, ctx=ast.Load())
+        if node.id == 'abs':
+            return node
+        raise ValueError(f"Unknown name in rule expression: {node.id}")
+
+    def visit_Call(self, node):
+        if not (isinstance(node.func, ast.Name) and node.func.id == 'abs') or node.keywords or len(node.args) != 1:
+            raise ValueError("Only abs(x) may be called in rule expressions")
+        node.args = [self.visit(node.args[0])]
+        return node
+
+    def visit_BinOp(self, node):
+        node = self.generic_visit(node)
+        if self.scalar and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            op = ast.And() if isinstance(node.op, ast.BitAnd) else ast.Or()
+            return ast.BoolOp(op=op, values=[node.left, node.right])
+        return node
+
+    def visit_UnaryOp(self, node):
+        node = self.generic_visit(node)
+        if self.scalar and isinstance(node.op, ast.Invert):
+            return ast.UnaryOp(op=ast.Not(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        node = self.generic_visit(node)
+        if self.scalar or len(node.ops) == 1:
+            return node
+        operands = [node.left] + node.comparators
+        pairs = [ast.Compare(left=operands[i], ops=[op], comparators=[operands[i + 1]]) for i, op in enumerate(node.ops)]
+        result = pairs[0]
+        for pair in pairs[1:]:
+            result = ast.BinOp(left=result, op=ast.BitAnd(), right=pair)
+        return result
+
+    def compile(self, expression):
+        return self.visit(ast.parse(expression, mode='eval').body)
+
+
+class RuleSet:
+    """
+    Declarative BUY/SELL rules compiled into two Python functions over a flat
+    feature vector (FEATURE_NAMES order):
+
+    - `evaluate(v)` for live trading: one bar, first matching rule by
+      priority, short-circuiting so later rules are not even computed.
+    - `evaluate_all(matrix)` for backtests: the same expressions element-wise
+      over a (features, bars) matrix, giving the fired rule for every bar.
+
+    Rules are dicts with name, signal ('BUY'/'SELL'), priority, when (an
+    expression over features, CONDITIONS and UPPERCASE config settings using
+    & | ~ and comparisons) and message. Live hits are counted per rule.
+    """
+
+    def __init__(self, rules, conditions=None):
+        self.rules = sorted(rules, key=lambda rule: rule['priority'])
+        self.conditions = dict(CONDITIONS if conditions is None else conditions)
+        self.names = [rule['name'] for rule in self.rules]
+        self.signals = [rule['signal'] for rule in self.rules]
+        self._evaluate, self._evaluate_all = self._compile()
+        self._hits = np.zeros(len(self.rules), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def _compile(self):
+        # Scalar: every sub-condition is inlined into the rules that use it
+        scalar = {}
+        for name, expression in self.conditions.items():
+            scalar[name] = _Compiler(scalar, scalar=True).compile(expression)
+        lines = ['def _evaluate(v, config):']
+        for i, rule in enumerate(self.rules):
+            condition = ast.unparse(_Compiler(scalar, scalar=True).compile(rule['when']))
+            lines.append(f'    if {condition}: return {i}')
+        lines.append('    return -1')
+
+        # Vector: sub-conditions become locals computed once
+        vector = {}
+        body = ['def _evaluate_all(v, config):']
+        for name, expression in self.conditions.items():
+            body.append(f'    {name} = {ast.unparse(_Compiler(vector, scalar=False).compile(expression))}')
+            vector[name] = None
+        conditions = [ast.unparse(_Compiler(vector, scalar=False).compile(rule['when'])) for rule in self.rules]
+        body.append(f"    return [{', '.join(conditions)}]")
+
+        namespace = {}
+        exec(compile('\n'.join(lines) + '\n\n' + '\n'.join(body), '<rules>', 'exec'), namespace)
+        return namespace['_evaluate'], namespace['_evaluate_all']
+
+    def evaluate(self, v):
+        """Index of the first rule that matches feature vector `v`, or -1. Counts the hit."""
+        fired = self._evaluate(v, config)
+        if fired >= 0:
+            with self._lock:
+                self._hits[fired] += 1
+        return fired
+
+    def evaluate_all(self, matrix, valid=None):
+        """Index of the rule that fires on every bar of a (features, bars) matrix, -1 for none."""
+        bars = matrix.shape[1]
+        conditions = [np.broadcast_to(np.asarray(c, dtype=bool), bars) for c in self._evaluate_all(matrix, config)]
+        fired = np.select(conditions, np.arange(len(self.rules)), default=-1)
+        if valid is not None:
+            fired[~valid] = -1
+        return fired
+
+    def hit_counts(self, fired=None):
+        """{rule name: hits}, from the live counters or from an evaluate_all result."""
+        if fired is None:
+            with self._lock:
+                counts = self._hits.copy()
+        else:
+            counts = np.bincount(fired[fired >= 0], minlength=len(self.rules))
+        return dict(zip(self.names, counts.tolist()))
+
+
+def feature_vector(frames):
+    """The FEATURE_NAMES values from the newest rows of {timeframe: DataFrame}, as a list of floats."""
+    columns = {}
+    vector = []
+    for interval, column, back in FEATURES.values():
+        values = columns.get((interval, column))
+        if values is None:
+            values = columns[(interval, column)] = frames[interval][column].to_numpy()
+        vector.append(float(values[-1 - back]))
+    return vector
+
+
+def load_rules(path):
+    """A RuleSet from a JSON file: {"rules": [...], "conditions": {...}} (conditions default to CONDITIONS)."""
+    with open(path) as f:
+        spec = json.load(f)
+    return RuleSet(spec['rules'], spec.get('conditions'))
+
+
+# Rules used by the strategy: the built-in ones unless config.RULES_FILE points elsewhere
+active = load_rules(config.RULES_FILE) if config.RULES_FILE else RuleSet(RULES)
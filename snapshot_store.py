@@ -0,0 +1,55 @@
+# snapshot_store.py
+
+import logging
+import os
+import pickle
+import zlib
+
+MAGIC = b'KBSNAP1\n'  # File header: format marker, then the CRC32 of the payload
+HEADER_SIZE = len(MAGIC) + 4
+
+
+def atomic_write(path, data):
+    """
+    Write `data` (bytes) to `path` so that a crash at any point leaves either
+    the previous file or the complete new one: the data goes to a temporary
+    file that is synced and then renamed over `path`.
+    """
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    # The rename is only durable once the directory entry is on disk too
+    directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def save(path, state):
+    """Atomically write `state` (picklable, e.g. dicts of NumPy arrays) as a checksummed binary snapshot. Returns its size."""
+    payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    data = MAGIC + zlib.crc32(payload).to_bytes(4, 'little') + payload
+    atomic_write(path, data)
+    return len(data)
+
+
+def load(path):
+    """The state saved at `path`, or None if there is none or it fails its checksum."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logging.error(f"Could not read snapshot {path}: {e}")
+        return None
+    payload = data[HEADER_SIZE:]
+    if data[:len(MAGIC)] != MAGIC or zlib.crc32(payload).to_bytes(4, 'little') != data[len(MAGIC):HEADER_SIZE]:
+        logging.error(f"Snapshot {path} is damaged; ignoring it.")
+        return None
+    # Only files this bot wrote itself are loaded; pickle is not for untrusted input
+    return pickle.loads(payload)
@@ -0,0 +1,46 @@
+# test_account.py
+
+import pytest
+
+import config
+from account import AccountState
+
+
+class FlakyClient:
+    """Balance endpoint that can be switched to failing."""
+
+    def __init__(self):
+        self.failing = False
+
+    def query_private(self, method, data=None):
+        if self.failing:
+            raise TimeoutError('REST call timed out')
+        return {'error': [], 'result': {'ZUSD': '100.0'}}
+
+
+@pytest.fixture
+def account():
+    return AccountState('test', FlakyClient())
+
+
+def test_never_fetched_balance_is_not_used(account):
+    account.client.failing = True
+    assert account.balance('ZUSD') is None
+
+
+def test_failed_refresh_after_fill_skips_sizing(account):
+    assert account.balance('ZUSD') == 100.0
+    account.client.failing = True
+    account.invalidate()
+    assert account.balance('ZUSD') is None
+
+
+def test_failed_refresh_uses_snapshot_until_hard_limit(account):
+    assert account.balance('ZUSD') == 100.0
+    account.client.failing = True
+    account.refreshed_at -= config.BALANCE_MAX_AGE + 1
+    assert account.balance('ZUSD') == 100.0
+    account.refreshed_at -= config.BALANCE_HARD_MAX_AGE
+    assert account.balance('ZUSD') is None
+    account.client.failing = False
+    assert account.balance('ZUSD') == 100.0
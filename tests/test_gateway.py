@@ -0,0 +1,106 @@
+# test_gateway.py
+
+import asyncio
+
+import pytest
+
+import config
+from gateway import KrakenGateway, RateLimiter
+from mock_kraken import MockKrakenServer
+
+SUBSCRIPTIONS = [
+    {'event': 'subscribe', 'pair': ['XBT/USD'], 'subscription': {'name': 'ohlc', 'interval': 1}},
+    {'event': 'subscribe', 'pair': ['XBT/USD'], 'subscription': {'name': 'ohlc', 'interval': 5}},
+]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(config, 'RECONNECT_BASE_DELAY', 0.05)
+    monkeypatch.setattr(config, 'RECONNECT_MAX_DELAY', 0.1)
+
+
+async def wait_until(predicate, timeout=10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run_against_mock(scenario, **gateway_kwargs):
+    """Run `scenario(server, gateway, messages)` with a gateway connected to a fresh mock server."""
+    async def main():
+        server = MockKrakenServer(tick_interval=0.02)
+        await server.start()
+        messages = []
+        gateway = KrakenGateway(server.ws_url, lambda message, received_ns: messages.append(message),
+                                SUBSCRIPTIONS, **gateway_kwargs)
+        task = asyncio.create_task(gateway.run())
+        try:
+            await scenario(server, gateway, messages)
+        finally:
+            await gateway.stop()
+            await asyncio.wait_for(task, 5)
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_resubscribes_after_disconnect():
+    connects = []
+
+    async def scenario(server, gateway, messages):
+        await wait_until(lambda: len(messages) > 5)
+        assert len(server.subscriptions) == len(SUBSCRIPTIONS)
+        await server.disconnect_all()
+        await wait_until(lambda: len(server.subscriptions) == 2 * len(SUBSCRIPTIONS))
+        received = len(messages)
+        await wait_until(lambda: len(messages) > received + 5)  # The feed resumes
+        assert server.subscriptions == SUBSCRIPTIONS * 2
+        assert server.connections == 2
+        assert gateway.reconnects == 1
+        assert len(connects) == 2
+
+    run_against_mock(scenario, on_connect=lambda: connects.append(1))
+
+
+def test_failing_on_connect_reconnects():
+    connects = []
+
+    def on_connect():
+        connects.append(1)
+        if len(connects) == 1:
+            raise RuntimeError("resync failed")
+
+    async def scenario(server, gateway, messages):
+        # The first session may end before the server has read all of its subscribes
+        await wait_until(lambda: len(connects) == 2 and len(server.subscriptions) > len(SUBSCRIPTIONS)
+                         and server.subscriptions[-len(SUBSCRIPTIONS):] == SUBSCRIPTIONS)
+        assert gateway.reconnects == 1
+        assert gateway.connected.is_set()
+
+    run_against_mock(scenario, on_connect=on_connect)
+
+
+def test_rejected_handshake_is_retried():
+    async def scenario(server, gateway, messages):
+        # The mock's REST port answers the upgrade request with a plain HTTP response
+        gateway.url = server.rest_url.replace('http://', 'ws://') + '/'
+        await server.disconnect_all()
+        await wait_until(lambda: gateway.reconnects >= 3)
+        assert not gateway.connected.is_set()
+
+    run_against_mock(scenario)
+
+
+def test_rate_limiter_paces_concurrent_callers():
+    async def main():
+        limiter = RateLimiter(2, 2.0)
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*(limiter.acquire(1) for _ in range(6)))
+        return asyncio.get_running_loop().time() - start, limiter.counter
+
+    elapsed, counter = asyncio.run(main())
+    # Four calls over the limit, at two per second
+    assert elapsed >= 1.9
+    assert counter <= 2.0 + 1e-9
@@ -0,0 +1,21 @@
+# test_history_store.py
+
+import numpy as np
+
+from history_store import RECORD_FIELDS, HistoryStore
+
+
+def candles(start, count):
+    rows = np.ones((count, RECORD_FIELDS))
+    rows[:, 0] = (start + np.arange(count)) * 60.0
+    return rows
+
+
+def test_append_skips_candles_already_stored(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    assert store.append('XXBTZUSD', 1, candles(0, 10)) == 10
+    assert store.append('XXBTZUSD', 1, candles(5, 10)) == 5
+    assert store.append('XXBTZUSD', 1, candles(0, 3)) == 0
+    timestamps = store.load('XXBTZUSD', 1)['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    assert timestamps.tolist() == [i * 60 for i in range(15)]
+
@@ -0,0 +1,68 @@
+# test_indicators.py
+
+import numpy as np
+import pytest
+from ta.volatility import AverageTrueRange
+
+import config
+import indicators
+from benchmark import synthetic_candles
+from indicators import INDICATOR_COLUMNS, IncrementalIndicators
+
+TOLERANCE = 1e-9  # Relative difference allowed against `ta` (absolute below 1)
+
+
+@pytest.fixture(scope='module')
+def candles():
+    return synthetic_candles(600, 1, end=1_700_000_000, seed=3)
+
+
+def assert_close(actual, expected, name):
+    actual = np.asarray(actual, dtype=np.float64)
+    expected = np.asarray(expected, dtype=np.float64)
+    assert np.array_equal(np.isnan(actual), np.isnan(expected)), f"{name}: NaN in different places"
+    error = np.abs(actual - expected) / np.maximum(np.abs(expected), 1.0)
+    assert np.nanmax(error, initial=0.0) < TOLERANCE, f"{name}: off by {np.nanmax(error):.3g}"
+
+
+def streamed(data):
+    """Feed `data` through IncrementalIndicators as a live feed would: each candle opens, then is revised."""
+    engine = IncrementalIndicators()
+    columns = {name: [] for name in INDICATOR_COLUMNS}
+    for open_, high, low, close, volume in data[['open', 'high', 'low', 'close', 'volume']].itertuples(index=False):
+        engine.update(open_, open_, open_, volume / 2, new_candle=True)
+        engine.compute()
+        engine.update(high, low, close, volume, new_candle=False)
+        for name, value in engine.compute().items():
+            columns[name].append(value)
+    return columns
+
+
+def test_incremental_matches_ta(candles):
+    columns = streamed(candles)
+    for name in INDICATOR_COLUMNS:
+        assert_close(columns[name], indicators._ta_column(candles, name), name)
+
+
+def test_incremental_atr_matches_ta_library(candles):
+    expected = AverageTrueRange(candles['high'], candles['low'], candles['close'],
+                                window=config.ATR_WINDOW).average_true_range()
+    assert_close(streamed(candles)['atr'], expected, 'atr')
+
+
+@pytest.mark.parametrize('backend', sorted(indicators.kernels.EMA_KERNELS))
+def test_kernels_match_ta(candles, backend):
+    differences = indicators.compare_backends(candles, backend)
+    assert set(differences) == set(INDICATOR_COLUMNS)
+    assert max(differences.values()) < TOLERANCE, differences
+
+
+@pytest.mark.parametrize('backend', sorted(indicators.kernels.EMA_KERNELS))
+def test_batch_matches_ta_per_frame(candles, backend):
+    # Different lengths exercise the left padding; 30 rows is shorter than most indicator windows
+    frames = [candles, candles.iloc[250:].reset_index(drop=True), candles.iloc[:30]]
+    results = indicators.batch_indicators(frames, backend=backend, workers=2)
+    assert len(results) == len(frames)
+    for frame, values in zip(frames, results):
+        for name in INDICATOR_COLUMNS:
+            assert_close(values[name], indicators._ta_column(frame, name), name)
@@ -0,0 +1,166 @@
+# test_orders.py
+
+import os
+
+import pytest
+
+import config
+import orders
+from orders import OrderManager, Position
+from paper_exchange import PaperExchange
+
+PAIR = 'XBT/USD'
+REST_PAIR = 'XXBTZUSD'
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(config, 'NATIVE_EXIT_ORDERS', False)
+    monkeypatch.setattr(config, 'ORDER_LOOKUP_DELAY', 0)
+    monkeypatch.setattr(config, 'FILL_POLL_INTERVAL', 0)
+
+
+@pytest.fixture
+def exchange():
+    paper = PaperExchange(None, {'ZUSD': 10000.0}, latency=0)
+    paper.on_price(REST_PAIR, 100.0, 1000)
+    return paper
+
+
+def restart(manager, client, state_dir):
+    """Drop `manager` without saving, as a crash would, and start a new one on the same state."""
+    manager.journal.close()
+    return OrderManager(PAIR, REST_PAIR, client, str(state_dir))
+
+
+class LostResponse:
+    """Client whose AddOrder calls time out, after reaching the exchange if `placed`."""
+
+    def __init__(self, exchange, placed):
+        self.exchange = exchange
+        self.placed = placed
+
+    def query_private(self, method, data=None):
+        if method == 'AddOrder':
+            if self.placed:
+                self.exchange.query_private(method, data)
+            raise TimeoutError('REST call timed out')
+        return self.exchange.query_private(method, data)
+
+
+# Journal replay
+
+def test_replay_order_without_fill_stays_pending(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    manager._journal('order', side='BUY', quantity=1.0, price=100.0, stop_loss=95.0, take_profit=110.0,
+                     rule='r', userref=7)
+    recovered = restart(manager, exchange, tmp_path)
+    assert recovered.position is None
+    assert recovered.pending['side'] == 'BUY' and recovered.pending['userref'] == 7
+    # Replaying saved the state, so the record survives another restart
+    assert restart(recovered, exchange, tmp_path).pending['userref'] == 7
+
+
+def test_replay_order_then_rejected_clears_pending(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    manager._journal('order', side='BUY', quantity=1.0, price=100.0, stop_loss=95.0, take_profit=110.0,
+                     rule='r', userref=7)
+    manager._journal('rejected', userref=7)
+    recovered = restart(manager, exchange, tmp_path)
+    assert recovered.pending is None
+    assert recovered.position is None
+
+
+def test_replay_order_then_fill_restores_position(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    manager._journal('order', side='BUY', quantity=1.5, price=100.0, stop_loss=95.0, take_profit=110.0,
+                     rule='r', userref=7)
+    position = Position(1.5, 100.02, 95.0, 110.0, rule='r', entry_txid='PAPER-1', userref=7)
+    manager._record_fill('BUY', 1.5, 100.02, 'PAPER-1', 'r', position)
+    recovered = restart(manager, exchange, tmp_path)
+    assert recovered.pending is None
+    assert recovered.position.to_dict() == position.to_dict()
+    assert recovered.fills[-1]['txid'] == 'PAPER-1'
+
+
+def test_replay_stops_at_torn_record(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    manager._journal('order', side='BUY', quantity=1.0, price=100.0, stop_loss=95.0, take_profit=110.0,
+                     rule='r', userref=7)
+    manager.journal.write('{"seq": 2, "event": "rej')
+    assert restart(manager, exchange, tmp_path).pending['userref'] == 7
+
+
+# Reconcile against the paper exchange
+
+def test_reconcile_adopts_entry_sent_before_crash(exchange, tmp_path, monkeypatch):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+
+    def crash(*args, **kwargs):
+        place_order(*args, **kwargs)
+        raise SystemExit  # The process dies before the response is handled
+
+    place_order = orders.place_order
+    monkeypatch.setattr(orders, 'place_order', crash)
+    with pytest.raises(SystemExit):
+        manager.open_long(2.0, 100.0, 90.0, 120.0, 'r')
+    monkeypatch.setattr(orders, 'place_order', place_order)
+
+    recovered = restart(manager, exchange, tmp_path)
+    assert recovered.pending is not None and recovered.position is None
+    recovered.reconcile()
+    assert recovered.pending is None
+    assert recovered.position.quantity == 2.0
+    assert recovered.position.entry_price == pytest.approx(100.0 * (1 + exchange.slippage))
+    assert recovered.reconciled == 1
+
+
+def test_reconcile_settles_native_exit_filled_while_down(exchange, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'NATIVE_EXIT_ORDERS', True)
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    assert manager.open_long(1.0, 100.0, 95.0, 110.0, 'r')
+    assert set(manager.position.exit_orders) == {'stop_loss', 'take_profit'}
+
+    manager.journal.close()
+    exchange.on_price(REST_PAIR, 94.0, 1001)  # The stop triggers while the bot is down
+    recovered = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    recovered.reconcile()
+    assert recovered.position is None
+    assert recovered.fills[-1]['reason'] == 'stop_loss'
+    assert exchange.metrics()['open_orders'] == 0  # The take-profit was cancelled
+
+
+def test_reconcile_drops_position_sold_outside_bot(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    assert manager.open_long(1.0, 100.0, 95.0, 110.0, 'r')
+    exchange.balances['XXBT'] = 0.0
+    recovered = restart(manager, exchange, tmp_path)
+    recovered.reconcile()
+    assert recovered.position is None
+    assert recovered.reconciled == 1
+
+
+# Orders whose outcome is unknown
+
+def test_timed_out_entry_that_filled_is_booked(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, LostResponse(exchange, placed=True), str(tmp_path))
+    assert manager.open_long(1.0, 100.0, 95.0, 110.0, 'r')
+    assert manager.pending is None
+    assert manager.position.entry_price == pytest.approx(100.0 * (1 + exchange.slippage))
+
+
+def test_timed_out_exit_that_was_not_placed_keeps_position(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    assert manager.open_long(1.0, 100.0, 95.0, 110.0, 'r')
+    manager.client = LostResponse(exchange, placed=False)
+    assert not manager.close('signal', 101.0)
+    assert manager.pending is None
+    assert manager.position is not None
+    assert os.path.getsize(manager.journal_path) == 0  # Resolved and saved
+
+
+def test_entry_books_the_reported_fill(exchange, tmp_path):
+    manager = OrderManager(PAIR, REST_PAIR, exchange, str(tmp_path))
+    assert manager.open_long(1.0, 99.0, 95.0, 110.0, 'r')
+    assert manager.position.entry_price == pytest.approx(100.0 * (1 + exchange.slippage))
+    assert manager.fills[-1]['price'] == manager.position.entry_price
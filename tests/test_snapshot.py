@@ -0,0 +1,96 @@
+# test_snapshot.py
+
+import numpy as np
+import pytest
+
+import backtest
+import config
+from benchmark import synthetic_candles
+
+HISTORY = 1500
+LIVE = 300
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'SNAPSHOT_INTERVAL', 60)
+
+
+@pytest.fixture(scope='module')
+def candles():
+    data = synthetic_candles(HISTORY + LIVE, 1, end=1_700_000_000, seed=5)
+    times = data['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    values = data[['open', 'high', 'low', 'close', 'vwap', 'volume', 'count']].to_numpy()
+    return data, times, values
+
+
+def new_instrument():
+    from instrument import Instrument
+    return Instrument('P', 'PZUSD', None, None, None)
+
+
+def warmed_up(data):
+    from instrument import TIMEFRAMES
+    instrument = new_instrument()
+    with instrument.lock:
+        for interval in TIMEFRAMES:
+            frame = data if interval == 1 else backtest.resample_ohlc(data, interval)
+            instrument.buffers[interval].load_frame(frame)
+            instrument.engines[interval].warm_up(instrument.buffers[interval])
+            if interval in instrument.levels:
+                instrument.levels[interval].warm_up(instrument.buffers[interval])
+        instrument._seed_aggregators()
+    return instrument
+
+
+def feed(instrument, times, values, i, revision):
+    """Revision 0..2 of 1m candle `i`, as the feed updates an open candle."""
+    open_, high, low, close, vwap, volume, count = values[i].tolist()
+    high, low, close = [(open_, open_, open_), ((open_ + high) / 2, (open_ + low) / 2, (open_ + close) / 2),
+                        (high, low, close)][revision]
+    instrument.on_candle(1, (float(times[i]), open_, high, low, close, vwap, volume * (revision + 1) / 3, count))
+
+
+def assert_same(a, b):
+    for left, right in zip(a.snapshot(), b.snapshot()):
+        assert left.equals(right)
+
+
+def test_snapshot_round_trip(candles):
+    data, times, values = candles
+    live = warmed_up(data.iloc[:HISTORY])
+    for i in range(HISTORY, HISTORY + LIVE // 2):
+        for revision in range(3):
+            feed(live, times, values, i, revision)
+    feed(live, times, values, HISTORY + LIVE // 2, 0)  # Saved with a candle still open
+
+    assert live.save_state() > 0
+    restored = new_instrument()
+    assert restored.restore_state()
+    assert_same(live, restored)
+
+    # Both carry on identically from the open candle
+    for i in range(HISTORY + LIVE // 2, HISTORY + LIVE):
+        for revision in range(1 if i == HISTORY + LIVE // 2 else 0, 3):
+            feed(live, times, values, i, revision)
+            feed(restored, times, values, i, revision)
+    assert_same(live, restored)
+
+
+def test_snapshot_ignored_after_settings_change(candles, monkeypatch):
+    live = warmed_up(candles[0].iloc[:HISTORY])
+    assert live.save_state() > 0
+    monkeypatch.setattr(config, 'RSI_WINDOW', config.RSI_WINDOW + 1)
+    assert not new_instrument().restore_state()
+
+
+def test_damaged_snapshot_ignored(candles):
+    live = warmed_up(candles[0].iloc[:HISTORY])
+    assert live.save_state() > 0
+    with open(live.state_path, 'r+b') as f:
+        f.seek(-5, 2)
+        byte = f.read(1)
+        f.seek(-5, 2)
+        f.write(bytes([byte[0] ^ 0xff]))
+    assert not new_instrument().restore_state()
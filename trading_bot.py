@@ -1,345 +1,259 @@
 import time
-import indicators
-import strategy
+import asyncio
 import logging
-import pandas as pd
-import threading
 import json
-import krakenex
-import logging
-import websocket
 import config
+from account import AccountState
+import event_log
+from evaluator import CoalescingEvaluator
+from exchange import get_client
+from frame_decoder import FrameDecoder, BOOK, EVENT, TRADE
+from gateway import KrakenGateway, GatewayClient
+from history_store import HistoryStore
+from instrument import Instrument, BASE_TIMEFRAME, BUFFER_COLUMNS, SUBSCRIBED_TIMEFRAMES, TIMEFRAMES
+import latency
+from market_bus import MarketDataBus
+from paper_exchange import split_pair
+import rules
 
 ## VERSION 0.9 - still need to test algo and actual trade APIs (non sandbox)
 
-# Configure logging
-logging.basicConfig(
-    filename='trading_bot.log',
-    level=logging.INFO,
-    format='%(asctime)s:%(levelname)s:%(message)s'
-)
-
-MAX_RETRIES = 6  # Maximum number of retries before giving up
-RETRY_DELAY = 10  # Delay between retries (in seconds)
-RETRY_COUNT = 0
-
-# Global variables for the bot
-position = None
-entry_price = 0
-stop_loss_price = 0
-take_profit_price = 0
-
-# Separate DataFrames for 1m, 5m, and 1h data
-data_frame_1m = pd.DataFrame()
-data_frame_5m = pd.DataFrame()
-data_frame_1h = pd.DataFrame()
-data_lock = threading.Lock()
+# Configure logging: written by a background thread, so hot paths only queue events
+event_log.setup()
 
 ################ WEB SOCKET RELATED FUNCTIONS ##########################
 
-def get_client():
-    """Initialize and return the Kraken client."""
-    kraken.key = config.API_KEY
-    kraken.secret = config.API_SECRET
-    return kraken
-
-def place_order(client, pair, side, volume):
-    """Place an order on Kraken."""
-    if config.PAPER_TRADING:
-        logging.info(f"Simulated {side} order for {volume} {pair}")
-        return {'status': 'simulated', 'side': side, 'volume': volume}
-    else:
-        try:
-            order = client.query_private('AddOrder', {
-                'pair': pair,
-                'type': side.lower(),
-                'ordertype': 'market',
-                'volume': volume
-            })
-            logging.info(f"Order placed: {order}")
-            return order
-        except Exception as e:
-            logging.error(f"Error placing order: {e}")
-            return None
-
-def get_websocket_manager():
-    """Start the Kraken WebSocket connection with retry logic."""
-    ws = websocket.WebSocketApp(
-        "wss://ws.kraken.com/",
-        on_message=on_message,
-        on_error=on_error,
-        on_close=on_close
-    )
-    ws.on_open = on_open
-    return ws
-
-def on_message(ws, message):    
-    """Handle incoming WebSocket messages."""
-    handle_socket_message(message)
-
-
-def on_error(ws, error):
-    """Handle WebSocket errors and try to reconnect."""
-    global RETRY_COUNT
-    logging.error(f"WebSocket error: {error}")
-
-    if RETRY_COUNT < MAX_RETRIES:
-        RETRY_COUNT += 1
-        logging.info(f"Retrying WebSocket connection ({RETRY_COUNT}/{MAX_RETRIES})...")
-        time.sleep(RETRY_DELAY * RETRY_COUNT)  # Exponential backoff
-        reconnect_websocket()
-    else:
-        logging.error("Max retries reached. Could not reconnect WebSocket.")
-
-def on_close(ws):
-    """Handle WebSocket closing and attempt to reconnect."""
-    global RETRY_COUNT
-    logging.warning("WebSocket connection closed.")
-    
-    if RETRY_COUNT < MAX_RETRIES:
-        RETRY_COUNT += 1
-        logging.info(f"Retrying WebSocket connection ({RETRY_COUNT}/{MAX_RETRIES})...")
-        time.sleep(RETRY_DELAY * RETRY_COUNT)
-        reconnect_websocket()
-    else:
-        logging.error("Max retries reached. Could not reconnect WebSocket.")
-
-def on_open(ws):
-    """Reset retry count when WebSocket successfully connects."""
-    global RETRY_COUNT
-    logging.info("WebSocket connection opened.")
-    RETRY_COUNT = 0  # Reset retry counter on successful connection
-
-def reconnect_websocket():
-    """Attempt to reconnect the WebSocket."""
-    global ws
-    try:
-        ws = get_websocket_manager()
-        wst = threading.Thread(target=ws.run_forever)
-        wst.start()
-        logging.info("WebSocket reconnection successful.")
-    except Exception as e:
-        logging.error(f"Error reconnecting WebSocket: {e}")
-
-
-def subscribe_to_ohlc():
-    global data_frame_1m, data_frame_5m, data_frame_1h
-    """Subscribe to Kraken OHLC WebSocket data for 1m, 5m, and 1h intervals."""
-    # Subscribe to the 1-minute OHLC
-    ws.send(json.dumps({
-        "event": "subscribe",
-        "pair": [config.SYMBOL],
-        "subscription": {"name": "ohlc", "interval": config.TIMEFRAME_SHORT}
-    }))
-
-    # Subscribe to the 5-minute OHLC
-    ws.send(json.dumps({
-        "event": "subscribe",
-        "pair": [config.SYMBOL],
-        "subscription": {"name": "ohlc", "interval": config.TIMEFRAME_LONG}
-    }))
-
-    # Subscribe to the 1-hour OHLC
-    ws.send(json.dumps({
-        "event": "subscribe",
-        "pair": [config.SYMBOL],
-        "subscription": {"name": "ohlc", "interval": config.TIMEFRAME_CONFIRM}
-    }))
-
-# Initialize global variables to track last candle timestamps
-last_candle_timestamp_1m = None
-last_candle_timestamp_5m = None
-last_candle_timestamp_1h = None
-
-def handle_socket_message(message):
-    global data_frame_1m, data_frame_5m, data_frame_1h
-    global last_candle_timestamp_1m, last_candle_timestamp_5m, last_candle_timestamp_1h
-    
+def ohlc_subscriptions():
+    """Kraken OHLC subscription payloads for every pair (just the base interval when resampling locally)."""
+    # One subscription per interval covers all pairs on this single connection
+    return [
+        {
+            "event": "subscribe",
+            "pair": list(instruments),
+            "subscription": {"name": "ohlc", "interval": interval}
+        }
+        for interval in SUBSCRIBED_TIMEFRAMES
+    ]
+
+def market_subscriptions():
+    """OHLC plus, if enabled, trade and book subscription payloads."""
+    payloads = ohlc_subscriptions()
+    if config.SUBSCRIBE_TRADES:
+        payloads.append({"event": "subscribe", "pair": list(instruments), "subscription": {"name": "trade"}})
+    if config.BOOK_DEPTH:
+        payloads.append(book_subscription(list(instruments)))
+    return payloads
+
+def book_subscription(pairs, event="subscribe"):
+    return {"event": event, "pair": pairs, "subscription": {"name": "book", "depth": config.BOOK_DEPTH}}
+
+def resubscribe_book(pair):
+    """Fetch a fresh book snapshot after a checksum mismatch."""
+    logging.warning(f"Order book checksum mismatch for {pair}; resubscribing.")
+    if gateway is not None and gateway.loop is not None:
+        for event in ("unsubscribe", "subscribe"):
+            gateway.loop.create_task(gateway.send(book_subscription([pair], event)))
+
+def handle_socket_message(message, received_ns=None):
     try:
-        msg = json.loads(message)
-
-        if isinstance(msg, list):
-            ohlc_data = msg[1]
-            subscription = msg[2]
-
-            # Extract the current candle timestamp
-            current_candle_timestamp = float(ohlc_data[1])  # This is the candle's end timestamp
-
-            # Create a new row for the DataFrame
-            new_row = pd.DataFrame([{
-                'timestamp': pd.to_datetime(current_candle_timestamp, unit='s'),  # Candle end time
-                'open': float(ohlc_data[2]),  # Open price
-                'high': float(ohlc_data[3]),  # High price
-                'low': float(ohlc_data[4]),   # Low price
-                'close': float(ohlc_data[5]), # Close price
-                'vwap': float(ohlc_data[6]),  # VWAP
-                'volume': float(ohlc_data[7]),# Volume
-                'count': float(ohlc_data[8]), # Number of trades
-            }])
-
-            with data_lock:
-                if 'ohlc-1' in subscription:
-                    if last_candle_timestamp_1m and current_candle_timestamp > last_candle_timestamp_1m:
-                        # Append the last completed candle before starting a new one
-                        print("Appending: A new complete 1 min candlestick.")
-                        data_frame_1m = pd.concat([data_frame_1m, new_row])
-                        data_frame_1m = data_frame_1m.tail(config.REQUIRED_DATA_LENGTH)
-                    else:
-                        # Update the current row if the candle is still open
-                        print("Updating: An existing 1 min candlestick")
-                        data_frame_1m.iloc[-1] = new_row.iloc[0]
-                    last_candle_timestamp_1m = current_candle_timestamp
-
-                elif 'ohlc-5' in subscription:
-                    if last_candle_timestamp_5m and current_candle_timestamp > last_candle_timestamp_5m:
-                        print("Appending: A new complete 5 min candlestick.")
-                        data_frame_5m = pd.concat([data_frame_5m, new_row])
-                        data_frame_5m = data_frame_5m.tail(config.REQUIRED_DATA_LENGTH)
-                    else:
-                        print("Updating: An existing 5 min candlestick")
-                        data_frame_5m.iloc[-1] = new_row.iloc[0]
-                    last_candle_timestamp_5m = current_candle_timestamp
-
-                elif 'ohlc-60' in subscription:
-                    if last_candle_timestamp_1h and current_candle_timestamp > last_candle_timestamp_1h:
-                        print("Appending: A new complete 1 hour candlestick.")
-                        data_frame_1h = pd.concat([data_frame_1h, new_row])
-                        data_frame_1h = data_frame_1h.tail(config.REQUIRED_DATA_LENGTH)
-                    else:
-                        print("Updating: An existing 1 hour candlestick")
-                        data_frame_1h.iloc[-1] = new_row.iloc[0]
-                    last_candle_timestamp_1h = current_candle_timestamp
-
-            # Run the bot after adding/updating data
-            run_bot()
+        parse_start = time.perf_counter_ns()
+        frame = decoder.decode(message)
+        if frame is None:
+            return
+        kind, pair, interval, payload = frame
+
+        if kind == EVENT:
+            if payload.get('status') == 'error':
+                logging.warning(f"Kraken rejected subscription {payload.get('subscription')} for {payload.get('pair')}: "
+                                f"{payload.get('errorMessage')}")
+            return
+
+        instrument = instruments.get(pair)
+        if instrument is None:
+            return
+
+        if kind == TRADE:
+            paper = paper_exchanges.get(pair)
+            if paper is not None:
+                for trade in payload:
+                    paper.on_price(instrument.rest_pair, float(trade[0]), float(trade[2]))
+            instrument.on_trades(payload)
+            return
+        if kind == BOOK:
+            if not instrument.on_book(payload):
+                resubscribe_book(pair)
+            return
+
+        # OHLC: payload is the candle in CANDLE_COLUMNS order, stamped with its start time
+        latency.recorder.record('parse', time.perf_counter_ns() - parse_start)
+
+        # The simulator sees the price before the bot can act on it
+        paper = paper_exchanges.get(pair)
+        if paper is not None and interval == BASE_TIMEFRAME:
+            paper.on_candle(instrument.rest_pair, payload, time.time())
+
+        with latency.span('candle_update'):
+            appended = instrument.on_candle(interval, payload, received_ns)
+        event_log.emit('candle', logging.DEBUG, pair=pair, interval=interval, new=appended, close=payload[4])
+
+        # Queue an evaluation of this pair on the latest data; bursts collapse into one run
+        evaluator.submit(pair)
 
     except Exception as e:
         logging.error(f"Error in handle_socket_message: {e}")
 
-
 ################ WEB SOCKET RELATED FUNCTIONS ENDING ##########################
 
 
 def fetch_historical_data():
-    """Fetch historical OHLC data for 1m, 5m, and 1h intervals."""
-    global data_frame_1m, data_frame_5m, data_frame_1h
-
-
-    # Current UNIX timestamp (in seconds)
-    current_timestamp = int(time.time())
-
-    # Calculate since timestamps for 500 periods
-    since_1m = current_timestamp - (500 * 60)  # 1-minute chart
-    since_5m = current_timestamp - (500 * 5 * 60)  # 5-minute chart
-    since_1h = current_timestamp - (500 * 60 * 60 * 1)  # 1-hour chart`
-    # Fetch historical data for 1-minute, 5-minute, and 1-hour intervals
-    data_frame_1m = get_historical_ohlc(config.REST_SYMBOL, config.TIMEFRAME_SHORT, since_1m)
-    data_frame_5m = get_historical_ohlc(config.REST_SYMBOL, config.TIMEFRAME_LONG, since_5m)
-    data_frame_1h = get_historical_ohlc(config.REST_SYMBOL, config.TIMEFRAME_CONFIRM, since_1h)
-
-    # Ensure we have enough data before starting
-    if data_frame_1m is None or len(data_frame_1m) < config.REQUIRED_DATA_LENGTH:
-        logging.error("Not enough 1-minute historical data.")
-        return False
-    if data_frame_5m is None or len(data_frame_5m) < config.REQUIRED_DATA_LENGTH:
-        logging.error("Not enough 5-minute historical data.")
-        return False
-    if data_frame_1h is None or len(data_frame_1h) < config.REQUIRED_DATA_LENGTH:
-        logging.error("Not enough 1-hour historical data.")
-        return False
-    logging.info("*** Historical Data Successfully Loaded ***")
-    return True
-
-
-
-def run_bot():
-    """Run the trading bot logic."""
-    global position, entry_price, stop_loss_price, take_profit_price, data_frame_1m, data_frame_5m, data_frame_1h
-    try:
-        with data_lock:
-            # Use the 1-minute data for decision making, confirm trend using 5-minute and 1-hour data
-            data_1m = data_frame_1m.copy()
-            data_5m = data_frame_5m.copy()
-            data_1h = data_frame_1h.copy()            
-            data_1m = indicators.apply_technical_indicators(data_1m)
-            data_5m = indicators.apply_technical_indicators(data_5m)
-            data_1h = indicators.apply_technical_indicators(data_1h)
-            signal, last_price = strategy.generate_signals(data_1m, data_5m, data_1h)
-            
-            logging.info("1-minute data (last 5 rows):\n%s", data_1m.tail(10).to_string())
-            logging.info("5-minute data (last 5 rows):\n%s", data_5m.tail(10).to_string())
-            logging.info("1-hour data (last 5 rows):\n%s", data_1h.tail(10).to_string())
-
-            if position is None and signal == 'BUY':
-                atr_value = data_1m['atr'].iloc[-1]
-                stop_loss_price = strategy.calculate_stop_loss(last_price, atr_value)
-                take_profit_price = strategy.calculate_take_profit(last_price, stop_loss_price)
-                quantity = strategy.calculate_quantity(client, last_price, stop_loss_price)
-                if quantity > 0:
-                    order = place_order(client, config.SYMBOL, 'BUY', quantity)
-                    if order:
-                        position = 'LONG'
-                        entry_price = last_price
-                        logging.info(f"Bought {quantity} {config.SYMBOL} at {last_price}")
-            elif position == 'LONG' and (signal == 'SELL' or last_price <= stop_loss_price or last_price >= take_profit_price):
-                order = place_order(client, config.SYMBOL, 'SELL', position)
-                if order:
-                    position = None
-                    logging.info(f"Sold position at {last_price}")
-    except Exception as e:
-        logging.error(f"Error in run_bot: {e}")
+    """Restore every instrument from its snapshot or fetch its history, dropping pairs that lack enough history."""
+    for pair, instrument in list(instruments.items()):
+        if not (instrument.restore_state() or instrument.fetch_history()):
+            logging.error(f"Dropping {pair}: historical data unavailable.")
+            del instruments[pair]
+    return bool(instruments)
 
 
-def get_historical_ohlc(pair, interval, since):
-    """Fetch historical OHLC data from Kraken."""
-    try:
-        ohlc_data = client.query_public('OHLC', {'pair': pair, 'interval': interval, 'since': since})
+def reconcile_positions():
+    """Check restored positions and orders a crash left in flight against the exchange before trading."""
+    for instrument in instruments.values():
+        instrument.orders.reconcile()
 
-        # Check if the pair data exists in the response
-        if 'result' in ohlc_data and pair in ohlc_data['result']:
-            # Kraken returns 8 columns in the OHLC data: timestamp, open, high, low, close, vwap, volume, count
-            data = pd.DataFrame(ohlc_data['result'][pair], columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count'
-            ])
-            data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
 
-            # Convert numeric columns to appropriate types
-            numeric_columns = ['open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
-            data[numeric_columns] = data[numeric_columns].apply(pd.to_numeric)
+def save_states():
+    for instrument in instruments.values():
+        instrument.save_state()
 
-            return data
-        else:
-            logging.error(f"No data found for pair {pair} or API error: {ohlc_data}")
-            return None
 
-    except Exception as e:
-        logging.error(f"Error fetching historical data for {pair} on {interval} interval: {e}")
-        return None
+def resync_instruments():
+    """Gateway connect callback: check the next candle of every pair for candles missed while disconnected."""
+    for instrument in instruments.values():
+        instrument.resync()
+
+
+def evaluate_instrument(pair):
+    """Evaluation pool callback: run the strategy for one pair."""
+    instruments[pair].evaluate()
 
 
 ## IMPORTANT VARIABLES 
-kraken = krakenex.API()
-client = get_client()
+# One Kraken client per account, shared by the pairs that trade through it
+clients = {
+    name: get_client(account['key'], account['secret'])
+    for name, account in config.ACCOUNTS.items()
+}
+# Cached balances per account, so sizing reads a local snapshot instead of calling Balance
+accounts = {name: AccountState(name, client) for name, client in clients.items()}
+# Local candle cache so restarts only fetch the gap since the last stored candle
+history = HistoryStore(config.HISTORY_DIR) if config.HISTORY_CACHE_ENABLED else None
+# Buffers are kept in shared memory for strategy processes, if enabled
+bus = (MarketDataBus(config.BUS_NAME, config.PAIRS, TIMEFRAMES, BUFFER_COLUMNS, config.REQUIRED_DATA_LENGTH,
+                     config.CANDLE_DTYPE) if config.BUS_NAME else None)
+instruments = {
+    pair: Instrument(pair, spec['rest'], clients[spec['account']], accounts[spec['account']], history, bus)
+    for pair, spec in config.PAIRS.items()
+}
+# Paper trading: each pair's market data drives the simulator of the account that trades it
+paper_exchanges = {pair: clients[spec['account']] for pair, spec in config.PAIRS.items()} if config.PAPER_TRADING else {}
+for pair, paper in paper_exchanges.items():
+    instrument = instruments[pair]
+    if instrument.book is not None:
+        paper.attach_book(instrument.rest_pair, instrument.book)
+    position = instrument.orders.position
+    if position is not None:
+        # A paper position restored from STATE_DIR has to be held by the fresh simulator to be sold
+        paper.deposit(split_pair(instrument.rest_pair)[0], position.quantity, position.entry_price)
+# Routes frames by channel name; heartbeats and OHLC candles are decoded without a JSON parse
+decoder = FrameDecoder(SUBSCRIBED_TIMEFRAMES, config.SUBSCRIBE_TRADES, config.BOOK_DEPTH)
+# Strategy evaluation runs on a worker pool instead of the WebSocket receive thread
+evaluator = CoalescingEvaluator(evaluate_instrument, workers=config.EVALUATION_WORKERS, name='strategy-evaluator')
+profiler = latency.SamplingProfiler() if config.PROFILER_ENABLED else None
+gateway = None  # Set once the event loop is running
+
+def collect_stats():
+    """Latency percentiles per stage, evaluator/gateway/account metrics and (if enabled) profiler hot spots."""
+    stats = {
+        'latency': latency.recorder.stats(),
+        'evaluator': evaluator.metrics(),
+        'accounts': {name: account.metrics() for name, account in accounts.items()},
+        'rule_hits': rules.active.hit_counts(),
+        'log': event_log.events.metrics(),
+        'positions': {pair: instrument.orders.metrics() for pair, instrument in instruments.items()
+                      if instrument.orders.position is not None},
+        'gaps': {pair: instrument.metrics() for pair, instrument in instruments.items() if instrument.gaps},
+        'memory_bytes': {pair: instrument.memory() for pair, instrument in instruments.items()},
+        'frames': decoder.metrics(),
+        'paper': {name: client.metrics() for name, client in clients.items()} if config.PAPER_TRADING else None,
+    }
+    if gateway is not None:
+        stats['gateway'] = gateway.metrics()
+    if profiler is not None:
+        stats['profile'] = profiler.report()
+    return stats
+
+async def log_stats():
+    """Periodically write the pipeline stats to the log."""
+    while True:
+        await asyncio.sleep(config.STATS_LOG_INTERVAL)
+        logging.info(f"Pipeline stats: {json.dumps(collect_stats())}")
+
+async def snapshot_states():
+    """Periodically snapshot every instrument, so a restart resumes without refetching history."""
+    while True:
+        await asyncio.sleep(config.SNAPSHOT_INTERVAL)
+        await asyncio.to_thread(save_states)
+
+async def refresh_balances():
+    """Keep every account's cached balances current in the background."""
+    while True:
+        for account in accounts.values():
+            await asyncio.to_thread(account.refresh)
+        await asyncio.sleep(config.BALANCE_REFRESH_INTERVAL)
+
+async def run_gateway():
+    """Stream market data on one event loop; REST calls from the evaluation pool are scheduled onto it."""
+    global gateway
+    gateway = KrakenGateway(config.WEBSOCKET_URL, handle_socket_message, market_subscriptions(), resync_instruments)
+    routed = {id(client): GatewayClient(gateway, client) for client in clients.values()}
+    for instrument in instruments.values():
+        instrument.set_client(routed[id(instrument.client)])
+    for account in accounts.values():
+        account.client = routed[id(account.client)]
+    tasks = [asyncio.create_task(log_stats()), asyncio.create_task(refresh_balances())]
+    if config.SNAPSHOT_INTERVAL:
+        tasks.append(asyncio.create_task(snapshot_states()))
+    try:
+        await gateway.run()
+    finally:
+        for task in tasks:
+            task.cancel()
 
 def main():
-    global ws, data_frame_1m, data_frame_5m, data_frame_1h
+    if config.PROFILER_ENABLED:
+        profiler.start()
+    if config.STATS_PORT:
+        latency.start_stats_server(config.STATS_PORT, collect_stats)
 
-    # Step 1: Fetch historical data
+    # Step 1: Restore snapshots or fetch historical data
     if not fetch_historical_data():
         logging.error("Failed to fetch historical data. Exiting.")
         return
-    
-    # Step 2: Set up WebSocket connection for real-time updates
-    ws = get_websocket_manager()
-    wst = threading.Thread(target=ws.run_forever)
-    wst.start()
 
-    time.sleep(3)  # Allow WebSocket connection to open
-    subscribe_to_ohlc()
+    # Step 2: Bring restored positions in line with the exchange
+    reconcile_positions()
 
-    # Step 3: Main loop to keep the WebSocket connection alive
-    while True:
-        time.sleep(1)
+    # Step 3: Stream real-time updates until interrupted; the gateway reconnects on its own
+    try:
+        asyncio.run(run_gateway())
+    except KeyboardInterrupt:
+        logging.info("Shutting down.")
+    finally:
+        evaluator.shutdown()
+        if config.SNAPSHOT_INTERVAL:
+            save_states()
+        if bus is not None:
+            bus.close()
+        event_log.events.stop()
 
 if __name__ == '__main__':
     main()